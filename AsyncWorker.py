@@ -1,9 +1,16 @@
 import asyncio
 import threading
 
+from TimerWheel import TimerWheel, TimerHandle
+
 class AsyncWorker:
-    def __init__(self):
+    def __init__(self, timer_wheel:TimerWheel|None=None):
         self.loop = asyncio.new_event_loop()
+        # Delayed and recurring actions. The loop only wakes up to advance the wheel when a timer is due
+        self.timers = timer_wheel or TimerWheel()
+        self._timers_lock = threading.Lock()
+        self._next_tick_at = None # Wheel clock time the loop wakes up at to advance the wheel, None if not armed
+        self._tick_handle = None # asyncio TimerHandle of that wake up, only used on the loop
         self.thread = threading.Thread(target=self._run_loop, daemon=True)
         self.thread.start()
 
@@ -14,6 +21,55 @@ class AsyncWorker:
     def run_task(self, coro):
         return asyncio.run_coroutine_threadsafe(coro, self.loop)
 
+    def time(self) -> float:
+        """
+        Current time of the timer clock, in seconds
+        """
+        return self.timers.time()
+
+    def call_later(self, delay:float, callback, *args) -> TimerHandle:
+        """
+        Run callback(*args) on the loop after delay seconds. Safe to call from any thread.
+        Returns a handle whose cancel() is O(1), eg when a newer MIDI action makes the timer obsolete.
+        """
+        return self._arm_timers(self.timers.call_later(delay, callback, *args))
+
+    def call_every(self, interval:float, callback, *args) -> TimerHandle:
+        """
+        Run callback(*args) on the loop every interval seconds, until the returned handle is cancelled.
+        """
+        return self._arm_timers(self.timers.call_every(interval, callback, *args))
+
+    def _arm_timers(self, handle:TimerHandle) -> TimerHandle:
+        deadline = handle.tick * self.timers.tick
+        with self._timers_lock:
+            # The loop already wakes up before this timer is due
+            if self._next_tick_at is not None and self._next_tick_at <= deadline:
+                return handle
+            self._next_tick_at = deadline
+        self.loop.call_soon_threadsafe(self._schedule_tick)
+        return handle
+
+    def _schedule_tick(self):
+        # Sleep until the earliest pending timer, instead of waking up every tick of the wheel
+        if self._tick_handle:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+        with self._timers_lock:
+            self._next_tick_at = self.timers.next_deadline()
+            if self._next_tick_at is None:
+                return
+            delay = max(0.0, self._next_tick_at - self.timers.time())
+        self._tick_handle = self.loop.call_later(delay, self._tick_timers)
+
+    def _tick_timers(self):
+        self._tick_handle = None
+        try:
+            self.timers.advance()
+        finally:
+            # Keep ticking even if advance raised, or no timer would ever fire again
+            self._schedule_tick()
+
 if __name__ == "__main__":
     # Example usage
     async_worker = AsyncWorker()
@@ -0,0 +1,66 @@
+# Schedule beat-aligned actions on the server's own clock, from tempo updates sent by the client
+
+import threading
+from typing import Callable
+
+from loguru import logger
+
+from AsyncWorker import AsyncWorker
+
+
+class BeatScheduler:
+    def __init__(self, async_worker:AsyncWorker, on_beat:Callable[[int], None]):
+        """
+        Args:
+            async_worker: AsyncWorker object whose timers fire the beats
+            on_beat: Callable run on every beat with the beat index, eg to pulse the GPIO light
+        """
+        self.async_worker = async_worker
+        self.on_beat = on_beat
+        self.muted = False # Beats keep being tracked, but on_beat is not called. Eg while recording
+        self.bpm = None
+        self.playing = False
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._timer = None
+
+    def update(self, bpm:float, playing:bool, phase_s:float) -> None:
+        """
+        Re-align beats to a tempo update. Safe to call from any thread, eg the OSC handler.
+        Args:
+            bpm: Float, tempo in beats per minute
+            playing: Bool, whether the transport is running
+            phase_s: Float, seconds elapsed since the last beat when the update was sent
+        """
+        now = self.async_worker.timers.time()
+        with self._lock:
+            self._generation += 1
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self.bpm = bpm
+            self.playing = bool(playing)
+            if not self.playing or bpm <= 0:
+                return
+            beat = 60.0 / bpm
+            next_beat = now - phase_s + beat
+            while next_beat < now:
+                next_beat += beat
+            self._schedule(self._generation, next_beat, beat, 0)
+        logger.info(f"Tempo {bpm:.2f} BPM, next beat in {next_beat - now:.3f}s")
+
+    def stop(self) -> None:
+        self.update(self.bpm or 0, False, 0)
+
+    def _schedule(self, generation:int, beat_time:float, beat:float, index:int) -> None:
+        delay = beat_time - self.async_worker.timers.time()
+        self._timer = self.async_worker.call_later(delay, self._beat, generation, beat_time, beat, index)
+
+    def _beat(self, generation:int, beat_time:float, beat:float, index:int) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return
+            # Next beat from the ideal beat time, not from now, so timer lateness does not accumulate
+            self._schedule(generation, beat_time + beat, beat, index + 1)
+        if not self.muted:
+            self.on_beat(index)
@@ -0,0 +1,97 @@
+# Per-device circuit breaker: after repeated failures, calls to the device fail instantly instead of
+# queueing behind calls that will never succeed. While open, a background probe checks whether the
+# device is back (half-open), and closes the breaker when it is.
+
+import time
+import threading
+from typing import Callable
+
+from loguru import logger
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+            self,
+            name:str,
+            failure_threshold:int=3,
+            reset_timeout:float=5.0,
+            clock:Callable[[], float]=time.monotonic,
+            ):
+        """
+        Args:
+            name: Str, name of the device, for logs and stats
+            failure_threshold: Int, consecutive failures after which the breaker opens
+            reset_timeout: Float, seconds to wait after opening before probing the device
+            clock: Callable returning the current time in seconds
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.successes = 0
+        self.rejected = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Whether a call can go through. Calls are rejected, and counted, while the breaker is open or probing.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def start_probe(self) -> bool:
+        """
+        Move an open breaker to half-open once reset_timeout has elapsed.
+        Returns True if the caller should probe the device now.
+        """
+        with self._lock:
+            if self.state != OPEN or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info(f"Circuit breaker for {self.name} closed, device is back")
+            self.state = CLOSED
+            self.opened_at = None
+
+    def record_failure(self) -> bool:
+        """
+        Returns True if this failure opened the breaker (or a probe failed and it opened again).
+        """
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    logger.warning(f"Circuit breaker for {self.name} opened after {self.consecutive_failures} failures")
+                self.state = OPEN
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failures": self.failures,
+                "successes": self.successes,
+                "rejected": self.rejected,
+                }
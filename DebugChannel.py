@@ -0,0 +1,270 @@
+# Debug control channel of the running server, over OSC next to the MIDI channel: start and stop a sampling
+# profiler, and read live counters and pending AsyncWorker tasks, without restarting the server and losing the lag
+# being investigated. Replies are sent back to the address and port the request came from, as one OSC message
+# holding a JSON string.
+# The profiler is a thread reading the stack of every thread at a fixed interval: nothing runs while it is off,
+# and while it is on the profiled code isn't instrumented, only interrupted once per interval.
+# Query a server with tests/send_debug_cmd.py. The channel has no access control: it is off unless server.py is
+# started with --debug_channel, eg on a trusted studio network while investigating a lag.
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import threading
+from collections import Counter
+
+from loguru import logger
+from pythonosc import osc_message
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from AsyncWorker import AsyncWorker
+
+
+DEBUG_CHANNEL = "/debug"
+REPLY_ADDRESS = "/debug/reply"
+PROFILE_INTERVAL_S = 0.005 # Time between two samples of the thread stacks
+MIN_PROFILE_INTERVAL_S = 0.001 # Shorter requested intervals are raised to this, a 0 interval would spin a core
+PROFILE_DIR = "."
+MAX_STACK_DEPTH = 64
+TOP_FUNCTIONS = 10 # Functions with the most samples, in the reply to /debug/profile/stop
+TASKS_TIMEOUT_S = 1.0 # Max time to wait for the AsyncWorker loop to list its tasks, eg when it is the one lagging
+
+
+class SamplingProfiler:
+    def __init__(self, interval:float=PROFILE_INTERVAL_S):
+        """
+        Sample the stacks of all the threads of the process, counted by stack
+        Args:
+            interval: Float, time in seconds between two samples
+        """
+        self.interval = interval
+        self.stacks = Counter() # Folded stack, eg "MainThread;server.py:midi_handler", -> samples
+        self.samples = 0
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.stacks[self._fold(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _fold(thread_name:str, frame) -> str:
+        functions = []
+        while frame is not None and len(functions) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            functions.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        functions.append(thread_name)
+        return ";".join(reversed(functions))
+
+    def top(self, n:int=TOP_FUNCTIONS) -> list:
+        """
+        Returns:
+            List of [function, share of the samples], of the n functions most often at the top of a stack
+        """
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [[function, round(count / total, 3)] for function, count in leaves.most_common(n)]
+
+    def dump(self, path:str) -> None:
+        """
+        Write the samples as folded stacks, one "thread;caller;callee count" line per stack, eg for flamegraph.pl
+        or speedscope
+        """
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class DebugChannel:
+    def __init__(self, async_worker:AsyncWorker, stats:dict|None=None, profile_dir:str=PROFILE_DIR):
+        """
+        Args:
+            async_worker: AsyncWorker object whose pending tasks and timers are reported
+            stats: Dict, name -> callable returning a JSON serializable dict of live counters,
+                    eg {"dispatcher": device_dispatcher.stats}
+            profile_dir: Str, directory the profiles are written to
+        """
+        self.async_worker = async_worker
+        self.stats = stats or {}
+        self.profile_dir = profile_dir
+        self.profiler = SamplingProfiler()
+        self._lock = threading.Lock() # Profile start and stop requests can arrive on several OSC handler threads
+        self._reply_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def map(self, dispatcher, channel:str=DEBUG_CHANNEL) -> None:
+        """
+        Map the debug addresses on an OSC dispatcher
+        Args:
+            dispatcher: pythonosc Dispatcher, eg the one of create_osc_dispatcher
+            channel: Str, prefix of the debug addresses, eg "/debug" for "/debug/stats"
+        """
+        handlers = {
+            "/profile/start": self.profile_start,
+            "/profile/stop": self.profile_stop,
+            "/stats": self.get_stats,
+            "/tasks": self.get_tasks,
+            }
+        for address, handler in handlers.items():
+            dispatcher.map(channel + address, self._handle, handler, needs_reply_address=True)
+
+    def _handle(self, client_address, address, args, *osc_args) -> None:
+        handler = args[0]
+        try:
+            reply = json.dumps({"request": address, **handler(*osc_args)}, default=str)
+            self._reply_sock.sendto(_build_message(REPLY_ADDRESS, reply), client_address)
+        except Exception as e:
+            # Eg a reply larger than a UDP datagram: the requester still gets an answer
+            logger.exception(f"Error handling {address}: {e}")
+            reply = json.dumps({"request": address, "error": str(e)})
+            self._reply_sock.sendto(_build_message(REPLY_ADDRESS, reply), client_address)
+
+    def profile_start(self, interval:float=PROFILE_INTERVAL_S) -> dict:
+        interval = max(float(interval), MIN_PROFILE_INTERVAL_S)
+        with self._lock:
+            self.profiler.interval = interval
+            self.profiler.start()
+        logger.info(f"Profiling every {interval * 1e3:.1f} ms")
+        return {"profiling": True, "interval_s": interval}
+
+    def profile_stop(self) -> dict:
+        """
+        Stop the profiler and write its samples to a file
+        Returns:
+            Dict with the path of the file, the number of samples and the functions seen most often
+        """
+        with self._lock:
+            if not self.profiler.running:
+                return {"profiling": False, "error": "profiler not running"}
+            self.profiler.stop()
+            duration = time.monotonic() - self.profiler.started_at
+            path = os.path.join(self.profile_dir, f"profile_{time.strftime('%Y%m%d_%H%M%S')}.folded")
+            self.profiler.dump(path)
+            reply = {
+                "profiling": False,
+                "path": os.path.abspath(path),
+                "duration_s": round(duration, 3),
+                "samples": self.profiler.samples,
+                "top": self.profiler.top(),
+                }
+        logger.info(f"Wrote {reply['samples']} samples to {path}")
+        return reply
+
+    def get_stats(self) -> dict:
+        return {name: stats() for name, stats in self.stats.items()}
+
+    def get_tasks(self) -> dict:
+        """
+        Returns:
+            Dict with the tasks pending on the AsyncWorker loop, and where they are waiting, and its number of timers
+        """
+        tic = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(_pending_tasks(), self.async_worker.loop)
+        tasks = future.result(timeout=TASKS_TIMEOUT_S)
+        return {
+            "tasks": tasks,
+            "timers": len(self.async_worker.timers),
+            "loop_lag_ms": round((time.monotonic() - tic) * 1e3, 2), # Time for the loop to run the listing
+            }
+
+
+def _build_message(address:str, *args) -> bytes:
+    builder = OscMessageBuilder(address=address)
+    for arg in args:
+        builder.add_arg(arg)
+    return builder.build().dgram
+
+
+async def _pending_tasks() -> list:
+    tasks = []
+    for task in asyncio.all_tasks():
+        if task is asyncio.current_task():
+            continue
+        stack = task.get_stack(limit=1)
+        where = f"{os.path.basename(stack[0].f_code.co_filename)}:{stack[0].f_lineno}" if stack else None
+        tasks.append({"name": task.get_name(), "coro": task.get_coro().__qualname__, "at": where})
+    return tasks
+
+
+def debug_request(host:str, port:int, address:str, *args, timeout:float=5.0) -> dict:
+    """
+    Send a debug request to a server and wait for its reply
+    Args:
+        host: Str, IP address of the server
+        port: Int, port the server listens on
+        address: Str, debug address, eg "/debug/stats"
+        args: Arguments of the request, eg the sampling interval of "/debug/profile/start"
+        timeout: Float, max time in seconds to wait for the reply
+    Returns:
+        Dict, the reply
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(_build_message(address, *args), (host, port))
+        data = sock.recv(65535)
+    return json.loads(osc_message.OscMessage(data).params[0])
+
+
+def time_profiler_overhead(n:int=50000, interval:float=PROFILE_INTERVAL_S) -> None:
+    """
+    Time handling n MIDI messages on an inline light, with the profiler off and on
+    """
+    import server
+    from DeviceDispatcher import DeviceDispatcher
+    from devices.DummyLightController import DummyLightController
+    logger.disable("server")
+    process = server.create_midi_table(
+            server.DEFAULT_SERVER_CONFIG,
+            {},
+            DeviceDispatcher(AsyncWorker()),
+            light_controller=DummyLightController(server.GPIO_PIN),
+            )
+    messages = [[144, 25, 127], [16, 106, 127], [16, 105, 127], [144, 25, 0]]
+    profiler = SamplingProfiler(interval)
+    for profiling in (False, True):
+        if profiling:
+            profiler.start()
+        tic = time.perf_counter()
+        for i in range(n):
+            process(messages[i % len(messages)])
+        elapsed = time.perf_counter() - tic
+        profiler.stop()
+        print(f"Profiler {'on' if profiling else 'off'}: {elapsed / n * 1e6:.2f} us/message")
+    print(f"{profiler.samples} samples, {len(profiler.stacks)} stacks")
+
+
+if __name__ == "__main__":
+    time_profiler_overhead()
@@ -0,0 +1,365 @@
+# Routes device commands either inline (non-blocking devices such as a GPIO pin) or onto the AsyncWorker loop
+
+import asyncio
+import threading
+import statistics
+from collections import deque
+from concurrent.futures import Future
+
+from loguru import logger
+
+from AsyncWorker import AsyncWorker
+from CircuitBreaker import CircuitBreaker
+from LatencyStats import percentile
+from devices.LightController import LightController
+from devices.DirigeraAsyncClient import critical_request
+import EventJournal as ej
+from StateStore import StateStore
+
+
+DEVICE_TIMEOUT_S = 2.0 # Deadline for a whole device action, eg the 3 hub requests of a color change
+FAILURE_THRESHOLD = 3 # Consecutive failures before a device's circuit breaker opens
+RESET_TIMEOUT_S = 5.0 # Time an open breaker waits before probing the device again
+LATENCY_SAMPLES = 1000 # Latencies kept per lane for stats
+
+# Priority lanes. Critical commands (eg the recording light, RECORD_START/STOP) always run ahead of
+# best-effort ones (eg ambience plugs), and supersede the best-effort commands still queued for their device
+CRITICAL = 0
+BEST_EFFORT = 1
+LANE_NAMES = {CRITICAL: "critical", BEST_EFFORT: "best_effort"}
+SHARED_QUEUE = "shared" # Queue key of the controllers passed to DeviceDispatcher.share_queue
+
+
+class Command:
+    __slots__ = ("controller", "action", "kwargs", "deadline", "priority", "created_at", "future")
+
+    def __init__(
+            self,
+            controller:LightController,
+            action:str,
+            kwargs:dict,
+            deadline:float|None=None,
+            priority:int=BEST_EFFORT,
+            created_at:float=0.0,
+            ):
+        """
+        Args:
+            controller: LightController object the command is for
+            action: Str, name of the controller method, eg "turn_on"
+            kwargs: Dict, keyword arguments passed to the controller method
+            deadline: Float, time (AsyncWorker clock) after which the command is stale and dropped. None to never drop
+            priority: Int, lane of the command: CRITICAL or BEST_EFFORT
+            created_at: Float, time (AsyncWorker clock) the command was dispatched, for lane latency stats
+        """
+        self.controller = controller
+        self.action = action
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.priority = priority
+        self.created_at = created_at
+        self.future = Future()
+
+
+class _DeviceQueue:
+    __slots__ = ("lanes", "running")
+
+    def __init__(self):
+        self.lanes = {CRITICAL: deque(), BEST_EFFORT: deque()}
+        self.running = False
+
+
+class DeviceDispatcher:
+    def __init__(
+            self,
+            async_worker:AsyncWorker,
+            timeout:float=DEVICE_TIMEOUT_S,
+            failure_threshold:int=FAILURE_THRESHOLD,
+            reset_timeout:float=RESET_TIMEOUT_S,
+            journal:ej.EventJournal|None=None,
+            state_store:StateStore|None=None,
+            ):
+        """
+        Args:
+            async_worker: AsyncWorker object to run blocking device calls on
+            timeout: Float, deadline in seconds for each blocking device action
+            failure_threshold: Int, consecutive failures before a device's calls fail fast
+            reset_timeout: Float, seconds before a failing device is probed in the background
+            journal: EventJournal object recording the outcome and latency of every device action
+            state_store: StateStore object keeping the last command dispatched to, and confirmed by, each blocking
+                      device, to restore them after a restart
+        """
+        self.async_worker = async_worker
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.journal = journal
+        self.state_store = state_store
+        self.breakers = {} # id(controller) -> CircuitBreaker, for blocking controllers
+        self.stale_dropped = {} # Device name -> number of commands dropped because their deadline passed
+        self.superseded = {} # Device name -> number of best-effort commands dropped for a newer critical one
+        self.lane_latencies = {lane: deque(maxlen=LATENCY_SAMPLES) for lane in LANE_NAMES}
+        self._device_queues = {} # Queue key -> _DeviceQueue: commands to a device run one at a time
+        self._queue_keys = {} # id(controller) -> key of a queue shared with other controllers, see share_queue
+        # id(controller) -> (TimerHandle, kwargs) of the delayed action for that controller. Changed from the OSC handler
+        # threads and the loop: the kwargs dict, new on every call, tells a firing timer whether it's still the pending one
+        self._pending_timers = {}
+        self._pending_timers_lock = threading.Lock()
+
+    def dispatch(
+            self,
+            controller:LightController,
+            action:str,
+            deadline:float|None=None,
+            priority:int=BEST_EFFORT,
+            **kwargs,
+            ) -> Future | None:
+        """
+        Run an action on a device controller.
+        Non-blocking controllers run the action right away in the calling thread (eg the OSC handler),
+        which avoids an event loop + thread pool hop for a microsecond pin write.
+        Blocking controllers run the async version of the action on the AsyncWorker loop, with a timeout,
+        one command at a time per device, critical commands first. Their calls fail fast while their
+        circuit breaker is open.
+        Args:
+            controller: LightController object, eg GPIOLightController or DirigeraLightController
+            action: Str, name of the controller method, eg "turn_on" or "turn_off"
+            deadline: Float, time (AsyncWorker clock) after which the command is dropped if it hasn't reached
+                      the device yet, eg stuck behind a slow hub. None to never drop it
+            priority: Int, CRITICAL or BEST_EFFORT lane
+            kwargs: Keyword arguments passed to the controller method, eg hex_color
+        Returns:
+            Future of the action running on the AsyncWorker loop, None if it ran inline or was rejected
+        """
+        if controller is None:
+            return None
+
+        # A newer action on this controller, or on a scene setting its device, makes its delayed action obsolete
+        with self._pending_timers_lock:
+            pending_timers = [self._pending_timers.pop(id(device), None) for device in {controller, *controller.devices}]
+        for pending_timer in pending_timers:
+            if pending_timer:
+                pending_timer[0].cancel()
+        return self._dispatch(controller, action, deadline, priority, kwargs)
+
+    def _dispatch(self, controller:LightController, action:str, deadline:float|None, priority:int, kwargs:dict) -> Future | None:
+        if not controller.is_blocking:
+            tic = self.async_worker.time()
+            outcome = ej.OK
+            try:
+                getattr(controller, action)(**kwargs)
+            except Exception as e:
+                outcome = ej.FAILED
+                logger.exception(f"Error running {action} on {controller.name}: {e}")
+            latency = self.async_worker.time() - tic
+            self.lane_latencies[priority].append(latency)
+            self._journal(controller, action, outcome, latency)
+            return None
+
+        if self.state_store:
+            self.state_store.set_desired(controller.name, action, kwargs)
+        breaker = self.breaker(controller)
+        if not breaker.allow():
+            logger.debug("Circuit breaker open for {}, dropping {}", controller.name, action)
+            self._journal(controller, action, ej.REJECTED)
+            return None
+
+        command = Command(controller, action, kwargs, deadline, priority, self.async_worker.time())
+        self.async_worker.loop.call_soon_threadsafe(self._enqueue, command)
+        return command.future
+
+    def breaker(self, controller:LightController) -> CircuitBreaker:
+        breaker = self.breakers.get(id(controller))
+        if breaker is None:
+            breaker = self.breakers.setdefault(
+                    id(controller),
+                    CircuitBreaker(
+                        controller.name,
+                        failure_threshold=self.failure_threshold,
+                        reset_timeout=self.reset_timeout,
+                        clock=self.async_worker.time,
+                        ),
+                    )
+        return breaker
+
+    def stats(self) -> dict:
+        """
+        Circuit breaker state, failure counts and commands dropped, per device
+        """
+        return {
+            breaker.name: {
+                **breaker.stats(),
+                "stale_dropped": self.stale_dropped.get(breaker.name, 0),
+                "superseded": self.superseded.get(breaker.name, 0),
+                }
+            for breaker in list(self.breakers.values())
+            }
+
+    def lane_stats(self) -> dict:
+        """
+        Latency from dispatch to completion per priority lane, in milliseconds
+        """
+        stats = {}
+        for lane, name in LANE_NAMES.items():
+            latencies = sorted(self.lane_latencies[lane])
+            if not latencies:
+                stats[name] = {"count": 0}
+                continue
+            stats[name] = {
+                "count": len(latencies),
+                "p50_ms": statistics.median(latencies) * 1e3,
+                "p99_ms": percentile(latencies, 0.99) * 1e3,
+                "max_ms": latencies[-1] * 1e3,
+                }
+        return stats
+
+    def share_queue(self, controllers:list[LightController]) -> None:
+        """
+        Run the commands of these controllers on one queue, one at a time in dispatch order, instead of one queue
+        per controller. Eg hub scenes and the devices they set: a slow scene trigger can't be overtaken by a newer
+        device command, nor the other way round. Replaces the controllers sharing the queue before
+        Args:
+            controllers: List of LightController objects, None entries are ignored. Empty to stop sharing
+        """
+        # Swapped whole: the loop reads it without a lock
+        self._queue_keys = {id(controller): SHARED_QUEUE for controller in controllers if controller}
+
+    def _enqueue(self, command:Command) -> None:
+        controller = command.controller
+        key = self._queue_keys.get(id(controller), id(controller))
+        device_queue = self._device_queues.get(key)
+        if device_queue is None:
+            device_queue = self._device_queues[key] = _DeviceQueue()
+
+        if command.priority == CRITICAL:
+            # Queued best-effort commands setting the same devices are older: running them after this one would
+            # overwrite it. On a shared queue, eg a scene superseding the commands to its devices, and the other way round
+            best_effort = device_queue.lanes[BEST_EFFORT]
+            devices = {id(device) for device in controller.devices}
+            superseded = [
+                    queued for queued in best_effort
+                    if queued.controller is controller or not devices.isdisjoint(id(device) for device in queued.controller.devices)
+                    ]
+            for superseded_command in superseded:
+                name = superseded_command.controller.name
+                self.superseded[name] = self.superseded.get(name, 0) + 1
+                best_effort.remove(superseded_command)
+                self._journal_command(superseded_command, ej.SUPERSEDED)
+                superseded_command.future.set_result(None)
+
+        device_queue.lanes[command.priority].append(command)
+        if not device_queue.running:
+            device_queue.running = True
+            self.async_worker.loop.create_task(self._drain(device_queue))
+
+    async def _drain(self, device_queue:_DeviceQueue) -> None:
+        try:
+            while True:
+                lane = next((lane for lane in (CRITICAL, BEST_EFFORT) if device_queue.lanes[lane]), None)
+                if lane is None:
+                    return
+                command = device_queue.lanes[lane].popleft()
+                await self._run_command(command, self.breaker(command.controller))
+        finally:
+            device_queue.running = False
+
+    async def _run_command(self, command:Command, breaker:CircuitBreaker) -> None:
+        controller = command.controller
+        if command.deadline is not None and self.async_worker.time() > command.deadline:
+            self.stale_dropped[controller.name] = self.stale_dropped.get(controller.name, 0) + 1
+            logger.warning(f"Dropping stale {command.action} on {controller.name}, {self.async_worker.time() - command.deadline:.2f}s past its deadline")
+            self._journal_command(command, ej.STALE)
+            command.future.set_result(None)
+            return
+
+        # Lets the hub client keep connections free for critical requests
+        token = critical_request.set(command.priority == CRITICAL)
+        outcome = ej.OK
+        try:
+            async with asyncio.timeout(self.timeout):
+                await getattr(controller, f"async_{command.action}")(**command.kwargs)
+        except Exception as e:
+            outcome = ej.TIMEOUT if isinstance(e, TimeoutError) else ej.FAILED
+            logger.warning(f"{command.action} on {controller.name} failed: {type(e).__name__} {e}")
+            if breaker.record_failure():
+                self.async_worker.call_later(self.reset_timeout, self._probe, controller, breaker)
+        else:
+            breaker.record_success()
+            if self.state_store:
+                self.state_store.set_confirmed(controller.name, command.action, command.kwargs)
+        finally:
+            critical_request.reset(token)
+            self.lane_latencies[command.priority].append(self.async_worker.time() - command.created_at)
+            self._journal_command(command, outcome)
+            command.future.set_result(None)
+
+    def _journal(self, controller:LightController, action:str, outcome:int, latency:float=0.0) -> None:
+        if self.journal:
+            self.journal.record(ej.DEVICE, action, outcome, latency, device=controller.name)
+
+    def _journal_command(self, command:Command, outcome:int) -> None:
+        self._journal(command.controller, command.action, outcome, self.async_worker.time() - command.created_at)
+
+    def _probe(self, controller:LightController, breaker:CircuitBreaker) -> None:
+        if breaker.start_probe():
+            self.async_worker.run_task(self._run_probe(controller, breaker))
+
+    async def _run_probe(self, controller:LightController, breaker:CircuitBreaker) -> None:
+        try:
+            async with asyncio.timeout(self.timeout):
+                await controller.async_probe()
+        except Exception as e:
+            logger.debug(f"Probe of {controller.name} failed: {type(e).__name__} {e}")
+            breaker.record_failure()
+            self.async_worker.call_later(self.reset_timeout, self._probe, controller, breaker)
+        else:
+            breaker.record_success()
+
+    def dispatch_later(self, delay:float, controller:LightController, action:str, **kwargs) -> None:
+        """
+        Run an action on a device controller after delay seconds, eg dim the lights 30 s after stop, for the delayed
+        scenes of the config. The delayed action is cancelled if another action is dispatched to the same controller,
+        or to a scene setting its device, in the meantime.
+        Args:
+            delay: Float, delay in seconds
+            controller: LightController object
+            action: Str, name of the controller method, eg "turn_off"
+            kwargs: Keyword arguments passed to the controller method
+        """
+        if controller is None:
+            return
+
+        key = id(controller)
+        with self._pending_timers_lock:
+            pending_timer = self._pending_timers.pop(key, None)
+            if pending_timer:
+                pending_timer[0].cancel()
+            handle = self.async_worker.call_later(
+                    delay,
+                    self._run_delayed,
+                    key,
+                    controller,
+                    action,
+                    kwargs,
+                    )
+            self._pending_timers[key] = (handle, kwargs)
+
+    def _run_delayed(self, key:int, controller:LightController, action:str, kwargs:dict) -> None:
+        with self._pending_timers_lock:
+            # Cancelled too late to stop it firing, by a newer action on the controller: that one wins
+            pending_timer = self._pending_timers.get(key)
+            if not (pending_timer and pending_timer[1] is kwargs):
+                return
+            del self._pending_timers[key]
+        self._dispatch(controller, action, None, BEST_EFFORT, kwargs)
+
+    def turn_on(
+            self,
+            controller:LightController,
+            deadline:float|None=None,
+            priority:int=BEST_EFFORT,
+            **kwargs,
+            ) -> Future | None:
+        return self.dispatch(controller, "turn_on", deadline=deadline, priority=priority, **kwargs)
+
+    def turn_off(self, controller:LightController, deadline:float|None=None, priority:int=BEST_EFFORT) -> Future | None:
+        return self.dispatch(controller, "turn_off", deadline=deadline, priority=priority)
@@ -0,0 +1,278 @@
+# Append-only journal of every MIDI event received and device action run by the server, to inspect a session
+# afterwards. Fixed-width records in a memory-mapped ring file: writing a record is a struct.pack_into in memory,
+# no syscall, and the oldest records are overwritten once the file is full.
+# Read it offline with: python EventJournal.py journal.bin --kind device --outcome failed
+
+import os
+import mmap
+import time
+import struct
+import argparse
+import itertools
+from collections import namedtuple
+from datetime import datetime
+
+from loguru import logger
+
+
+JOURNAL_CAPACITY = 65536 # Records kept, 6 MiB
+MAGIC = b"MIDIJRNL"
+VERSION = 2
+HEADER = struct.Struct("<8sHHI") # Magic, version, record size, capacity
+HEADER_SIZE = 64
+# Sequence number (0: empty slot), wall clock timestamp, kind, MIDI status, data1, data2, action, outcome,
+# latency in microseconds, source, eg "192.168.100.12:57120", device. 96 bytes
+RECORD = struct.Struct("<QdBBBBBBI32s38s")
+
+# Kinds
+MIDI = 0
+DEVICE = 1
+KINDS = ("midi", "device")
+
+# Outcomes
+RECEIVED = 0 # MIDI event received
+OK = 1
+FAILED = 2
+TIMEOUT = 3
+STALE = 4 # Dropped, past its deadline
+REJECTED = 5 # Dropped, circuit breaker open
+SUPERSEDED = 6 # Dropped, replaced by a critical command
+OUTCOMES = ("received", "ok", "failed", "timeout", "stale", "rejected", "superseded")
+
+# Action codes, stored in the journals: never change or reorder them, append new actions at the end.
+# 0 is no action, then MidiActions values and device actions. Unknown actions are "other"
+ACTIONS = (
+    None,
+    "record_start",
+    "record_stop",
+    "play",
+    "stop",
+    "track_left",
+    "track_right",
+    "snare_on",
+    "snare_off",
+    "all_notes_off",
+    "reset_all",
+    "unknown",
+    "turn_on",
+    "turn_off",
+    "set_level",
+    "other",
+    )
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+OTHER_ACTION = ACTION_CODES["other"]
+
+JournalEntry = namedtuple(
+        "JournalEntry",
+        ["seq", "timestamp", "kind", "midi_data", "action", "outcome", "latency", "source", "device"],
+        )
+
+
+class EventJournal:
+    def __init__(self, path:str, capacity:int=JOURNAL_CAPACITY):
+        """
+        Open or create a journal file. An existing journal is appended to, after its last record. One written by
+        another version is moved to path + ".old" and a new journal is started
+        Args:
+            path: Str, path of the journal file
+            capacity: Int, number of records kept, for a new journal. Existing journals keep their capacity
+        """
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE
+        if not new:
+            with open(path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            try:
+                read_header(header)
+            except ValueError as e:
+                logger.warning(f"{e}, moving {path} to {path}.old")
+                os.replace(path, path + ".old")
+                new = True
+        with open(path, "a+b") as f:
+            if new:
+                f.truncate(HEADER_SIZE + capacity * RECORD.size)
+            self._mm = mmap.mmap(f.fileno(), 0)
+        if new:
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD.size, capacity)
+        self.capacity = read_header(self._mm)
+        last_seq = max((entry_seq(self._mm, slot) for slot in range(self.capacity)), default=0)
+        # next() on itertools.count is atomic: concurrent handlers each get their own slot, without a lock
+        self._seq = itertools.count(last_seq + 1)
+        self._names = {} # Name -> encoded name, so that recording doesn't encode it every time
+        self._pack_into = RECORD.pack_into
+
+    def record(
+            self,
+            kind:int,
+            action:str|None=None,
+            outcome:int=RECEIVED,
+            latency:float=0.0,
+            source:str="",
+            device:str="",
+            midi_data:list|None=None,
+            timestamp:float|None=None,
+            ) -> None:
+        """
+        Append a record. Safe to call from any thread. Does nothing once the journal is closed
+        Args:
+            kind: Int, MIDI or DEVICE
+            action: Str, MidiActions value or device action, eg "turn_on"
+            outcome: Int, eg RECEIVED, OK or FAILED
+            latency: Float, seconds from receiving the event to the outcome
+            source: Str, where the event came from, eg the OSC client address. Truncated to 32 bytes
+            device: Str, device name. Truncated to 38 bytes
+            midi_data: List, [status, data1, data2]
+            timestamp: Float, time.time() of the event. Defaults to now
+        """
+        if self._mm.closed:
+            # Eg a device command finishing after shutdown closed the journal
+            return
+        seq = next(self._seq)
+        status, data1, data2 = midi_data if midi_data else (0, 0, 0)
+        self._pack_into(
+                self._mm,
+                HEADER_SIZE + (seq % self.capacity) * RECORD.size,
+                seq,
+                timestamp or time.time(),
+                kind,
+                status,
+                data1,
+                data2,
+                ACTION_CODES.get(action, OTHER_ACTION),
+                outcome,
+                min(int(latency * 1e6), 0xFFFFFFFF),
+                self._encode(source),
+                self._encode(device),
+                )
+
+    def _encode(self, name:str) -> bytes:
+        encoded = self._names.get(name)
+        if encoded is None:
+            encoded = self._names[name] = name.encode()
+        return encoded
+
+    def flush(self) -> None:
+        """
+        Write the journal to disk now, eg before shutting down. Otherwise the kernel writes it back on its own
+        """
+        self._mm.flush()
+
+    def close(self) -> None:
+        if self._mm.closed:
+            return
+        self._mm.flush()
+        self._mm.close()
+
+
+def read_header(buffer) -> int:
+    magic, version, record_size, capacity = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"Not a version {VERSION} event journal")
+    return capacity
+
+def entry_seq(buffer, slot:int) -> int:
+    return struct.unpack_from("<Q", buffer, HEADER_SIZE + slot * RECORD.size)[0]
+
+def read_journal(path:str) -> list[JournalEntry]:
+    """
+    Decode all the records of a journal file, oldest first
+    Args:
+        path: Str, path of the journal file
+    Returns:
+        List of JournalEntry
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    capacity = read_header(data)
+    entries = []
+    for slot in range(capacity):
+        seq, timestamp, kind, status, data1, data2, action, outcome, latency_us, source, device = RECORD.unpack_from(
+                data,
+                HEADER_SIZE + slot * RECORD.size,
+                )
+        if seq == 0:
+            continue
+        entries.append(JournalEntry(
+            seq,
+            timestamp,
+            KINDS[kind],
+            [status, data1, data2],
+            ACTIONS[action] if action < len(ACTIONS) else "other",
+            OUTCOMES[outcome] if outcome < len(OUTCOMES) else str(outcome),
+            latency_us / 1e6,
+            source.rstrip(b"\0").decode(errors="replace"),
+            device.rstrip(b"\0").decode(errors="replace"),
+            ))
+    entries.sort(key=lambda entry: entry.seq)
+    return entries
+
+def filter_entries(
+        entries:list[JournalEntry],
+        kind:str|None=None,
+        action:str|None=None,
+        outcome:str|None=None,
+        device:str|None=None,
+        since:float|None=None,
+        until:float|None=None,
+        ) -> list[JournalEntry]:
+    """
+    Keep the entries matching all the given filters. None matches everything
+    """
+    return [
+        entry for entry in entries
+        if (kind is None or entry.kind == kind)
+        and (action is None or entry.action == action)
+        and (outcome is None or entry.outcome == outcome)
+        and (device is None or device in entry.device)
+        and (since is None or entry.timestamp >= since)
+        and (until is None or entry.timestamp <= until)
+        ]
+
+def format_entry(entry:JournalEntry) -> str:
+    timestamp = datetime.fromtimestamp(entry.timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    line = f"{entry.seq:>8} {timestamp} {entry.kind:<6} {entry.outcome:<10} {entry.action or '-':<14}"
+    if entry.kind == "midi":
+        return f"{line} {entry.midi_data} from {entry.source}"
+    return f"{line} {entry.device} {entry.latency * 1e3:.1f} ms"
+
+
+def time_journal(path:str, n:int=100000) -> None:
+    """
+    Time recording n events in the journal, against appending each one to a regular file
+    """
+    journal = EventJournal(path)
+    midi_data = [144, 38, 100]
+    tic = time.perf_counter()
+    for _ in range(n):
+        journal.record(MIDI, "snare_on", source="192.168.1.20", midi_data=midi_data)
+    journal_s = time.perf_counter() - tic
+    journal.close()
+
+    with open(path + ".log", "ab", buffering=0) as f:
+        tic = time.perf_counter()
+        for _ in range(n):
+            f.write(RECORD.pack(1, time.time(), MIDI, *midi_data, 1, 0, 0, b"192.168.1.20", b""))
+        file_s = time.perf_counter() - tic
+    os.remove(path + ".log")
+    print(f"mmap journal:      {journal_s / n * 1e6:.2f} us/event")
+    print(f"unbuffered write:  {file_s / n * 1e6:.2f} us/event")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode and filter an event journal")
+    parser.add_argument("path", help="Path of the journal file")
+    parser.add_argument("--kind", choices=KINDS, help="Only MIDI events or device actions")
+    parser.add_argument("--action", help="Only this action, eg record_start or turn_on")
+    parser.add_argument("--outcome", choices=OUTCOMES, help="Only this outcome, eg failed")
+    parser.add_argument("--device", help="Only devices whose name contains this")
+    parser.add_argument("--last", type=float, help="Only the last this many seconds of the journal")
+    parser.add_argument("--benchmark", action="store_true", help="Time writing to a journal at path instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        time_journal(args.path)
+    else:
+        entries = read_journal(args.path)
+        since = entries[-1].timestamp - args.last if entries and args.last else None
+        for entry in filter_entries(entries, args.kind, args.action, args.outcome, args.device, since):
+            print(format_entry(entry))
@@ -0,0 +1,16 @@
+# Percentiles of latency samples, for the stats of the server and the timing comparisons of its modules
+
+import math
+
+
+def percentile(sorted_values:list, fraction:float) -> float:
+    """
+    Nearest-rank percentile: the smallest sample with at least this fraction of the samples at or below it.
+    Eg the 99th percentile of 10 samples is the largest one, not the 9th
+    Args:
+        sorted_values: List of samples, sorted in increasing order, not empty
+        fraction: Float, from 0 (excluded) to 1, eg 0.99 for the 99th percentile
+    Returns:
+        The sample at that percentile
+    """
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
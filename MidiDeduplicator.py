@@ -0,0 +1,54 @@
+# Suppress the same MIDI action arriving from a second MIDI source, eg pressing record on the keyboard
+# sends a controller message, and Logic then sends its own recording light message for the same action
+
+import time
+import threading
+
+import midi_states as ms
+
+
+DEDUP_WINDOW_S = 0.3 # Same action from another source within this window is a duplicate
+
+
+class MidiDeduplicator:
+    def __init__(self, window:float=DEDUP_WINDOW_S, clock=time.monotonic):
+        """
+        Args:
+            window: Float, seconds after an action during which the same action from a different source is suppressed
+            clock: Callable returning the current time in seconds
+        """
+        self.window = window
+        self.clock = clock
+        self.suppressed = {} # MidiActions -> number of duplicates suppressed
+        self._last_seen = {} # MidiActions -> (source, time) of the last action let through
+        self._lock = threading.Lock() # Each MIDI port calls back from its own thread
+
+    def accept(self, midi_action:ms.MidiActions|None, source:str, timestamp:float|None=None) -> bool:
+        """
+        Check whether an action should be handled, or is a duplicate from another source.
+        Repeats from the same source, and other actions, are always let through.
+        Args:
+            midi_action: MidiActions enum of the message, None for messages not mapped to an action, eg notes
+            source: Str, name of the MIDI source the message came from
+            timestamp: Float, time the message was received. Defaults to clock()
+        Returns:
+            Bool, False if the message is a duplicate and should be dropped
+        """
+        if midi_action is None:
+            return True
+        if timestamp is None:
+            timestamp = self.clock()
+
+        with self._lock:
+            last_seen = self._last_seen.get(midi_action)
+            if last_seen is not None:
+                last_source, last_time = last_seen
+                if last_source != source and timestamp - last_time <= self.window:
+                    self.suppressed[midi_action] = self.suppressed.get(midi_action, 0) + 1
+                    return False
+            self._last_seen[midi_action] = (source, timestamp)
+        return True
+
+    @property
+    def suppressed_total(self) -> int:
+        return sum(self.suppressed.values())
@@ -0,0 +1,111 @@
+# Watch for MIDI ports appearing and disappearing, eg the keyboard plugged in after the client started,
+# and open/close the matching MIDI inputs on the fly, without restarting the client
+
+import threading
+
+from loguru import logger
+
+
+POLL_INTERVAL_S = 1.0 # Time between two port enumerations
+
+
+class MidiPortWatcher:
+    def __init__(
+            self,
+            sources:list[str],
+            list_ports,
+            open_port,
+            close_port,
+            poll_interval:float=POLL_INTERVAL_S,
+            ):
+        """
+        Args:
+            sources: List of str, MIDI sources to keep open. A port is a match if its name contains the source
+            list_ports: Callable returning the list of port names, eg rtmidi.MidiIn().get_ports
+            open_port: Callable(index, port_name, source) opening a port and returning a handle, eg a MidiIn
+            close_port: Callable(handle) closing a port opened by open_port
+            poll_interval: Float, time in seconds between two port enumerations
+        """
+        self.sources = sources
+        self.list_ports = list_ports
+        self.open_port = open_port
+        self.close_port = close_port
+        self.poll_interval = poll_interval
+        self.opened = {} # Source -> (port name, handle)
+        self.reconnects = 0 # Ports opened again after having been closed
+        self._seen = set() # Sources opened at least once
+        self._last_ports = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def scan(self) -> None:
+        """
+        Enumerate ports once, close the ones that went away and open the ones that appeared.
+        Does nothing if the port list didn't change since the last scan
+        """
+        try:
+            ports = list(self.list_ports())
+        except Exception as e:
+            logger.warning(f"Could not list MIDI ports: {type(e).__name__} {e}")
+            return
+        if ports == self._last_ports:
+            return
+        self._last_ports = ports
+
+        for source, (port_name, handle) in list(self.opened.items()):
+            if port_name not in ports:
+                logger.warning(f"MIDI port {port_name} disappeared, closing it")
+                del self.opened[source]
+                try:
+                    self.close_port(handle)
+                except Exception as e:
+                    logger.debug(f"Error closing MIDI port {port_name}: {type(e).__name__} {e}")
+
+        for source in self.sources:
+            if source in self.opened:
+                continue
+            index = next((index for index, port_name in enumerate(ports) if source in port_name), None)
+            if index is None:
+                continue
+            try:
+                handle = self.open_port(index, ports[index], source)
+            except Exception as e:
+                # Eg the port went away between listing and opening it. Retried on the next change
+                logger.warning(f"Could not open MIDI port {ports[index]}: {type(e).__name__} {e}")
+                self._last_ports = None
+                continue
+            self.opened[source] = (ports[index], handle)
+            if source in self._seen:
+                self.reconnects += 1
+            self._seen.add(source)
+            logger.info(f"Opened MIDI port {ports[index]}")
+
+    def missing(self) -> list[str]:
+        """
+        Sources without an open port
+        """
+        return [source for source in self.sources if source not in self.opened]
+
+    def start(self) -> "MidiPortWatcher":
+        """
+        Scan right away, then keep scanning in a background thread
+        """
+        self.scan()
+        self._thread = threading.Thread(target=self._run, name="MidiPortWatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop watching and close all open ports
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for source, (port_name, handle) in list(self.opened.items()):
+            del self.opened[source]
+            self.close_port(handle)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.scan()
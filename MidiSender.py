@@ -0,0 +1,243 @@
+# Hand MIDI messages off from rtmidi callbacks to a single sender thread.
+# Callbacks only push (midi_data, timestamp, source) into a preallocated ring buffer, per source.
+# The sender thread merges the rings in timestamp order, and hands batches to a handler that classifies,
+# filters and transmits them: callbacks take microseconds, and the OSC client is only used from one thread.
+
+import time
+import threading
+
+from loguru import logger
+
+
+RING_CAPACITY = 1024 # Messages buffered per source, power of 2
+MAX_BATCH = 64 # Max messages handed to the handler at once
+IDLE_WAIT_S = 0.5 # Max time the sender thread sleeps without being woken up
+
+
+class RingBuffer:
+    def __init__(self, capacity:int=RING_CAPACITY):
+        """
+        Fixed size single producer, single consumer queue. No lock: the producer only moves head,
+        the consumer only moves tail, and the slot is written before head is published.
+        Args:
+            capacity: Int, number of slots, power of 2
+        """
+        if capacity & (capacity - 1):
+            raise ValueError(f"Ring buffer capacity must be a power of 2, got {capacity}")
+        self.capacity = capacity
+        self.dropped = 0 # Items pushed while the ring was full
+        self._slots = [None] * capacity
+        self._mask = capacity - 1
+        self._head = 0 # Number of items pushed
+        self._tail = 0 # Number of items popped
+
+    def __len__(self) -> int:
+        return self._head - self._tail
+
+    def push(self, item) -> bool:
+        """
+        Called by the producer only. Never blocks: the item is dropped if the ring is full
+        Returns:
+            Bool, False if the item was dropped
+        """
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self.dropped += 1
+            return False
+        self._slots[head & self._mask] = item
+        self._head = head + 1
+        return True
+
+    def drain(self, out:list) -> int:
+        """
+        Called by the consumer only. Pop all items into out, oldest first
+        Returns:
+            Int, number of items popped
+        """
+        tail = self._tail
+        head = self._head
+        slots = self._slots
+        mask = self._mask
+        for index in range(tail, head):
+            out.append(slots[index & mask])
+            slots[index & mask] = None
+        self._tail = head
+        return head - tail
+
+
+class MidiSender:
+    def __init__(self, handler, sources:list[str], capacity:int=RING_CAPACITY, max_batch:int=MAX_BATCH):
+        """
+        Args:
+            handler: Callable taking a list of (midi_data, timestamp, source) tuples, in timestamp order.
+                     Only ever called from the sender thread
+            sources: List of str, names of the MIDI sources, one ring buffer each
+            capacity: Int, messages buffered per source
+            max_batch: Int, max messages per handler call
+        """
+        self.handler = handler
+        self.max_batch = max_batch
+        self.rings = {source: RingBuffer(capacity) for source in sources}
+        self.batches = 0
+        self.processed = 0
+        self._wake = threading.Event()
+        self._idle = False
+        self._running = False
+        self._thread = None
+
+    def push(self, message:tuple, source:str) -> None:
+        """
+        rtmidi callback: midi_in.set_callback(sender.push, source)
+        Args:
+            message: MIDI message from rtmidi. Tuple([status, data1, data2], delta time)
+            source: Str, name of the MIDI source
+        """
+        if self.rings[source].push((message[0], time.monotonic(), source)) and self._idle:
+            self._wake.set()
+
+    @property
+    def dropped(self) -> int:
+        return sum(ring.dropped for ring in self.rings.values())
+
+    def start(self) -> "MidiSender":
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="MidiSender", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout:float=1.0) -> None:
+        """
+        Stop the sender thread after it handles the messages already buffered
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _drain(self) -> list:
+        events = []
+        for ring in self.rings.values():
+            ring.drain(events)
+        if len(self.rings) > 1:
+            # Messages from different sources, in the order they were received
+            events.sort(key=lambda event: event[1])
+        return events
+
+    def _run(self) -> None:
+        while True:
+            events = self._drain()
+            if not events:
+                if not self._running:
+                    return
+                # Check the rings again once marked idle: a push in between either sees the flag or gets drained
+                self._idle = True
+                events = self._drain()
+                if not events:
+                    self._wake.wait(IDLE_WAIT_S)
+                    self._wake.clear()
+                    self._idle = False
+                    continue
+                self._idle = False
+
+            for start in range(0, len(events), self.max_batch):
+                batch = events[start:start + self.max_batch]
+                try:
+                    self.handler(batch)
+                except Exception as e:
+                    logger.exception(f"Error handling MIDI messages {batch}: {e}")
+                self.batches += 1
+                self.processed += len(batch)
+
+
+def time_callbacks(sender:MidiSender, n:int=20000) -> list[float]:
+    """
+    Duration of each rtmidi callback pushing into the sender, in seconds
+    """
+    durations = []
+    message = ([144, 38, 100], 0.0)
+    source = next(iter(sender.rings))
+    for _ in range(n):
+        tic = time.perf_counter()
+        sender.push(message, source)
+        durations.append(time.perf_counter() - tic)
+        if len(durations) % 512 == 0:
+            while len(sender.rings[source]):
+                time.sleep(0)
+    return durations
+
+
+def time_sustained_rate(handler, n:int=100000, sources:tuple=("logic", "keyboard")) -> tuple[float, int]:
+    """
+    Push n messages as fast as possible from one thread per source, like the rtmidi callback threads,
+    holding back while a ring is 3/4 full: the rate the sender keeps up with, without dropping
+    Returns:
+        Float messages/s handled by the sender thread, int messages dropped because a ring was full
+    """
+    sender = MidiSender(handler, list(sources)).start()
+
+    def produce(source:str):
+        ring = sender.rings[source]
+        for i in range(n // len(sources)):
+            while len(ring) >= ring.capacity * 3 // 4:
+                time.sleep(0)
+            sender.push(([144, 38, i % 128], 0.0), source)
+
+    tic = time.perf_counter()
+    producers = [threading.Thread(target=produce, args=(source,)) for source in sources]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    sender.stop(timeout=30)
+    return sender.processed / (time.perf_counter() - tic), sender.dropped
+
+
+def run_timing_comparison() -> None:
+    import statistics
+    from LatencyStats import percentile
+    from pythonosc import osc_bundle_builder, osc_message_builder, udp_client
+    import midi_states as ms
+
+    logger.remove()
+    osc_client = udp_client.SimpleUDPClient("127.0.0.1", 9) # Discard port: measures the send, nothing listens
+
+    def inline_callback(message:tuple, source:str) -> None:
+        # What the callback did before: classify and send, on the callback thread
+        ms.get_midi_action(message[0])
+        osc_client.send_message("/midi", message[0])
+
+    def send_batch(events:list) -> None:
+        bundle = osc_bundle_builder.OscBundleBuilder(osc_bundle_builder.IMMEDIATELY)
+        for midi_data, timestamp, source in events:
+            ms.get_midi_action(midi_data)
+            msg = osc_message_builder.OscMessageBuilder(address="/midi")
+            for value in midi_data:
+                msg.add_arg(value)
+            bundle.add_content(msg.build())
+        osc_client.send(bundle.build())
+
+    inline = []
+    for _ in range(20000):
+        tic = time.perf_counter()
+        inline_callback(([144, 38, 100], 0.0), "logic")
+        inline.append(time.perf_counter() - tic)
+
+    sender = MidiSender(send_batch, ["logic"]).start()
+    ring = time_callbacks(sender)
+    sender.stop()
+
+    for name, durations in [("inline classify+send", inline), ("ring buffer push", ring)]:
+        durations.sort()
+        p99 = percentile(durations, 0.99)
+        print(f"{name:22s} callback p50 {statistics.median(durations) * 1e6:6.2f} us, p99 {p99 * 1e6:6.2f} us")
+
+    tic = time.perf_counter()
+    for i in range(20000):
+        inline_callback(([144, 38, i % 128], 0.0), "logic")
+    print(f"inline max rate: {20000 / (time.perf_counter() - tic):,.0f} msg/s")
+    rate, dropped = time_sustained_rate(send_batch)
+    print(f"sender max sustained rate: {rate:,.0f} msg/s, {dropped} dropped")
+
+
+if __name__ == "__main__":
+    run_timing_comparison()
@@ -0,0 +1,87 @@
+# OSC over UDP multicast: the client sends each datagram once to a multicast group, and every server that joined
+# the group receives it, eg the recording light Pi and a second Pi outside the booth door. The client's cost per
+# event stays one send, however many servers listen.
+# On one machine, several servers can join the same group and port, with --multicast_interface 127.0.0.1.
+
+import time
+import socket
+import struct
+
+from pythonosc import udp_client, osc_server
+
+
+MULTICAST_GROUP = "239.255.0.42" # Administratively scoped: not routed outside the site
+MULTICAST_TTL = 1 # Datagrams don't leave the local network
+MULTICAST_INTERFACE = "0.0.0.0" # Let the kernel choose the interface
+
+
+class MulticastOSCClient(udp_client.SimpleUDPClient):
+    def __init__(self, group:str=MULTICAST_GROUP, port:int=5005, interface:str=MULTICAST_INTERFACE, ttl:int=MULTICAST_TTL):
+        """
+        OSC client publishing to a multicast group. Sends like SimpleUDPClient
+        Args:
+            group: Str, multicast group address, eg "239.255.0.42"
+            port: Int, port the servers listen on
+            interface: Str, IP address of the interface to send from, eg "127.0.0.1" to test on one machine
+            ttl: Int, number of routers a datagram can cross
+        """
+        super().__init__(group, port, family=socket.AF_INET)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        # Servers on this machine receive the datagrams too
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+
+class MulticastOSCUDPServer(osc_server.ThreadingOSCUDPServer):
+    def __init__(self, server_address:tuple, dispatcher, group:str=MULTICAST_GROUP, interface:str=MULTICAST_INTERFACE):
+        """
+        OSC server joining a multicast group. Still receives the datagrams sent to its own address
+        Args:
+            server_address: Tuple, (ip, port) to listen on, eg ("0.0.0.0", 5005)
+            dispatcher: Dispatcher, as for ThreadingOSCUDPServer
+            group: Str, multicast group address to join
+            interface: Str, IP address of the interface to join the group on
+        """
+        self.group = group
+        self.interface = interface
+        super().__init__(server_address, dispatcher)
+
+    def server_bind(self) -> None:
+        # Several servers on one machine share the port: each one gets a copy of every multicast datagram
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+        membership = struct.pack("4s4s", socket.inet_aton(self.group), socket.inet_aton(self.interface))
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+
+def time_fan_out(n_servers:int, n:int=20000) -> None:
+    """
+    Time sending a MIDI message to n_servers servers on this machine: one unicast send per server, against one
+    multicast send. Servers are plain sockets that are never read, only the sending side is timed
+    """
+    servers = [MulticastOSCUDPServer((MULTICAST_INTERFACE, 0), None, interface="127.0.0.1")]
+    port = servers[0].server_address[1]
+    servers += [MulticastOSCUDPServer((MULTICAST_INTERFACE, port), None, interface="127.0.0.1") for _ in range(n_servers - 1)]
+    unicast_clients = [udp_client.SimpleUDPClient("127.0.0.1", port) for _ in servers]
+    multicast_client = MulticastOSCClient(port=port, interface="127.0.0.1")
+    midi_data = [153, 38, 100]
+
+    tic = time.perf_counter()
+    for _ in range(n):
+        for client in unicast_clients:
+            client.send_message("/midi", midi_data)
+    unicast_s = time.perf_counter() - tic
+    tic = time.perf_counter()
+    for _ in range(n):
+        multicast_client.send_message("/midi", midi_data)
+    multicast_s = time.perf_counter() - tic
+    for osc in servers:
+        osc.server_close()
+    print(f"{n_servers} servers: unicast {unicast_s / n * 1e6:.1f} us/event, multicast {multicast_s / n * 1e6:.1f} us/event")
+
+
+if __name__ == "__main__":
+    for n_servers in (1, 2, 4, 8):
+        time_fan_out(n_servers)
@@ -0,0 +1,213 @@
+# Logging off the hot path: loguru writes into a bounded queue, and a background thread writes the queue
+# to stderr or a file (an SD card on the Pi) in batches. Per-message logs are counted into periodic summaries.
+
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+
+from loguru import logger
+
+
+QUEUE_SIZE = 10000 # Log messages buffered before new ones are dropped
+FLUSH_INTERVAL_S = 0.2 # Max time a log message waits in the queue. Warnings and errors are written right away
+WARNING_LEVEL_NO = logger.level("WARNING").no
+SUMMARY_INTERVAL_S = 10.0 # Time between two summaries of per-message logs
+LOG_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+
+
+class QueuedSink:
+    def __init__(self, stream, maxsize:int=QUEUE_SIZE, flush_interval:float=FLUSH_INTERVAL_S):
+        """
+        Loguru sink putting formatted messages in a bounded queue, written to stream by a background thread.
+        Never blocks the logging thread: messages are dropped, and counted, when the queue is full.
+        Stopped, writing what is left in the queue, when removed from the logger.
+        Args:
+            stream: File-like object to write to, eg sys.stderr or an open log file
+            maxsize: Int, max number of messages in the queue
+            flush_interval: Float, time in seconds between two writes of the queue
+        """
+        self.stream = stream
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._queue = deque() # append and popleft are atomic, no lock needed
+        self._wake = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="QueuedSink", daemon=True)
+        self._thread.start()
+
+    def write(self, message) -> None:
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        self._queue.append(message)
+        if message.record["level"].no >= WARNING_LEVEL_NO:
+            self._wake.set()
+
+    def stop(self) -> None:
+        """
+        Write what is left in the queue and stop the background thread
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write()
+        self._write()
+
+    def _write(self) -> None:
+        lines = []
+        while self._queue:
+            lines.append(self._queue.popleft())
+        if self.dropped != self._reported_dropped:
+            lines.append(f"{self.dropped - self._reported_dropped} log messages dropped, logging queue full\n")
+            self._reported_dropped = self.dropped
+        if not lines:
+            return
+        # One write and flush per batch instead of per message
+        self.stream.write("".join(lines))
+        self.stream.flush()
+        self.written += len(lines)
+
+
+class LogSummary:
+    def __init__(self, name:str):
+        """
+        Counts of frequent events, eg messages forwarded, logged as one line by flush()
+        Args:
+            name: Str, what is counted, eg "Sent over OSC"
+        """
+        self.name = name
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._since = time.monotonic()
+
+    def count(self, key, n:int=1) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + n
+
+    def counts(self) -> dict:
+        """
+        Returns:
+            Dict, key -> count since the last flush, without resetting them
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def flush(self) -> dict:
+        """
+        Log the counts since the last flush, if any, and reset them
+        Returns:
+            Dict, key -> count since the last flush
+        """
+        now = time.monotonic()
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        elapsed, self._since = now - self._since, now
+        if counts:
+            logger.info("{} in the last {:.0f}s: {}", self.name, elapsed, counts)
+        return counts
+
+
+def setup_logging(level:str="INFO", log_file:str|None=None, queue_size:int=QUEUE_SIZE) -> QueuedSink:
+    """
+    Replace loguru's default stderr handler with a queued one.
+    Messages below level cost a level check only, as long as they are logged with arguments,
+    eg logger.debug("Sent {}", midi_data), instead of f-strings.
+    Args:
+        level: Str, min level written, eg "INFO" or "DEBUG"
+        log_file: Str, path of a file to append logs to instead of stderr
+        queue_size: Int, max number of messages waiting to be written
+    Returns:
+        QueuedSink, the sink, stopped by logger.remove() and at exit
+    """
+    stream = open(log_file, "a") if log_file else sys.stderr
+    sink = QueuedSink(stream, maxsize=queue_size)
+    logger.remove()
+    logger.add(sink, level=level, format=LOG_FORMAT, colorize=stream.isatty())
+    atexit.register(sink.stop)
+    return sink
+
+
+def time_logging(log, n:int=20000) -> list[float]:
+    """
+    Duration of n calls to log(i), in seconds
+    """
+    durations = []
+    for i in range(n):
+        tic = time.perf_counter()
+        log(i)
+        durations.append(time.perf_counter() - tic)
+    return durations
+
+
+class SlowStream:
+    """
+    File wrapper taking write_latency seconds per write and flush, like an SD card under load
+    """
+    def __init__(self, file, write_latency:float=0.0005):
+        self.file = file
+        self.write_latency = write_latency
+
+    def write(self, data:str) -> None:
+        time.sleep(self.write_latency)
+        self.file.write(data)
+
+    def flush(self) -> None:
+        time.sleep(self.write_latency)
+        self.file.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+def run_timing_comparison(log_file:str) -> None:
+    import statistics
+    from LatencyStats import percentile
+
+    midi_data = [144, 38, 100]
+    summary = LogSummary("Sent over OSC")
+
+    def before(i:int) -> None:
+        # What the client did for every message: a synchronous f-string info log
+        logger.info(f"Sent MIDI message {midi_data} over OSC channel /midi")
+
+    def after(i:int) -> None:
+        summary.count("/midi")
+        logger.debug("Sent MIDI message {} over OSC channel {}", midi_data, "/midi")
+
+    results = []
+    logger.remove()
+    handler_id = logger.add(SlowStream(open(log_file, "a")), level="INFO", format=LOG_FORMAT)
+    results.append(("sync slow sink, info per message", time_logging(before, n=2000)))
+    logger.remove(handler_id)
+
+    sink = QueuedSink(SlowStream(open(log_file, "a")))
+    logger.add(sink, level="INFO", format=LOG_FORMAT)
+    results.append(("queued slow sink, info per message", time_logging(before)))
+    results.append(("queued slow sink, summary + debug", time_logging(after)))
+    logger.remove()
+    sink.stop()
+
+    results.append(("no logging", time_logging(lambda i: None)))
+
+    for name, durations in results:
+        durations.sort()
+        p99 = percentile(durations, 0.99)
+        print(f"{name:34s} p50 {statistics.median(durations) * 1e6:6.2f} us, p99 {p99 * 1e6:7.2f} us")
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix=".log") as log_file:
+        run_timing_comparison(log_file.name)
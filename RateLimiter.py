@@ -0,0 +1,110 @@
+# Token bucket rate limiter with latest-value semantics, for devices that cannot keep up with every event.
+# Eg a Dirigera bulb cannot take one HTTP request per drum hit: hits arriving faster than the device
+# rate are folded into a single pending value, sent as soon as a token is available.
+
+import threading
+from typing import Any, Callable
+
+
+class LatestValueRateLimiter:
+    def __init__(
+            self,
+            scheduler,
+            send:Callable[[Any], None],
+            rate:float,
+            burst:int=1,
+            merge:Callable[[Any, Any], Any]|None=None,
+            ):
+        """
+        Args:
+            scheduler: Object with time() and call_later(delay, callback, *args), eg AsyncWorker or TimerWheel
+            send: Callable sending a value to the device
+            rate: Float, maximum number of sends per second
+            burst: Int, number of sends allowed back to back after an idle period
+            merge: Callable folding a new value into the pending one, eg max. Defaults to keeping the latest value
+        """
+        self.scheduler = scheduler
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        self.merge = merge or (lambda pending, value: value)
+        self.sent = 0
+        self.folded = 0 # Values folded into a pending value instead of being sent
+        self._tokens = float(burst)
+        self._last_refill = scheduler.time()
+        self._pending = None
+        self._has_pending = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, value:Any) -> None:
+        """
+        Send value now if the rate allows, else keep it pending until the next token. Safe to call from any thread.
+        """
+        with self._lock:
+            if self._has_pending:
+                self._pending = self.merge(self._pending, value)
+                self.folded += 1
+                return
+            self._refill()
+            if self._tokens < 1:
+                self._pending = value
+                self._has_pending = True
+                self._timer = self.scheduler.call_later((1 - self._tokens) / self.rate, self._flush)
+                return
+            self._tokens -= 1
+            self.sent += 1
+        self.send(value)
+
+    def cancel(self) -> None:
+        """
+        Drop the pending value, eg when a newer action makes it obsolete.
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = None
+            self._has_pending = False
+
+    def _flush(self) -> None:
+        with self._lock:
+            if not self._has_pending:
+                return
+            self._refill()
+            value = self._pending
+            self._pending = None
+            self._has_pending = False
+            self._timer = None
+            self._tokens = max(self._tokens - 1, 0.0)
+            self.sent += 1
+        self.send(value)
+
+    def _refill(self) -> None:
+        now = self.scheduler.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+if __name__ == "__main__":
+    # Benchmark: a 20 hits/s snare roll against a device capped at 2 requests/s
+    import time
+    from loguru import logger
+    from AsyncWorker import AsyncWorker
+
+    hits_per_s = 20
+    duration_s = 5
+    device_rate = 2
+
+    requests = []
+    limiter = LatestValueRateLimiter(AsyncWorker(), lambda velocity: requests.append((time.monotonic(), velocity)), rate=device_rate, merge=max)
+    tic = time.monotonic()
+    for i in range(hits_per_s * duration_s):
+        limiter.submit(60 + i % 67)
+        time.sleep(1 / hits_per_s)
+    time.sleep(1 / device_rate + 0.05)
+    elapsed = time.monotonic() - tic
+
+    gaps = [b[0] - a[0] for a, b in zip(requests, requests[1:])]
+    logger.info(f"{hits_per_s * duration_s} hits in {elapsed:.2f}s -> {len(requests)} device requests ({len(requests) / elapsed:.2f}/s, cap {device_rate}/s), {limiter.folded} hits folded")
+    logger.info(f"Smallest gap between device requests: {min(gaps):.3f}s")
@@ -0,0 +1,245 @@
+# Server configuration: device names, colors, MIDI mapping and the device scene of each action.
+# Loaded from a TOML file, and reloaded in the background when the file changes: the new dispatch table
+# is built on the side, then swapped in with a single assignment, so an event is never handled half with
+# the old config and half with the new one.
+
+import os
+import threading
+import tomllib
+
+from loguru import logger
+
+import midi_states as ms
+from devices.DirigeraLightController import COLOR_TO_HEX
+
+
+CONFIG_PATH = "config.toml"
+POLL_INTERVAL_S = 1.0 # Time between two checks of the config file
+DEVICE_ROLES = ("rgb_light", "sunset_lights", "spotlight")
+CONTROL_CHANGE = list(range(176, 192)) # Control change status, all channels
+
+# Same behavior as before the config file existed. config.toml starts as a copy of it
+DEFAULT_CONFIG = {
+    "devices": {
+        "rgb_light": "recording_light",
+        "sunset_lights": "Sunset Lights",
+        "spotlight": "Spotlight Plug",
+        },
+    "colors": dict(COLOR_TO_HEX),
+    "midi": [
+        {"action": "all_notes_off", "status": CONTROL_CHANGE, "data1": 123, "data2": 0},
+        {"action": "reset_all", "status": CONTROL_CHANGE, "data1": 121, "data2": 0},
+        {"action": "record_start", "data1": 25, "data2": 127},
+        {"action": "record_stop", "data1": 25, "data2": 0},
+        {"action": "play", "data1": 106, "data2": 127},
+        {"action": "stop", "data1": 105, "data2": 127},
+        {"action": "track_left", "data1": 109, "data2": 127},
+        {"action": "track_right", "data1": 110, "data2": 127},
+        {"action": "snare_on", "status": 153, "data1": 38},
+        {"action": "snare_off", "status": 137, "data1": 38},
+        ],
+    "scenes": {
+        "reset_all": {"rgb_light": "orange", "spotlight": "off", "sunset_lights": "on"},
+        "record_start": {"rgb_light": "red", "sunset_lights": "on"},
+        "record_stop": {"rgb_light": "pink"},
+        "play": {"rgb_light": "dark_green", "spotlight": "on", "sunset_lights": "off"},
+        "stop": {"rgb_light": "pink", "spotlight": "off", "sunset_lights": "on"},
+        "all_notes_off": {"rgb_light": "off", "sunset_lights": "off", "spotlight": "off"},
+        },
+    }
+
+
+class ServerConfig:
+    def __init__(self, config:dict):
+        """
+        Validate a configuration and compile it into lookup tables. Never modified once built
+        Args:
+            config: Dict, parsed config file, see DEFAULT_CONFIG
+        Raises:
+            ValueError: unknown device role, action or color
+        """
+        self.devices = dict(config.get("devices", {}))
+        for role in self.devices:
+            if role not in DEVICE_ROLES:
+                raise ValueError(f"Unknown device role {role}, expected one of {DEVICE_ROLES}")
+        self.colors = {**COLOR_TO_HEX, **config.get("colors", {})} # Built-in colors, unless redefined
+
+        # (status or None for any, data1, data2 or None for any) -> MidiActions
+        self.midi_rules = {}
+        for rule in config.get("midi", []):
+            midi_action = parse_action(rule["action"])
+            statuses = rule.get("status")
+            if not isinstance(statuses, list):
+                statuses = [statuses]
+            for status in statuses:
+                self.midi_rules[(status, rule["data1"], rule.get("data2"))] = midi_action
+
+        # MidiActions -> tuple of (role, controller method, kwargs)
+        self.scenes = {
+            parse_action(action): self._parse_scene(action, scene)
+            for action, scene in config.get("scenes", {}).items()
+            }
+
+        # MidiActions -> (delay in seconds, tuple of (role, controller method, kwargs)): device states set some time
+        # after the action, unless another command reaches the device first
+        self.delayed_scenes = {}
+        for action, scene in config.get("delayed_scenes", {}).items():
+            scene = dict(scene)
+            delay = scene.pop("after_s", None)
+            if not isinstance(delay, (int, float)) or isinstance(delay, bool) or delay <= 0:
+                raise ValueError(f"Delayed scene of {action} needs a positive after_s, got {delay!r}")
+            self.delayed_scenes[parse_action(action)] = (float(delay), self._parse_scene(action, scene))
+
+        # MidiActions -> name of a scene stored on the Dirigera hub, triggered instead of the scene above
+        self.hub_scenes = {}
+        for action, scene_name in config.get("hub_scenes", {}).items():
+            if not isinstance(scene_name, str):
+                raise ValueError(f"Hub scene of {action} must be a scene name, got {scene_name!r}")
+            self.hub_scenes[parse_action(action)] = scene_name
+
+    @classmethod
+    def default(cls) -> "ServerConfig":
+        return cls(DEFAULT_CONFIG)
+
+    def _parse_scene(self, action:str, scene:dict) -> tuple:
+        commands = []
+        for role, state in scene.items():
+            if role not in DEVICE_ROLES:
+                raise ValueError(f"Unknown device role {role} in scene {action}")
+            commands.append((role, *self._parse_state(state)))
+        return tuple(commands)
+
+    def _parse_state(self, state:str) -> tuple[str, dict]:
+        if state == "off":
+            return "turn_off", {}
+        if state == "on":
+            return "turn_on", {}
+        if state.startswith("#"):
+            return "turn_on", {"hex_color": state}
+        if state not in self.colors:
+            raise ValueError(f"Unknown color {state}")
+        return "turn_on", {"hex_color": self.colors[state]}
+
+    def midi_action(self, midi_data:list) -> ms.MidiActions | None:
+        """
+        Translate a MIDI message to an action, exact status rules first
+        Args:
+            midi_data: List, [status, data1, data2]
+        Returns:
+            MidiActions enum, or None if no rule matches
+        """
+        status, data1, data2 = midi_data
+        rules = self.midi_rules
+        return (
+                rules.get((status, data1, data2))
+                or rules.get((status, data1, None))
+                or rules.get((None, data1, data2))
+                or rules.get((None, data1, None))
+                )
+
+
+def parse_action(action:str) -> ms.MidiActions:
+    try:
+        return ms.MidiActions(action)
+    except ValueError:
+        raise ValueError(f"Unknown action {action}") from None
+
+def load_config(path:str=CONFIG_PATH) -> ServerConfig:
+    """
+    Read and validate a TOML config file
+    Raises:
+        OSError, tomllib.TOMLDecodeError or ValueError if the file can't be used
+    """
+    with open(path, "rb") as f:
+        return ServerConfig(tomllib.load(f))
+
+
+class LiveTable:
+    def __init__(self, table=None, config:ServerConfig|None=None, controllers:dict|None=None):
+        """
+        The live dispatch table: the MIDI processing function, with the config and the device controllers it uses.
+        Called like the table. Each call reads the table once, so a swap never affects an event being handled
+        """
+        self._current = (table, config, controllers or {})
+
+    def __call__(self, *args, **kwargs):
+        return self._current[0](*args, **kwargs)
+
+    @property
+    def table(self):
+        return self._current[0]
+
+    @property
+    def config(self) -> ServerConfig:
+        return self._current[1]
+
+    @property
+    def controllers(self) -> dict:
+        return self._current[2]
+
+    def swap(self, table, config:ServerConfig, controllers:dict) -> None:
+        # One assignment: readers see either the old tuple or the new one
+        self._current = (table, config, controllers)
+
+
+class ConfigWatcher:
+    def __init__(self, path:str, on_change, poll_interval:float=POLL_INTERVAL_S):
+        """
+        Reload a config file in a background thread when it changes
+        Args:
+            path: Str, path of the config file
+            on_change: Callable taking the new ServerConfig. Not called if the new file is invalid
+            poll_interval: Float, time in seconds between two checks of the file
+        """
+        self.path = path
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.reloads = 0
+        self.errors = 0
+        self._stat = self._read_stat()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_stat(self) -> tuple | None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self) -> bool:
+        """
+        Reload the config if the file changed since the last check
+        Returns:
+            Bool, True if a new config was loaded
+        """
+        stat = self._read_stat()
+        if stat == self._stat or stat is None:
+            return False
+        self._stat = stat
+        try:
+            config = load_config(self.path)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Invalid config {self.path}, keeping the current one: {type(e).__name__} {e}")
+            return False
+        self.on_change(config)
+        self.reloads += 1
+        return True
+
+    def start(self) -> "ConfigWatcher":
+        self._thread = threading.Thread(target=self._run, name="ConfigWatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception(f"Error reloading config {self.path}: {e}")
@@ -0,0 +1,126 @@
+# Sessions of the OSC clients sending MIDI to the server, one per source address, eg the main Logic rig
+# and a laptop running a test. Each session keeps its own desired state, merged with one policy:
+# while any session is recording, only recording sessions drive the devices. So a RESET_ALL or
+# ALL_NOTES_OFF from a second machine can't turn the lights off in the middle of a take.
+# client.py sends RESET_ALL when it starts, from a new port: it replaces the sessions of earlier clients on the
+# same host, eg a client restarted during a take, which would otherwise keep the devices for SESSION_TIMEOUT_S.
+
+import time
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+
+import midi_states as ms
+
+
+SESSION_TIMEOUT_S = 6 * 3600 # Sessions silent for longer are forgotten. Long: a take can be silent for a while
+
+# Actions that end the recording of the session sending them
+END_RECORDING_ACTIONS = {ms.MidiActions.RECORD_STOP, ms.MidiActions.ALL_NOTES_OFF, ms.MidiActions.RESET_ALL}
+
+
+class Session:
+    __slots__ = ("source", "recording", "last_action", "last_seen", "ignored")
+
+    def __init__(self, source:str, now:float):
+        self.source = source
+        self.recording = False
+        self.last_action = None
+        self.last_seen = now
+        self.ignored = 0 # Actions not applied because another session was recording
+
+
+class SessionManager:
+    def __init__(self, timeout:float=SESSION_TIMEOUT_S, clock=time.monotonic):
+        """
+        Args:
+            timeout: Float, seconds after which a silent session is forgotten
+            clock: Callable returning the current time in seconds
+        """
+        self.timeout = timeout
+        self.clock = clock
+        self.recording = 0 # Number of recording sessions: the merged state is recording if > 0
+        self.expired = 0
+        # Source -> Session, least recently seen first: expiring is popping from the front
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, source:str, midi_action:ms.MidiActions|None, now:float|None=None) -> bool:
+        """
+        Apply a MIDI action to the session of its source, and tell whether the devices should follow it
+        Args:
+            source: Str, address of the client, eg "192.168.1.20:53000"
+            midi_action: MidiActions enum, or None for unmapped messages
+            now: Float, clock() time of the message. Defaults to now
+        Returns:
+            Bool, False if the action must not change the devices because another session is recording
+        """
+        now = now if now is not None else self.clock()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(source)
+            if session is None:
+                session = self._sessions[source] = Session(source, now)
+                logger.info(f"New session from {source}, {len(self._sessions)} active")
+            else:
+                self._sessions.move_to_end(source)
+                session.last_seen = now
+            if midi_action is None:
+                return True
+            session.last_action = midi_action
+            if midi_action == ms.MidiActions.RESET_ALL:
+                self._replace_host_sessions(source)
+
+            if midi_action == ms.MidiActions.RECORD_START:
+                if not session.recording:
+                    session.recording = True
+                    self.recording += 1
+                return True
+            if midi_action in END_RECORDING_ACTIONS and session.recording:
+                session.recording = False
+                self.recording -= 1
+            # The session stopping the last recording gets the devices back, eg turns the light off
+            allowed = self.recording == 0 or session.recording
+            if not allowed:
+                session.ignored += 1
+            return allowed
+
+    def _replace_host_sessions(self, source:str) -> None:
+        host = source.rsplit(":", 1)[0]
+        for old_source in [old for old in self._sessions if old != source and old.rsplit(":", 1)[0] == host]:
+            session = self._sessions.pop(old_source)
+            if session.recording:
+                self.recording -= 1
+                logger.warning(f"Session from {old_source} replaced while recording, by a client restarted on {source}")
+
+    def _expire(self, now:float) -> None:
+        while self._sessions:
+            source, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.timeout:
+                return
+            self._sessions.popitem(last=False)
+            self.expired += 1
+            if session.recording:
+                self.recording -= 1
+                logger.warning(f"Session from {source} expired while recording")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dict, source -> {"recording", "last_action", "idle_s", "ignored"}
+        """
+        now = self.clock()
+        with self._lock:
+            return {
+                source: {
+                    "recording": session.recording,
+                    "last_action": session.last_action.value if session.last_action else None,
+                    "idle_s": now - session.last_seen,
+                    "ignored": session.ignored,
+                    }
+                for source, session in self._sessions.items()
+                }
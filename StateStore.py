@@ -0,0 +1,183 @@
+# Last known state of the server, persisted to a small JSON file so that a restarted server (crash, power blip,
+# deploy) puts the devices back as they were, instead of blinking through the health checks and waiting for a
+# RESET_ALL. Updates only change a dict in memory: a background thread writes the file at most once per
+# flush interval, atomically (temporary file, fsync, rename), so a burst of transitions costs one fsync.
+
+import os
+import json
+import time
+import threading
+
+from loguru import logger
+
+
+STATE_PATH = "server_state.json"
+FLUSH_INTERVAL_S = 0.5 # Updates within this time of the first one are written together
+STATE_MAX_AGE_S = 12 * 3600 # Older state is not restored: the studio has likely been used without the server since
+VERSION = 1
+PERSISTED_ACTIONS = ("turn_on", "turn_off") # Transient actions, eg set_level on snare hits, are not restored
+
+
+class StateStore:
+    def __init__(self, path:str=STATE_PATH, flush_interval:float=FLUSH_INTERVAL_S, state:dict|None=None):
+        """
+        Args:
+            path: Str, path of the state file
+            flush_interval: Float, max time in seconds an update waits before being written
+            state: Dict, state to start from, eg the one returned by load_state. Defaults to an empty state
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.updates = 0
+        self.writes = 0
+        # {"recording": bool, "devices": {name: {"desired": command, "confirmed": command or None}}}
+        # A command is {"action": str, "kwargs": dict, "seq": int}, seq orders the commands of all devices
+        self._state = {"recording": False, "devices": {}}
+        if state:
+            self._state["recording"] = state.get("recording", False)
+            self._state["devices"] = dict(state.get("devices", {}))
+        self._seq = max((device["desired"]["seq"] for device in self._state["devices"].values()), default=0)
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_recording(self, recording:bool) -> None:
+        with self._lock:
+            self._state["recording"] = recording
+        self._updated()
+
+    def set_desired(self, device:str, action:str, kwargs:dict) -> None:
+        """
+        Record the last command dispatched to a device. Only PERSISTED_ACTIONS are recorded
+        Args:
+            device: Str, device name
+            action: Str, eg "turn_on"
+            kwargs: Dict, keyword arguments of the action, eg {"hex_color": "#ff3729"}
+        """
+        if action not in PERSISTED_ACTIONS:
+            return
+        with self._lock:
+            self._seq += 1
+            entry = self._state["devices"].setdefault(device, {"desired": None, "confirmed": None})
+            entry["desired"] = {"action": action, "kwargs": kwargs, "seq": self._seq}
+        self._updated()
+
+    def set_confirmed(self, device:str, action:str, kwargs:dict) -> None:
+        """
+        Record a command that reached its device
+        """
+        if action not in PERSISTED_ACTIONS:
+            return
+        with self._lock:
+            entry = self._state["devices"].get(device)
+            if entry is None:
+                return
+            entry["confirmed"] = {"action": action, "kwargs": kwargs}
+        self._updated()
+
+    def _updated(self) -> None:
+        self.updates += 1
+        self._dirty.set()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._state))
+
+    def flush(self) -> None:
+        """
+        Write the state now if it changed since the last write
+        """
+        if not self._dirty.is_set():
+            return
+        self._dirty.clear()
+        state = self.snapshot()
+        state["version"] = VERSION
+        state["saved_at"] = time.time()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers see the old file or the new one, never a partial write
+        os.replace(tmp_path, self.path)
+        self.writes += 1
+
+    def start(self) -> "StateStore":
+        self._thread = threading.Thread(target=self._run, name="StateStore", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the writer thread, writing the pending updates
+        """
+        self._stop.set()
+        self._dirty.set() # Wake the writer thread
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._dirty.wait()
+            # Let the updates of the next flush interval join this write
+            self._stop.wait(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Could not write state to {self.path}: {e}")
+
+
+def load_state(path:str=STATE_PATH, max_age:float=STATE_MAX_AGE_S) -> dict | None:
+    """
+    Read the state written by a previous run
+    Args:
+        path: Str, path of the state file
+        max_age: Float, seconds after which a state is too old to restore
+    Returns:
+        Dict, the state, or None if there is none, it can't be read, or it is too old
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable state file {path}: {e}")
+        return None
+    if state.get("version") != VERSION:
+        logger.warning(f"Ignoring state file {path} of version {state.get('version')}")
+        return None
+    age = time.time() - state.get("saved_at", 0)
+    if age > max_age:
+        logger.info(f"Ignoring state saved {age / 3600:.1f} h ago")
+        return None
+    return state
+
+
+def time_burst(n:int=100, path:str="state_benchmark.json") -> None:
+    """
+    Time a burst of n device commands written one by one, against the same burst batched by the writer thread
+    """
+    store = StateStore(path)
+    tic = time.perf_counter()
+    for i in range(n):
+        store.set_desired("Spotlight Plug", PERSISTED_ACTIONS[i % 2], {})
+        store.flush()
+    unbatched_s = time.perf_counter() - tic
+    unbatched_writes = store.writes
+
+    store = StateStore(path).start()
+    tic = time.perf_counter()
+    for i in range(n):
+        store.set_desired("Spotlight Plug", PERSISTED_ACTIONS[i % 2], {})
+    updates_s = time.perf_counter() - tic
+    store.stop()
+    os.remove(path)
+    print(f"{n} updates: one write each {unbatched_s * 1e3:.1f} ms, {unbatched_writes} fsyncs. "
+          f"Batched {updates_s * 1e3:.2f} ms in the caller, {store.writes} fsyncs")
+
+
+if __name__ == "__main__":
+    time_burst()
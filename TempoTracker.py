@@ -0,0 +1,97 @@
+# Estimate tempo and beat phase from MIDI clock, so that only compact tempo updates are sent over OSC
+# instead of 24 clock pulses per beat.
+
+from collections import deque
+
+import midi_states as ms
+
+
+PULSES_PER_QUARTER_NOTE = 24
+
+
+class TempoTracker:
+    def __init__(self, window:int=48, bpm_threshold:float=0.5, phase_threshold_s:float=0.01):
+        """
+        Args:
+            window: Int, number of clock pulses to fit the tempo over. 48 pulses is 2 beats
+            bpm_threshold: Float, send an update when the tempo moves by more than this many BPM
+            phase_threshold_s: Float, send an update when beats drift from the last update by more than this many seconds
+        """
+        self.pulse_times = deque(maxlen=window)
+        self.pulse_count = 0 # Pulses since the last START, the beat falls on multiples of 24
+        self.bpm_threshold = bpm_threshold
+        self.phase_threshold_s = phase_threshold_s
+        self.playing = False
+        self.bpm = None
+        self._sent = None # (bpm, beat time, playing) of the last update
+
+    def process(self, status:int, timestamp:float) -> list | None:
+        """
+        Feed a MIDI clock message.
+        Args:
+            status: Int, MIDI status byte: TIMING_CLOCK, START, CONTINUE or STOP
+            timestamp: Float, time the message was received, in seconds
+        Returns:
+            [bpm, playing, phase_s] to send to the server if the tempo or phase changed, else None.
+            phase_s is the time elapsed since the last beat at timestamp
+        """
+        if status == ms.TIMING_CLOCK:
+            self.pulse_times.append(timestamp)
+            self.pulse_count += 1
+        elif status == ms.START:
+            # The first clock pulse after START is the first beat of the song
+            self.pulse_times.clear()
+            self.pulse_count = -1
+            self.playing = True
+            return self._update(timestamp, force=self.bpm is not None)
+        elif status == ms.CONTINUE:
+            self.pulse_times.clear()
+            self.playing = True
+            return self._update(timestamp, force=self.bpm is not None)
+        elif status == ms.STOP:
+            self.playing = False
+            return self._update(timestamp, force=True)
+        else:
+            return None
+
+        if len(self.pulse_times) < PULSES_PER_QUARTER_NOTE:
+            return None
+        return self._update(timestamp)
+
+    def _fit(self) -> tuple[float, float]:
+        """
+        Least squares fit of pulse times against pulse index: robust to the jitter of individual pulses.
+        Returns (seconds per pulse, fitted time of the last pulse)
+        """
+        n = len(self.pulse_times)
+        mean_x = (n - 1) / 2
+        mean_t = sum(self.pulse_times) / n
+        covariance = sum((x - mean_x) * (t - mean_t) for x, t in enumerate(self.pulse_times))
+        variance = sum((x - mean_x) ** 2 for x in range(n))
+        period = covariance / variance
+        return period, mean_t + period * (n - 1 - mean_x)
+
+    def _update(self, timestamp:float, force:bool=False) -> list | None:
+        beat_time = None
+        if len(self.pulse_times) >= PULSES_PER_QUARTER_NOTE:
+            period, last_pulse_time = self._fit()
+            self.bpm = 60.0 / (period * PULSES_PER_QUARTER_NOTE)
+            beat_time = last_pulse_time - period * (max(self.pulse_count, 0) % PULSES_PER_QUARTER_NOTE)
+
+        if self.bpm is None:
+            return None
+
+        if not force and self._sent:
+            sent_bpm, sent_beat_time, sent_playing = self._sent
+            beat = 60.0 / sent_bpm
+            drift = ((beat_time - sent_beat_time) + beat / 2) % beat - beat / 2
+            if (sent_playing == self.playing
+                    and abs(self.bpm - sent_bpm) <= self.bpm_threshold
+                    and abs(drift) <= self.phase_threshold_s):
+                return None
+
+        if beat_time is None:
+            # Just started or continued, no pulses yet: the beat is now
+            beat_time = timestamp
+        self._sent = (self.bpm, beat_time, self.playing)
+        return [round(self.bpm, 2), int(self.playing), max(timestamp - beat_time, 0.0)]
@@ -0,0 +1,179 @@
+# Hashed timer wheel: O(1) insert and cancel for delayed and recurring actions.
+# Timers are hashed into slots by their deadline tick. Advancing the wheel only looks at the slots
+# for the ticks that elapsed, so thousands of pending timers cost nothing until they are due.
+
+import time
+import threading
+from typing import Callable
+
+from loguru import logger
+
+
+class TimerHandle:
+    __slots__ = ("tick", "callback", "args", "interval", "wheel", "cancelled")
+
+    def __init__(self, tick:int, callback:Callable, args:tuple, interval:float|None, wheel:"TimerWheel"):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.interval = interval # Seconds between runs for recurring timers, None for one-shot timers
+        self.wheel = wheel
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """
+        Cancel the timer. O(1), safe to call from any thread and more than once.
+        """
+        self.wheel._remove(self)
+
+
+class TimerWheel:
+    def __init__(self, tick:float=0.01, slots:int=512, clock:Callable[[], float]=time.monotonic):
+        """
+        Args:
+            tick: Float, resolution of the wheel in seconds. Timers fire on the first tick at or after their deadline
+            slots: Int, number of slots. Timers further than tick * slots away just stay in their slot for more rounds
+            clock: Callable returning the current time in seconds. Can be swapped for a fake clock in tests
+        """
+        self.tick = tick
+        self.clock = clock
+        self._slots = [set() for _ in range(slots)]
+        self._current_tick = self._to_tick(clock())
+        self._lock = threading.Lock()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def time(self) -> float:
+        return self.clock()
+
+    def call_later(self, delay:float, callback:Callable, *args) -> TimerHandle:
+        """
+        Run callback(*args) after delay seconds.
+        """
+        return self._add(self.clock() + delay, callback, args, None)
+
+    def call_at(self, when:float, callback:Callable, *args) -> TimerHandle:
+        """
+        Run callback(*args) at time when, as returned by the wheel clock.
+        """
+        return self._add(when, callback, args, None)
+
+    def call_every(self, interval:float, callback:Callable, *args) -> TimerHandle:
+        """
+        Run callback(*args) every interval seconds, until the returned handle is cancelled.
+        """
+        return self._add(self.clock() + interval, callback, args, interval)
+
+    def advance(self, now:float|None=None) -> int:
+        """
+        Fire all timers due at time now. Callbacks run in the calling thread, eg the AsyncWorker loop.
+        Args:
+            now: Float, current time. Defaults to the wheel clock
+        Returns:
+            Int, number of timers fired
+        """
+        now_tick = self._to_tick(self.clock() if now is None else now)
+        due = []
+        with self._lock:
+            # Past one full turn, every slot has been visited: no need to go round again
+            first_tick = max(self._current_tick + 1, now_tick - len(self._slots) + 1)
+            for tick in range(first_tick, now_tick + 1):
+                slot = self._slots[tick % len(self._slots)]
+                for handle in [handle for handle in slot if handle.tick <= now_tick]:
+                    slot.remove(handle)
+                    due.append(handle)
+            self._current_tick = max(self._current_tick, now_tick)
+            self._len -= len(due)
+
+        due.sort(key=lambda handle: handle.tick)
+        fired = 0
+        for handle in due:
+            with self._lock:
+                # Cancelled from another thread after it was taken out of its slot
+                if handle.cancelled:
+                    continue
+                if handle.interval is not None:
+                    # Reschedule from the deadline, not from now, so recurring timers do not drift
+                    handle.tick = max(handle.tick + self._ticks(handle.interval), now_tick + 1)
+                    self._slots[handle.tick % len(self._slots)].add(handle)
+                    self._len += 1
+                else:
+                    handle.cancelled = True # Fired: a later cancel() does nothing
+            fired += 1
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                # The other due timers still run
+                logger.exception(f"Error in timer callback {handle.callback}: {e}")
+        return fired
+
+    def next_deadline(self) -> float | None:
+        """
+        Time of the first tick with a pending timer, to sleep until then instead of waking every tick.
+        Looks at one turn of slots at most, then at every pending timer for timers further away
+        Returns:
+            Float, wheel clock time, or None if no timer is pending
+        """
+        with self._lock:
+            if not self._len:
+                return None
+            n_slots = len(self._slots)
+            for tick in range(self._current_tick + 1, self._current_tick + n_slots + 1):
+                if any(handle.tick == tick for handle in self._slots[tick % n_slots]):
+                    return tick * self.tick
+            return min(handle.tick for slot in self._slots for handle in slot) * self.tick
+
+    def _add(self, when:float, callback:Callable, args:tuple, interval:float|None) -> TimerHandle:
+        with self._lock:
+            tick = max(self._to_tick(when, ceil=True), self._current_tick + 1)
+            handle = TimerHandle(tick, callback, args, interval, self)
+            self._slots[tick % len(self._slots)].add(handle)
+            self._len += 1
+        return handle
+
+    def _remove(self, handle:TimerHandle) -> None:
+        with self._lock:
+            if handle.cancelled:
+                return
+            handle.cancelled = True
+            slot = self._slots[handle.tick % len(self._slots)]
+            if handle in slot:
+                slot.remove(handle)
+                self._len -= 1
+
+    def _to_tick(self, when:float, ceil:bool=False) -> int:
+        tick = when / self.tick
+        return -int(-tick // 1) if ceil else int(tick // 1)
+
+    def _ticks(self, seconds:float) -> int:
+        return max(1, round(seconds / self.tick))
+
+
+if __name__ == "__main__":
+    # Benchmark timer insert and cancel cost, against asyncio's heap based call_later
+    import asyncio
+
+    n = 100_000
+    wheel = TimerWheel()
+
+    tic = time.perf_counter()
+    handles = [wheel.call_later(i % 60, print) for i in range(n)]
+    insert_time = time.perf_counter() - tic
+    tic = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    cancel_time = time.perf_counter() - tic
+    print(f"TimerWheel: insert {insert_time / n * 1e6:.2f}us/timer, cancel {cancel_time / n * 1e6:.2f}us/timer, {len(wheel)} pending")
+
+    loop = asyncio.new_event_loop()
+    tic = time.perf_counter()
+    handles = [loop.call_later(i % 60, print) for i in range(n)]
+    insert_time = time.perf_counter() - tic
+    tic = time.perf_counter()
+    for handle in handles:
+        handle.cancel()
+    cancel_time = time.perf_counter() - tic
+    print(f"asyncio call_later: insert {insert_time / n * 1e6:.2f}us/timer, cancel {cancel_time / n * 1e6:.2f}us/timer, {len(loop._scheduled)} still in the heap")
+    loop.close()
@@ -1,14 +1,22 @@
 # This program is to be run on the machine running Logic Pro X.
 # To setup recording light, go to Logic Pro X -> Settings -> Control Surfaces -> Setup -> New -> Recording Light
 import os
+import time
 import argparse
 import socket
+from functools import partial
 
 from loguru import logger
 import rtmidi
-from pythonosc import udp_client
+from pythonosc import udp_client, osc_bundle_builder, osc_message_builder
 
 from OBSController import OBSController
+from TempoTracker import TempoTracker
+from MidiDeduplicator import MidiDeduplicator, DEDUP_WINDOW_S
+from MidiSender import MidiSender
+from MidiPortWatcher import MidiPortWatcher, POLL_INTERVAL_S
+from QueuedLogging import LogSummary, setup_logging, SUMMARY_INTERVAL_S
+from MulticastOSC import MulticastOSCClient, MULTICAST_INTERFACE
 import midi_states as ms
 
 
@@ -19,49 +27,130 @@ KEYBOARD_MIDI_PORT_NAME = "Impact LX61+ MIDI2" # Change this to the name of your
 MIDI_SOURCES = [LOGIC_MIDI_PORT_NAME, KEYBOARD_MIDI_PORT_NAME]
 
 
-def send_midi_message_over_osc(message:tuple, data_dict:dict) -> None:
+def classify_midi_message(midi_data:list, timestamp:float, source:str, data_dict:dict) -> tuple[str, list] | None:
     """
-    Callback function to send MIDI message over OSC
+    Turn a MIDI message into the OSC message to send, if any
     Args:
-        message: MIDI message from rtmidi. Tuple([status, data1, data2], timestamp)
-        data_dict: Dict, data dictionary containing the OSC channel, OBS controller, and OSC client
+        midi_data: List, MIDI message from rtmidi: [status, data1, data2]
+        timestamp: Float, time.monotonic() when the rtmidi callback received it
+        source: Str, name of the MIDI source it came from
+        data_dict: Dict, data dictionary containing the OSC channels, tempo tracker and deduplicator
+    Returns:
+        Tuple (OSC channel, arguments), or None if nothing should be sent
     """
-    osc_channel = data_dict["osc_channel"]
-    obs_controller = data_dict["obs_controller"]
-    osc_client = data_dict["osc_client"]
-
-    midi_data = message[0] # Ignore timestamp
+    # MIDI clock: only send tempo updates, never the 24 pulses per beat
+    if midi_data and midi_data[0] in ms.CLOCK_STATUSES:
+        tempo_update = data_dict["tempo_tracker"].process(midi_data[0], timestamp)
+        if tempo_update:
+            return data_dict["tempo_channel"], tempo_update
+        return None
 
     # Make sure it is 3 bytes long
     if len(midi_data) != 3:
-        logger.warning(f"Invalid MIDI message: {midi_data}")
-        pass
+        logger.warning("Invalid MIDI message: {}", midi_data)
+        return None
 
     midi_action = ms.get_midi_action(midi_data)
-    match midi_action:
-        case ms.MidiActions.RECORD_START:
-            # Record video with OBS
-            if obs_controller:
-                logger.info(f"{midi_data}\tStarting OBS recording")
+    if not data_dict["deduplicator"].accept(midi_action, source, timestamp):
+        logger.debug("{}\tDuplicate {} from {}, ignoring", midi_data, midi_action, source)
+        return None
+
+    return data_dict["osc_channel"], midi_data
+
+def send_osc_messages(osc_client:udp_client.SimpleUDPClient, messages:list) -> None:
+    """
+    Send OSC messages in one datagram: a bundle if there is more than one
+    Args:
+        osc_client: SimpleUDPClient, OSC client
+        messages: List of (OSC channel, arguments) tuples
+    """
+    if len(messages) == 1:
+        osc_client.send_message(*messages[0])
+        return
+
+    bundle = osc_bundle_builder.OscBundleBuilder(osc_bundle_builder.IMMEDIATELY)
+    for osc_channel, args in messages:
+        message = osc_message_builder.OscMessageBuilder(address=osc_channel)
+        for arg in args:
+            message.add_arg(arg)
+        bundle.add_content(message.build())
+    osc_client.send(bundle.build())
+
+def send_midi_messages_over_osc(events:list, data_dict:dict) -> None:
+    """
+    MidiSender handler: classify a batch of MIDI messages from all sources, send them over OSC, then
+    run the OBS actions, so that a slow OBS call never delays the light.
+    Only called from the MidiSender thread, which is the only user of the OSC client and OBS controller.
+    Args:
+        events: List of (midi_data, timestamp, source) tuples, in the order they were received
+        data_dict: Dict, data dictionary containing the OSC channels, OBS controller, OSC client, tempo tracker,
+                   deduplicator and log summary
+    """
+    obs_controller = data_dict["obs_controller"]
+    messages = []
+    exiting = False
+
+    for midi_data, timestamp, source in events:
+        message = classify_midi_message(midi_data, timestamp, source, data_dict)
+        if message is None:
+            continue
+        messages.append(message)
+        if message[0] != data_dict["osc_channel"]:
+            continue
+        if ms.get_midi_action(midi_data) == ms.MidiActions.ALL_NOTES_OFF:
+            # Exit the program once this message is sent, ignoring the rest of the batch
+            logger.info("{}\tAll notes off", midi_data)
+            exiting = True
+            break
+
+    if messages:
+        send_osc_messages(data_dict["osc_client"], messages)
+        # Too frequent to log every message at info level: counted, and logged every summary interval
+        for osc_channel, args in messages:
+            data_dict["log_summary"].count(osc_channel)
+            logger.debug("Sent {} over OSC channel {}", args, osc_channel)
+
+    for osc_channel, args in messages:
+        if osc_channel != data_dict["osc_channel"] or not obs_controller:
+            continue
+        match ms.get_midi_action(args):
+            case ms.MidiActions.RECORD_START:
+                # Record video with OBS
+                logger.info("{}\tStarting OBS recording", args)
                 obs_controller.start_recording()
-        case ms.MidiActions.RECORD_STOP:
-            if obs_controller:
-                logger.info(f"{midi_data}\tStopping OBS recording")
+            case ms.MidiActions.RECORD_STOP | ms.MidiActions.ALL_NOTES_OFF:
+                logger.info("{}\tStopping OBS recording", args)
                 obs_controller.stop_recording()
-        case ms.MidiActions.ALL_NOTES_OFF:
-            osc_client.send_message(osc_channel, midi_data)
-            # Exit the program
-            logger.info(f"{midi_data}\tAll notes off")
-            if obs_controller:
-                logger.info(f"{midi_data}\tStopping OBS recording")
-                obs_controller.stop_recording()
-            logger.warning("All notes off event received. Exiting...")
-            os._exit(0)
 
-    # Send MIDI message over OSC
-    osc_client.send_message(osc_channel, midi_data)
-    logger.info(f"Sent MIDI message {midi_data} over OSC channel {osc_channel}")
-    return
+    if exiting:
+        logger.warning("All notes off event received. Exiting...")
+        logger.remove() # Write the queued logs, os._exit skips atexit
+        os._exit(0)
+
+def open_midi_port(index:int, port_name:str, source:str, midi_sender:MidiSender) -> rtmidi.MidiIn:
+    """
+    Open a MIDI port and hand its messages off to the sender thread
+    Args:
+        index: Int, index of the port in rtmidi's port list
+        port_name: Str, name of the port
+        source: Str, name of the MIDI source the port is for, eg LOGIC_MIDI_PORT_NAME
+        midi_sender: MidiSender object to push the MIDI messages to
+    Returns:
+        midi_in: MidiIn, the open port
+    """
+    midi_in = rtmidi.MidiIn()
+    midi_in.open_port(index)
+    if source == LOGIC_MIDI_PORT_NAME:
+        # MIDI clock is filtered out by default
+        midi_in.ignore_types(timing=False)
+    # The callback only hands the message off to the sender thread
+    midi_in.set_callback(midi_sender.push, source)
+    return midi_in
+
+def close_midi_port(midi_in:rtmidi.MidiIn) -> None:
+    midi_in.cancel_callback()
+    midi_in.close_port()
+    midi_in.delete()
 
 def create_osc_client(rpi_hostname:str, port:int) -> udp_client.SimpleUDPClient:
     """
@@ -93,21 +182,72 @@ if __name__ == "__main__":
             default="/midi",
             help="The OSC channel to listen on",
             )
+    parser.add_argument(
+            "--tempo_channel",
+            type=str,
+            default="/tempo",
+            help="The OSC channel to send tempo updates on, estimated from Logic's MIDI clock",
+            )
     parser.add_argument(
             "--rpi_hostname",
             type=str,
             default="rpi.local",
             help="The hostname of the RPi connected to the recording light",
             )
+    parser.add_argument(
+            "--multicast_group",
+            type=str,
+            default=None,
+            help="Send to this multicast group instead of --rpi_hostname, eg 239.255.0.42, for servers started with the same group",
+            )
+    parser.add_argument(
+            "--multicast_interface",
+            type=str,
+            default=MULTICAST_INTERFACE,
+            help="IP address of the interface to send multicast from, eg 127.0.0.1 to test with servers on this machine",
+            )
+    parser.add_argument(
+            "--dedup_window_ms",
+            type=float,
+            default=DEDUP_WINDOW_S * 1000,
+            help="Ignore an action that already came from the other MIDI source within this many milliseconds",
+            )
+    parser.add_argument(
+            "--port_poll_interval",
+            type=float,
+            default=POLL_INTERVAL_S,
+            help="Seconds between two checks for MIDI ports plugged in or out",
+            )
+    parser.add_argument(
+            "--log_level",
+            type=str,
+            default="INFO",
+            help="Min level of the logs written. DEBUG logs every MIDI message sent",
+            )
+    parser.add_argument(
+            "--log_file",
+            type=str,
+            default=None,
+            help="File to append logs to, instead of stderr",
+            )
+    parser.add_argument(
+            "--log_summary_interval",
+            type=float,
+            default=SUMMARY_INTERVAL_S,
+            help="Seconds between two logs of the number of messages sent",
+            )
     parser.add_argument(
             "--record_obs",
             action="store_true",
             help="Enable OBS recording control",
         )
     args = parser.parse_args()
+    # Logs are written by a background thread, never by the MIDI sender thread
+    setup_logging(level=args.log_level, log_file=args.log_file)
 
-    midi_in = rtmidi.MidiIn()
-    available_ports = midi_in.get_ports()
+    # Only used to list MIDI ports
+    port_enumerator = rtmidi.MidiIn()
+    available_ports = port_enumerator.get_ports()
 
     # Controller for OBS
     obs_controller = None
@@ -119,63 +259,64 @@ if __name__ == "__main__":
             logger.error("Is OBS running? And is the OBS websocket server enabled?")
             exit(1)
 
-    # Controller for OSC
-    osc_client = create_osc_client(
-            rpi_hostname=args.rpi_hostname,
-            port=PORT,
-            )
+    # Controller for OSC: one send per event, whether to one server or to every server in the multicast group
+    if args.multicast_group:
+        osc_client = MulticastOSCClient(args.multicast_group, PORT, interface=args.multicast_interface)
+    else:
+        osc_client = create_osc_client(
+                rpi_hostname=args.rpi_hostname,
+                port=PORT,
+                )
 
-    # Prepare data dictionary to pass to callback
+    # Prepare data dictionary to pass to the sender thread
     callback_data = {
         "osc_channel": args.osc_channel,
         "obs_controller": obs_controller,
         "osc_client": osc_client,
+        "tempo_channel": args.tempo_channel,
+        "tempo_tracker": TempoTracker(),
+        "deduplicator": MidiDeduplicator(window=args.dedup_window_ms / 1000),
+        "log_summary": LogSummary("Sent over OSC"),
     }
+    # Started once the reset message is sent: from then on, only the sender thread uses the OSC client
+    midi_sender = MidiSender(partial(send_midi_messages_over_osc, data_dict=callback_data), MIDI_SOURCES)
 
-    midi_ins = []
-    found_midi_sources = {midi_source: False for midi_source in MIDI_SOURCES}
-
-    # Loop through available MIDI ports and open the ones we want to listen to MIDI messages on
-    if available_ports:
-        logger.info(f"Available MIDI ports: {available_ports}")
-        for idx, port in enumerate(available_ports):
-            # We want to catch MIDI messages from Logic Pro X's virtual MIDI port
-            # We also want to catch MIDI messages from a MIDI controller
-            # Both sources are tied to the same callback function to send MIDI over OSC
-
-            for midi_source in MIDI_SOURCES:
-                if midi_source in port:
-                    midi_in = rtmidi.MidiIn()
-                    midi_in.open_port(idx)
-                    midi_in.set_callback(send_midi_message_over_osc, callback_data)
-                    logger.info(f"Opened MIDI port {available_ports[idx]}")
-                    midi_ins.append(midi_in)
-                    found_midi_sources[midi_source] = True
+    # Open the MIDI sources, and keep opening/closing them as they are plugged in and out,
+    # eg a keyboard connected after the client started: the OSC client and OBS connection stay up
+    port_watcher = MidiPortWatcher(
+            MIDI_SOURCES,
+            list_ports=port_enumerator.get_ports,
+            open_port=partial(open_midi_port, midi_sender=midi_sender),
+            close_port=close_midi_port,
+            poll_interval=args.port_poll_interval,
+            ).start()
 
-    else:
+    logger.info(f"Available MIDI ports: {available_ports}")
+    if not available_ports:
         logger.error("No MIDI ports available. Make sure that Logic Pro X is open, and that a recording light was setup:\nLogic Pro X -> Settings -> Control Surfaces -> Setup -> New -> Recording Light")
-        logger.info("Exiting...")
-        exit(1)
 
     # Warn user if any of the MIDI sources were not found
-    for midi_source, found in found_midi_sources.items():
-        if not found:
-            logger.warning(f"Could not find MIDI source '{midi_source}'. Make sure that the MIDI controller is connected and that Logic Pro X is open.")
+    for midi_source in port_watcher.missing():
+        logger.warning(f"Could not find MIDI source '{midi_source}'. It will be opened when it appears. Make sure that the MIDI controller is connected and that Logic Pro X is open.")
 
-    logger.info(f"OSC client set up with hostname {args.rpi_hostname} on port {PORT}")
+    logger.info(f"OSC client set up with {'multicast group ' + args.multicast_group if args.multicast_group else 'hostname ' + args.rpi_hostname} on port {PORT}")
     logger.info(f"Sending MIDI messages over OSC channel {args.osc_channel}")
 
     # Send reset message to server to init state
     logger.info("Sending reset message to server")
     osc_client.send_message(args.osc_channel, RESET_ALL_MESSAGE)
+    midi_sender.start()
 
     try:
         while True:
-            # Keep the main thread alive to receive MIDI messages
-            pass
+            # Keep the main thread alive to receive MIDI messages, without competing with the sender thread
+            time.sleep(args.log_summary_interval)
+            callback_data["log_summary"].flush()
     except KeyboardInterrupt:
+        logger.info(f"Suppressed duplicate actions: {callback_data['deduplicator'].suppressed}")
+        logger.info(f"MIDI messages dropped because the sender fell behind: {midi_sender.dropped}")
         logger.info("Exiting...")
     finally:
-        for midi_in in midi_ins:
-            midi_in.close_port()
+        port_watcher.stop()
+        midi_sender.stop()
         exit(0)
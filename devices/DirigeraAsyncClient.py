@@ -0,0 +1,209 @@
+# Native asyncio HTTP client for the Dirigera hub endpoints used by the Dirigera controllers.
+# Requests run on the event loop over a pool of keep-alive connections: no thread per call,
+# so dozens of devices can be driven concurrently from the AsyncWorker loop.
+
+import ssl
+import json
+import asyncio
+import contextvars
+from typing import Any
+
+from loguru import logger
+
+
+# Set by the caller (eg DeviceDispatcher) for requests on the critical lane, eg the recording light.
+# Other requests can't take the connections reserved for critical ones
+critical_request = contextvars.ContextVar("critical_request", default=False)
+
+
+class HubRequestError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Dirigera hub returned HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class _Pool:
+    def __init__(self, max_connections: int, reserved_connections: int):
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.best_effort = asyncio.Semaphore(max(max_connections - reserved_connections, 1))
+        self.idle: list[_Connection] = []
+
+
+class AsyncHubClient:
+    def __init__(
+            self,
+            ip_address: str,
+            token: str,
+            port: int = 8443,
+            api_version: str = "v1",
+            use_ssl: bool = True,
+            max_connections: int = 8,
+            reserved_connections: int = 2,
+            timeout: float = 5.0,
+            ):
+        """
+        Args:
+            ip_address: Str, IP address of the Dirigera hub
+            token: Str, Dirigera API token
+            port: Int, port of the hub API
+            api_version: Str, version of the hub API
+            use_ssl: Bool, the hub uses a self-signed certificate, which is not verified (like the dirigera module)
+            max_connections: Int, max number of concurrent connections to the hub
+            reserved_connections: Int, connections only used by critical requests, see critical_request
+            timeout: Float, default per-request timeout in seconds, including waiting for a free connection
+        """
+        self.ip_address = ip_address
+        self.port = port
+        self.base_route = f"/{api_version}"
+        self.token = token
+        self.max_connections = max_connections
+        self.reserved_connections = reserved_connections
+        self.timeout = timeout
+        self.ssl_context = None
+        if use_ssl:
+            self.ssl_context = ssl.create_default_context()
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        # Connections and semaphores are bound to the event loop that created them
+        self._pools: dict[asyncio.AbstractEventLoop, _Pool] = {}
+
+    async def get(self, route: str, timeout: float | None = None) -> Any:
+        body = await self.request("GET", route, timeout=timeout)
+        return json.loads(body) if body else None
+
+    async def patch(self, route: str, data: list[dict[str, Any]], timeout: float | None = None) -> str:
+        return await self.request("PATCH", route, data, timeout=timeout)
+
+    async def post(self, route: str, data: dict[str, Any] | None = None, timeout: float | None = None) -> str:
+        return await self.request("POST", route, data, timeout=timeout)
+
+    async def request(self, method: str, route: str, data: Any = None, timeout: float | None = None) -> str:
+        """
+        Send a request to the hub API.
+        Args:
+            method: Str, HTTP method
+            route: Str, route relative to the API base, eg "/devices/<id>"
+            data: JSON serializable body, if any
+            timeout: Float, timeout in seconds. Defaults to the client timeout
+        Returns:
+            Str, response body
+        Raises:
+            TimeoutError if the request did not complete in time
+            HubRequestError if the hub returned an error status
+        """
+        body = json.dumps(data).encode() if data is not None else b""
+        request = (
+            f"{method} {self.base_route}{route} HTTP/1.1\r\n"
+            f"Host: {self.ip_address}:{self.port}\r\n"
+            f"Authorization: Bearer {self.token}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n"
+        ).encode() + body
+
+        async with asyncio.timeout(timeout or self.timeout):
+            pool = self._pool()
+            if critical_request.get():
+                async with pool.semaphore:
+                    status, response_body = await self._send(pool, request)
+            else:
+                async with pool.best_effort, pool.semaphore:
+                    status, response_body = await self._send(pool, request)
+
+        if status >= 400:
+            raise HubRequestError(status, response_body)
+        return response_body
+
+    async def close(self) -> None:
+        """
+        Close the idle connections of the running loop.
+        """
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool:
+            for connection in pool.idle:
+                connection.close()
+
+    def _pool(self) -> _Pool:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = _Pool(self.max_connections, self.reserved_connections)
+        return pool
+
+    async def _send(self, pool: _Pool, request: bytes) -> tuple[int, str]:
+        while True:
+            reused = bool(pool.idle)
+            connection = pool.idle.pop() if reused else await self._connect()
+            try:
+                connection.writer.write(request)
+                await connection.writer.drain()
+                status, response_body, keep_alive = await self._read_response(connection.reader)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                connection.close()
+                if reused:
+                    # The hub closed an idle keep-alive connection: retry once on a fresh one
+                    logger.debug(f"Stale connection to Dirigera hub, reconnecting: {e}")
+                    continue
+                raise
+            except BaseException:
+                # Eg timeout: the response may still arrive later, the connection can't be reused
+                connection.close()
+                raise
+            if keep_alive:
+                pool.idle.append(connection)
+            else:
+                connection.close()
+            return status, response_body
+
+    async def _connect(self) -> _Connection:
+        reader, writer = await asyncio.open_connection(self.ip_address, self.port, ssl=self.ssl_context)
+        return _Connection(reader, writer)
+
+    async def _read_response(self, reader: asyncio.StreamReader) -> tuple[int, str, bool]:
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readuntil(b"\r\n")
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        return status, body.decode(), keep_alive
+
+
+_shared_clients: dict[tuple[str, str], AsyncHubClient] = {}
+
+def shared_hub_client(ip_address: str, token: str) -> AsyncHubClient:
+    """
+    Get the AsyncHubClient for a hub, shared by all controllers so they share its connection pool.
+    """
+    key = (ip_address, token)
+    if key not in _shared_clients:
+        _shared_clients[key] = AsyncHubClient(ip_address, token)
+    return _shared_clients[key]
@@ -0,0 +1,212 @@
+# Local stand-in for a Dirigera hub, serving the endpoints used by the Dirigera controllers over plain HTTP.
+# Runs on its own event loop thread, so both the dirigera module (requests) and AsyncHubClient can talk to it.
+# Every request is recorded in `requests`: (time.monotonic(), method, path)
+
+import json
+import time
+import uuid
+import asyncio
+import threading
+from typing import Any
+
+import dirigera
+
+from devices.DirigeraAsyncClient import AsyncHubClient
+
+
+LIGHT_CAPABILITIES = ["customName", "isOn", "lightLevel", "colorHue", "colorSaturation", "colorTemperature"]
+OUTLET_CAPABILITIES = ["customName", "isOn", "startupOnOff"]
+
+
+class DirigeraHubSimulator:
+    def __init__(self, latency: float = 0.02, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            latency: Float, time in seconds the hub takes to answer each request
+            host: Str, address to listen on
+            port: Int, port to listen on. 0 picks a free port
+        """
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.token = "simulator-token"
+        self.devices: dict[str, dict[str, Any]] = {}
+        self.scenes: dict[str, dict[str, Any]] = {}
+        self.requests: list[tuple[float, str, str]] = []
+        self.connections = 0
+        self.outage = None # None, "refuse" to drop connections, or "hang" to never answer, until cleared
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._writers = set()
+
+    def add_light(self, name: str, is_on: bool = False) -> str:
+        return self._add_device(name, "light", "light", {
+            "isOn": is_on,
+            "lightLevel": 100,
+            "colorHue": 0.0,
+            "colorSaturation": 0.0,
+            "colorTemperatureMin": 4000,
+            "colorTemperatureMax": 2202,
+            }, LIGHT_CAPABILITIES)
+
+    def add_outlet(self, name: str, is_on: bool = False) -> str:
+        return self._add_device(name, "outlet", "outlet", {"isOn": is_on}, OUTLET_CAPABILITIES)
+
+    def add_scene(self, name: str, device_attributes: dict[str, dict[str, Any]]) -> str:
+        """
+        Add a scene, setting the attributes of several devices at once when triggered
+        Args:
+            name: Str, name of the scene
+            device_attributes: Dict, device id -> attributes to set, eg {light_id: {"isOn": True, "lightLevel": 50}}
+        Returns:
+            Str, id of the scene
+        """
+        scene_id = str(uuid.uuid4())
+        self.scenes[scene_id] = {
+            "id": scene_id,
+            "info": {"name": name, "icon": "scenes_music_note"},
+            "type": "userScene",
+            "triggers": [],
+            "actions": [
+                {"id": device_id, "type": "device", "deviceId": device_id, "attributes": attributes}
+                for device_id, attributes in device_attributes.items()
+                ],
+            "createdAt": "2025-01-01T00:00:00.000Z",
+            "lastTriggered": None,
+            }
+        return scene_id
+
+    def start(self) -> "DirigeraHubSimulator":
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self._server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        async def shutdown():
+            self._server.close()
+            # Closing the client connections ends their handlers
+            for writer in list(self._writers):
+                writer.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.wait(tasks, timeout=self.latency + 1) if tasks else None
+            self.loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        self._thread.join()
+        self.loop.close()
+
+    def make_hub(self) -> dirigera.Hub:
+        """
+        dirigera.Hub talking to the simulator, for the synchronous code paths.
+        """
+        hub = dirigera.Hub(token=self.token, ip_address=self.host)
+        hub.api_base_url = f"http://{self.host}:{self.port}/v1"
+        return hub
+
+    def make_client(self, **kwargs) -> AsyncHubClient:
+        """
+        AsyncHubClient talking to the simulator, for the native async code paths.
+        """
+        return AsyncHubClient(self.host, self.token, port=self.port, use_ssl=False, **kwargs)
+
+    def _add_device(self, name: str, device_type: str, type_: str, attributes: dict, capabilities: list[str]) -> str:
+        device_id = str(uuid.uuid4())
+        now = "2025-01-01T00:00:00.000Z"
+        self.devices[device_id] = {
+            "id": device_id,
+            "type": type_,
+            "deviceType": device_type,
+            "createdAt": now,
+            "isReachable": True,
+            "lastSeen": now,
+            "attributes": {
+                "customName": name,
+                "model": "Simulated",
+                "manufacturer": "IKEA of Sweden",
+                "firmwareVersion": "1.0.0",
+                "hardwareVersion": "1",
+                **attributes,
+                },
+            "capabilities": {"canSend": [], "canReceive": capabilities},
+            "deviceSet": [],
+            "remoteLinks": [],
+            }
+        return device_id
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests.append((time.monotonic(), method, path))
+
+                if self.outage == "refuse":
+                    break
+                while self.outage == "hang" and not writer.is_closing():
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(self.latency)
+                status, response = self._route(method, path, json.loads(body) if body else None, headers)
+                payload = json.dumps(response).encode() if response is not None else b""
+                reason = {200: "OK", 202: "Accepted", 401: "Unauthorized", 404: "Not Found"}.get(status, "Error")
+                writer.write(
+                    f"HTTP/1.1 {status} {reason}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "\r\n".encode() + payload
+                    )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _route(self, method: str, path: str, data: Any, headers: dict[str, str]) -> tuple[int, Any]:
+        if headers.get("authorization") != f"Bearer {self.token}":
+            return 401, None
+        parts = path.strip("/").split("/")[1:] # Drop the api version
+        if parts == ["devices"] and method == "GET":
+            return 200, list(self.devices.values())
+        if len(parts) == 2 and parts[0] == "devices" and parts[1] in self.devices:
+            device = self.devices[parts[1]]
+            if method == "GET":
+                return 200, device
+            if method == "PATCH":
+                for item in data:
+                    device["attributes"].update(item.get("attributes", {}))
+                return 202, None
+        if parts == ["scenes"] and method == "GET":
+            return 200, list(self.scenes.values())
+        if len(parts) >= 2 and parts[0] == "scenes" and parts[1] in self.scenes:
+            scene = self.scenes[parts[1]]
+            if len(parts) == 2 and method == "GET":
+                return 200, scene
+            if parts[2:] == ["trigger"] and method == "POST":
+                # All the devices of the scene change at once
+                for action in scene["actions"]:
+                    self.devices[action["deviceId"]]["attributes"].update(action["attributes"])
+                scene["lastTriggered"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+                return 202, None
+        return 404, None
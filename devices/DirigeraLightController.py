@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import requests
 import asyncio
@@ -7,6 +8,7 @@ import dirigera
 from loguru import logger
 
 from devices.LightController import LightController
+from devices.DirigeraAsyncClient import AsyncHubClient, shared_hub_client
 
 
 COLOR_TO_HEX = {
@@ -26,24 +28,38 @@ COLOR_TO_HEX = {
     }
 
 class DirigeraLightController(LightController):
-    def __init__(self, light_name: str):
+    def __init__(
+            self,
+            light_name: str,
+            dirigera_hub: dirigera.Hub | None = None,
+            hub_client: AsyncHubClient | None = None,
+            ):
         """
         Args:
             light_name: Name of the light to control, e.g. "recording_light".
                         Refer to the name set in the Ikea Smart Home app.
+            dirigera_hub: dirigera.Hub to use for discovery and synchronous calls.
+                        Defaults to the hub at DIRIGERA_IP_ADDRESS, eg pass a DirigeraHubSimulator hub in tests
+            hub_client: AsyncHubClient for native async calls. Defaults to the shared client for the hub at
+                        DIRIGERA_IP_ADDRESS. When a dirigera_hub is passed without a hub_client,
+                        async calls fall back to running the synchronous calls in a thread
         """
-        # Get env var DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS
-        dirigera_token = os.getenv("DIRIGERA_TOKEN")
-        dirigera_ip_address = os.getenv("DIRIGERA_IP_ADDRESS")
-        if not dirigera_token or not dirigera_ip_address:
-            logger.error("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
-            raise ValueError("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
-
-        logger.info(f"Connecting to Dirigera Hub at {dirigera_ip_address}...")
-        self.dirigera_hub = dirigera.Hub(
-            token=dirigera_token,
-            ip_address=dirigera_ip_address,
-        )
+        if dirigera_hub is None:
+            # Get env var DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS
+            dirigera_token = os.getenv("DIRIGERA_TOKEN")
+            dirigera_ip_address = os.getenv("DIRIGERA_IP_ADDRESS")
+            if not dirigera_token or not dirigera_ip_address:
+                logger.error("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
+                raise ValueError("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
+
+            logger.info(f"Connecting to Dirigera Hub at {dirigera_ip_address}...")
+            dirigera_hub = dirigera.Hub(
+                token=dirigera_token,
+                ip_address=dirigera_ip_address,
+            )
+            hub_client = hub_client or shared_hub_client(dirigera_ip_address, dirigera_token)
+        self.dirigera_hub = dirigera_hub
+        self.hub_client = hub_client
 
         self.light = None
 
@@ -52,7 +68,7 @@ class DirigeraLightController(LightController):
         except requests.exceptions.ConnectionError as e:
             # Dirigera Hub IP is likely wrong
             logger.exception(e)
-            logger.warning(f"Could not connect to Dirigera Hub at {dirigera_ip_address}. Please check the connection.")
+            logger.warning(f"Could not connect to Dirigera Hub at {self.dirigera_hub.api_base_url}. Please check the connection.")
             raise e
 
         for light in lights:
@@ -84,6 +100,14 @@ class DirigeraLightController(LightController):
     def turn_off(self) -> None:
         self.light.set_light(lamp_on=False)
 
+    def set_level(self, level: int) -> None:
+        """
+        Set the brightness of the light, keeping its color.
+        Args:
+            level: Int, light level from 1 to 100
+        """
+        self.light.set_light_level(light_level=min(max(level, 1), 100))
+
     async def async_turn_on(self, hex_color: str | None = None) -> None:
         """
         Turn on the light asynchronously with the specified hex color.
@@ -91,13 +115,32 @@ class DirigeraLightController(LightController):
         Args:
             hex_color: Str, hex color code
         """
-        await asyncio.to_thread(self.turn_on, hex_color)
+        if not self.hub_client:
+            await asyncio.to_thread(self.turn_on, hex_color)
+            return
+        if not self.light.attributes.is_on:
+            await self._async_patch(isOn=True)
+            self.light.attributes.is_on = True
+        if hex_color:
+            hue, saturation, value = hex_to_hsv(hex_color)
+            await self._async_patch(colorHue=hue, colorSaturation=saturation / 100)
+            await self._async_patch(lightLevel=value)
+            self.light.attributes.color_hue = hue
+            self.light.attributes.color_saturation = saturation / 100
+            self.light.attributes.light_level = value
 
     async def async_turn_off(self) -> None:
         """
         Turn off the light asynchronously.
         """
-        await asyncio.to_thread(self.turn_off)
+        if not self.hub_client:
+            await asyncio.to_thread(self.turn_off)
+            return
+        await self._async_patch(isOn=False)
+        self.light.attributes.is_on = False
+
+    async def _async_patch(self, **attributes) -> None:
+        await self.hub_client.patch(f"/devices/{self.light.id}", [{"attributes": attributes}])
 
     def health_check(self) -> None:
         logger.info(f"Performing health check for Dirigera light {self.light_name}...")
@@ -108,6 +151,37 @@ class DirigeraLightController(LightController):
         self.turn_on(hex_color=COLOR_TO_HEX["green"])
         logger.info(f"Health check: Dirigera light {self.light_name} OK.")
 
+    async def async_set_level(self, level: int) -> None:
+        """
+        Set the brightness of the light asynchronously.
+        Args:
+            level: Int, light level from 1 to 100
+        """
+        if not self.hub_client:
+            await asyncio.to_thread(self.set_level, level)
+            return
+        level = min(max(level, 1), 100)
+        await self._async_patch(lightLevel=level)
+        self.light.attributes.light_level = level
+
+    @property
+    def name(self) -> str:
+        return self.light_name
+
+    @property
+    def device(self) -> dirigera.devices.light.Light:
+        return self.light
+
+    async def async_probe(self) -> None:
+        """
+        Fetch the light from the hub without changing its state. Raises if the hub can't be reached.
+        """
+        route = f"/devices/{self.light.id}"
+        if self.hub_client:
+            await self.hub_client.get(route)
+        else:
+            await asyncio.to_thread(self.dirigera_hub.get, route)
+
     async def async_health_check(self) -> None:
         logger.info(f"Performing health check for Dirigera light {self.light_name}...")
         await self.async_turn_on(hex_color=COLOR_TO_HEX["green"])
@@ -121,30 +195,41 @@ class DirigeraLightController(LightController):
 # Timing comparison functions
 def time_sync_operations(lights: list[DirigeraLightController]) -> float:
     """
-    Time synchronous operations on a list of smart lights.
+    Time synchronous color changes on a list of smart lights, one after the other.
     Returns elapsed time in seconds.
     """
     start_time = time.time()
 
     for light in lights:
-        light.health_check()
+        light.turn_on(hex_color=COLOR_TO_HEX["green"])
 
     end_time = time.time()
     return end_time - start_time
 
 
-async def time_async_operations(lights: list[DirigeraLightController]) -> float:
+async def time_thread_operations(lights: list[DirigeraLightController]) -> float:
     """
-    Time asynchronous operations on a list of smart lights.
+    Time concurrent color changes on a list of smart lights, each synchronous call running in a thread.
     Returns elapsed time in seconds.
     """
     start_time = time.time()
 
-    # Create a list of coroutines to execute
-    tasks = [light.async_health_check() for light in lights]
+    # Run all color changes concurrently, capped by the size of the default thread pool
+    await asyncio.gather(*[asyncio.to_thread(light.turn_on, COLOR_TO_HEX["pink"]) for light in lights])
 
-    # Run all health checks concurrently
-    await asyncio.gather(*tasks)
+    end_time = time.time()
+    return end_time - start_time
+
+
+async def time_async_operations(lights: list[DirigeraLightController]) -> float:
+    """
+    Time concurrent color changes on a list of smart lights, using the native async client.
+    Returns elapsed time in seconds.
+    """
+    start_time = time.time()
+
+    # Run all color changes concurrently on the event loop
+    await asyncio.gather(*[light.async_turn_on(hex_color=COLOR_TO_HEX["orange"]) for light in lights])
 
     end_time = time.time()
     return end_time - start_time
@@ -152,20 +237,42 @@ async def time_async_operations(lights: list[DirigeraLightController]) -> float:
 
 async def run_timing_comparison(lights: list[DirigeraLightController]) -> None:
     """
-    Run and report timing comparison between sync and async operations.
+    Run and report timing comparison between sync, to_thread and native async operations.
     """
     # Time synchronous operations
     sync_time = time_sync_operations(lights)
-    logger.info(f"Synchronous operation time: {sync_time:.2f} seconds")
+    logger.info(f"[{len(lights)} lights] Synchronous operation time: {sync_time:.2f} seconds")
+
+    # Time to_thread operations
+    thread_time = await time_thread_operations(lights)
+    logger.info(f"[{len(lights)} lights] to_thread operation time: {thread_time:.2f} seconds")
 
-    # Time asynchronous operations
+    # Time native asynchronous operations
     async_time = await time_async_operations(lights)
-    logger.info(f"Asynchronous operation time: {async_time:.2f} seconds")
+    logger.info(f"[{len(lights)} lights] Native async operation time: {async_time:.2f} seconds")
 
     improvement = (sync_time - async_time) / sync_time * 100
-    logger.info(f"Improvement: {improvement:.2f}%")
+    logger.info(f"[{len(lights)} lights] Improvement over synchronous: {improvement:.2f}%")
     return
 
+
+async def run_simulated_timing_comparison(n_lights: list[int] = [1, 10, 50]) -> None:
+    """
+    Run the timing comparison against a local Dirigera hub simulator, with an increasing number of fake lights.
+    """
+    from devices.DirigeraHubSimulator import DirigeraHubSimulator
+
+    for n in n_lights:
+        simulator = DirigeraHubSimulator().start()
+        for i in range(n):
+            simulator.add_light(f"light_{i}", is_on=True)
+        hub = simulator.make_hub()
+        hub_client = simulator.make_client(max_connections=n)
+        lights = [DirigeraLightController(f"light_{i}", dirigera_hub=hub, hub_client=hub_client) for i in range(n)]
+        await run_timing_comparison(lights)
+        await hub_client.close()
+        simulator.stop()
+
 def hex_to_hsv(hex_color: str) -> tuple[float, float, float]:
     """
     Convert hex color to HSV
@@ -199,6 +306,10 @@ def hex_to_hsv(hex_color: str) -> tuple[float, float, float]:
     return hue, saturation, value
 
 if __name__ == "__main__":
+    if "--simulator" in sys.argv:
+        asyncio.run(run_simulated_timing_comparison())
+        exit(0)
+
     light_controller = DirigeraLightController("recording_light")
     asyncio.run(run_timing_comparison([light_controller]))
     exit(0)
@@ -1,34 +1,52 @@
 import os
+import sys
 import time
 import asyncio
-import time
 
+import requests
 import dirigera
 from dirigera.devices.device import StartupEnum
 from loguru import logger
 
 from devices.LightController import LightController
+from devices.DirigeraAsyncClient import AsyncHubClient, shared_hub_client
 
 
 class DirigeraPlugController(LightController):
-    def __init__(self, plug_name: str, start_on: bool = False):
+    def __init__(
+            self,
+            plug_name: str,
+            start_on: bool = False,
+            dirigera_hub: dirigera.Hub | None = None,
+            hub_client: AsyncHubClient | None = None,
+            ):
         """
         Args:
             plug_name: Name of the plug to control, e.g. "disco_ball".
                        Refer to the name set in the Ikea Smart Home app.
+            start_on: Bool, whether the plug turns on when power comes back
+            dirigera_hub: dirigera.Hub to use for discovery and synchronous calls.
+                       Defaults to the hub at DIRIGERA_IP_ADDRESS, eg pass a DirigeraHubSimulator hub in tests
+            hub_client: AsyncHubClient for native async calls. Defaults to the shared client for the hub at
+                       DIRIGERA_IP_ADDRESS. When a dirigera_hub is passed without a hub_client,
+                       async calls fall back to running the synchronous calls in a thread
         """
-        # Get env var DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS
-        dirigera_token = os.getenv("DIRIGERA_TOKEN")
-        dirigera_ip_address = os.getenv("DIRIGERA_IP_ADDRESS")
-        if not dirigera_token or not dirigera_ip_address:
-            logger.error("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
-            raise ValueError("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
-
-        self.dirigera_hub = dirigera.Hub(
-            token=dirigera_token,
-            ip_address=dirigera_ip_address,
-        )
-        logger.info(f"Connected to Dirigera Hub at {dirigera_ip_address}")
+        if dirigera_hub is None:
+            # Get env var DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS
+            dirigera_token = os.getenv("DIRIGERA_TOKEN")
+            dirigera_ip_address = os.getenv("DIRIGERA_IP_ADDRESS")
+            if not dirigera_token or not dirigera_ip_address:
+                logger.error("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
+                raise ValueError("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
+
+            dirigera_hub = dirigera.Hub(
+                token=dirigera_token,
+                ip_address=dirigera_ip_address,
+            )
+            hub_client = hub_client or shared_hub_client(dirigera_ip_address, dirigera_token)
+        self.dirigera_hub = dirigera_hub
+        self.hub_client = hub_client
+        logger.info(f"Connected to Dirigera Hub at {self.dirigera_hub.api_base_url}")
 
         self.plug = None
 
@@ -37,7 +55,7 @@ class DirigeraPlugController(LightController):
         except requests.exceptions.ConnectionError as e:
             # Dirigera Hub IP is likely wrong
             logger.exception(e)
-            logger.error(f"Could not connect to Dirigera Hub at {dirigera_ip_address}. Please check the connection.")
+            logger.error(f"Could not connect to Dirigera Hub at {self.dirigera_hub.api_base_url}. Please check the connection.")
             raise e
             exit(1)
 
@@ -86,13 +104,45 @@ class DirigeraPlugController(LightController):
         """
         Turn on the plug asynchronously.
         """
-        await asyncio.to_thread(self.turn_on)
+        if not self.hub_client:
+            await asyncio.to_thread(self.turn_on)
+            return
+        logger.info(f"Turning on plug {self.plug_name}")
+        if not self.plug.attributes.is_on:
+            await self._async_set_on(True)
 
     async def async_turn_off(self) -> None:
         """
         Turn off the plug asynchronously.
         """
-        await asyncio.to_thread(self.turn_off)
+        if not self.hub_client:
+            await asyncio.to_thread(self.turn_off)
+            return
+        logger.info(f"Turning off plug {self.plug_name}")
+        if self.plug.attributes.is_on:
+            await self._async_set_on(False)
+
+    async def _async_set_on(self, outlet_on: bool) -> None:
+        await self.hub_client.patch(f"/devices/{self.plug.id}", [{"attributes": {"isOn": outlet_on}}])
+        self.plug.attributes.is_on = outlet_on
+
+    @property
+    def name(self) -> str:
+        return self.plug_name
+
+    @property
+    def device(self) -> dirigera.devices.outlet.Outlet:
+        return self.plug
+
+    async def async_probe(self) -> None:
+        """
+        Fetch the plug from the hub without changing its state. Raises if the hub can't be reached.
+        """
+        route = f"/devices/{self.plug.id}"
+        if self.hub_client:
+            await self.hub_client.get(route)
+        else:
+            await asyncio.to_thread(self.dirigera_hub.get, route)
 
     async def async_health_check(self) -> None:
         await self.async_turn_on()
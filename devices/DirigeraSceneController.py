@@ -0,0 +1,161 @@
+# Triggers a scene stored on the Dirigera hub: one request switches all the devices of the scene together,
+# instead of one to three requests per device. Scenes are created in the IKEA Home smart app.
+
+import os
+import asyncio
+
+import dirigera
+from loguru import logger
+
+from devices.LightController import LightController
+from devices.DirigeraAsyncClient import AsyncHubClient, shared_hub_client
+
+
+# Scene action attributes -> attributes of the dirigera device models, to keep the controllers' cached state in sync
+CACHED_ATTRIBUTES = {
+    "isOn": "is_on",
+    "lightLevel": "light_level",
+    "colorHue": "color_hue",
+    "colorSaturation": "color_saturation",
+    }
+
+
+class DirigeraSceneController(LightController):
+    def __init__(
+            self,
+            scene_name: str,
+            controllers: list[LightController] | None = None,
+            dirigera_hub: dirigera.Hub | None = None,
+            hub_client: AsyncHubClient | None = None,
+            ):
+        """
+        Args:
+            scene_name: Name of the scene to trigger, as set in the Ikea Smart Home app.
+            controllers: Dirigera device controllers, eg DirigeraLightController, whose cached state is updated
+                        when the scene is triggered, so that their next command isn't skipped as already done
+            dirigera_hub: dirigera.Hub to use for discovery and synchronous calls.
+                        Defaults to the hub at DIRIGERA_IP_ADDRESS, eg pass a DirigeraHubSimulator hub in tests
+            hub_client: AsyncHubClient for native async calls. Defaults to the shared client for the hub at
+                        DIRIGERA_IP_ADDRESS. When a dirigera_hub is passed without a hub_client,
+                        async calls fall back to running the synchronous calls in a thread
+        """
+        if dirigera_hub is None:
+            # Get env var DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS
+            dirigera_token = os.getenv("DIRIGERA_TOKEN")
+            dirigera_ip_address = os.getenv("DIRIGERA_IP_ADDRESS")
+            if not dirigera_token or not dirigera_ip_address:
+                logger.error("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
+                raise ValueError("Please set the environment variables DIRIGERA_TOKEN and DIRIGERA_IP_ADDRESS")
+
+            dirigera_hub = dirigera.Hub(
+                token=dirigera_token,
+                ip_address=dirigera_ip_address,
+            )
+            hub_client = hub_client or shared_hub_client(dirigera_ip_address, dirigera_token)
+        self.dirigera_hub = dirigera_hub
+        self.hub_client = hub_client
+        self.controllers = controllers or []
+
+        # Raw scenes: only their id, name and device actions are needed
+        scenes = self.dirigera_hub.get("/scenes")
+        scene = next((scene for scene in scenes if scene["info"]["name"] == scene_name), None)
+        if not scene:
+            logger.error(f"No Dirigera scene with name '{scene_name}' found")
+            logger.error(f"Available scenes: {[scene['info']['name'] for scene in scenes]}")
+            raise ValueError(f"No Dirigera scene with name '{scene_name}' found")
+
+        self.scene_name = scene_name
+        self.scene_id = scene["id"]
+        # Device id -> attributes the scene sets
+        self.actions = {
+            action.get("deviceId", action["id"]): action.get("attributes", {})
+            for action in scene.get("actions", [])
+            if action.get("type", "device") == "device"
+            }
+
+    def turn_on(self, hex_color: str | None = None) -> None:
+        """
+        Trigger the scene. The colors are the ones stored in the scene, hex_color is ignored.
+        """
+        logger.info(f"Triggering scene {self.scene_name}")
+        previous = self._update_controllers()
+        try:
+            self.dirigera_hub.post(f"/scenes/{self.scene_id}/trigger")
+        except Exception:
+            self._restore_controllers(previous)
+            raise
+
+    def turn_off(self) -> None:
+        """
+        A scene has no off state: turn off its devices with their own controllers.
+        """
+        pass
+
+    def health_check(self) -> None:
+        self.dirigera_hub.get(f"/scenes/{self.scene_id}")
+        logger.info(f"Scene {self.scene_name} OK")
+
+    async def async_turn_on(self, hex_color: str | None = None) -> None:
+        """
+        Trigger the scene asynchronously.
+        """
+        if not self.hub_client:
+            await asyncio.to_thread(self.turn_on, hex_color)
+            return
+        logger.info(f"Triggering scene {self.scene_name}")
+        previous = self._update_controllers()
+        try:
+            await self.hub_client.post(f"/scenes/{self.scene_id}/trigger")
+        except Exception:
+            self._restore_controllers(previous)
+            raise
+
+    async def async_turn_off(self) -> None:
+        pass
+
+    def _update_controllers(self) -> list[tuple]:
+        """
+        Set the cached state of the scene's devices before the trigger is sent: a device command dispatched while
+        the scene is in flight then sees the state the scene is setting, and isn't skipped as already done.
+        The DeviceDispatcher runs the scene and the device commands on one queue, in order, except a critical scene or
+        command superseding the older best-effort commands setting the same devices
+        Returns:
+            List of (device attributes, attribute name, previous value), to restore if the trigger fails
+        """
+        previous = []
+        for controller in self.controllers:
+            attributes = self.actions.get(controller.device.id)
+            if not attributes:
+                continue
+            cached = controller.device.attributes
+            for attribute, value in attributes.items():
+                if attribute in CACHED_ATTRIBUTES:
+                    previous.append((cached, CACHED_ATTRIBUTES[attribute], getattr(cached, CACHED_ATTRIBUTES[attribute])))
+                    setattr(cached, CACHED_ATTRIBUTES[attribute], value)
+        return previous
+
+    def _restore_controllers(self, previous: list[tuple]) -> None:
+        for cached, attribute, value in previous:
+            setattr(cached, attribute, value)
+
+    @property
+    def name(self) -> str:
+        return self.scene_name
+
+    @property
+    def devices(self) -> list[LightController]:
+        return [controller for controller in self.controllers if controller.device.id in self.actions]
+
+    async def async_probe(self) -> None:
+        """
+        Fetch the scene from the hub without triggering it. Raises if the hub can't be reached.
+        """
+        route = f"/scenes/{self.scene_id}"
+        if self.hub_client:
+            await self.hub_client.get(route)
+        else:
+            await asyncio.to_thread(self.dirigera_hub.get, route)
+
+    async def async_health_check(self) -> None:
+        await self.async_probe()
+        logger.info(f"Scene {self.scene_name} OK")
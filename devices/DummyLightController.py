@@ -8,6 +8,9 @@ from devices.LightController import LightController
 
 
 class DummyLightController(LightController):
+    # Only logs, safe to run inline
+    is_blocking = False
+
     def __init__(self, pin:int):
         logger.info(f"Dummy light init with pin={pin}")
 
@@ -0,0 +1,214 @@
+# Light effects (fade, pulse, blink) for a GPIOLightController, driven by GPIO PWM.
+# Effects are scheduled as timers on an event loop (eg the AsyncWorker loop): no thread sleeps between writes.
+# Each effect is a sequence of keyframes (offset in seconds from the effect start, duty cycle in %),
+# scheduled at absolute times so that a late timer never pushes back the following ones.
+
+import threading
+from typing import Iterable, Iterator
+
+from loguru import logger
+
+from devices.GPIOLightController import GPIOLightController
+
+
+PWM_FREQUENCY = 200 # Hz, high enough for a LED to not visibly flicker
+FADE_STEPS_PER_SECOND = 50
+
+
+def fade(start:float, end:float, duration:float, steps:int|None=None) -> Iterator[tuple[float, float]]:
+    """
+    Keyframes for a linear fade between 2 duty cycles.
+    Args:
+        start: Float, duty cycle at the start of the fade, from 0 to 100
+        end: Float, duty cycle at the end of the fade, from 0 to 100
+        duration: Float, duration of the fade in seconds
+        steps: Int, number of duty cycle changes. Defaults to FADE_STEPS_PER_SECOND * duration
+    """
+    steps = steps or max(1, int(duration * FADE_STEPS_PER_SECOND))
+    for i in range(steps + 1):
+        yield duration * i / steps, start + (end - start) * i / steps
+
+
+def blink(count:int, on_s:float, off_s:float) -> Iterator[tuple[float, float]]:
+    """
+    Keyframes for blinking the light count times. The light is off at the end.
+    """
+    for i in range(count):
+        offset = i * (on_s + off_s)
+        yield offset, 100.0
+        yield offset + on_s, 0.0
+
+
+def pulse(period:float, count:int|None=None, steps:int|None=None) -> Iterator[tuple[float, float]]:
+    """
+    Keyframes for fading the light up then down every period seconds.
+    Args:
+        period: Float, duration of one pulse in seconds
+        count: Int, number of pulses. Pulses forever if None, until cancelled or pre-empted
+        steps: Int, number of duty cycle changes per half pulse
+    """
+    i = 0
+    while count is None or i < count:
+        for offset, duty in fade(0.0, 100.0, period / 2, steps):
+            yield i * period + offset, duty
+        for offset, duty in fade(100.0, 0.0, period / 2, steps):
+            if offset > 0:
+                yield i * period + period / 2 + offset, duty
+        i += 1
+
+
+class GPIOEffectsEngine:
+    def __init__(self, light:GPIOLightController, loop, frequency:float=PWM_FREQUENCY):
+        """
+        Args:
+            light: GPIOLightController object whose pin is driven by the effects
+            loop: Event loop to schedule effect steps on, eg AsyncWorker.loop
+            frequency: Float, PWM frequency in Hz
+        """
+        self.light = light
+        self.loop = loop
+        self.pwm = light.gpio.PWM(light.pin, frequency)
+        self._pwm_running = False
+        self._lock = threading.Lock()
+        self._generation = 0 # Bumped by every new effect or cancel: stale steps become no-ops
+        self._handle = None
+        self._last_duty = 0.0
+        light.effects = self
+
+    def play(self, keyframes:Iterable[tuple[float, float]]) -> None:
+        """
+        Start an effect, pre-empting the running one. Safe to call from any thread.
+        When the effect ends fully on or fully off, the pin goes back to a plain HIGH or LOW output.
+        Args:
+            keyframes: Iterable of (offset in seconds, duty cycle), eg fade(0, 100, 1)
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self.light.is_on = False
+        self.loop.call_soon_threadsafe(self._start, generation, iter(keyframes))
+
+    def pulse_unless_on(self, duration:float) -> bool:
+        """
+        Blink the light once, unless it is solidly on (eg recording). Safe to call from any thread: checked and
+        started under the lock, so a concurrent turn_on is never undone by the pulse
+        Args:
+            duration: Float, duration of the pulse in seconds
+        Returns:
+            Bool, whether the pulse was started
+        """
+        with self._lock:
+            if self.light.is_on:
+                return False
+            self._generation += 1
+            generation = self._generation
+        self.loop.call_soon_threadsafe(self._start, generation, blink(1, duration, 0.0))
+        return True
+
+    def hold(self, on:bool) -> None:
+        """
+        Stop the running effect, if any, and leave the light solidly on or off. Safe to call from any thread.
+        """
+        with self._lock:
+            self._generation += 1
+            self._stop_pwm()
+            gpio = self.light.gpio
+            gpio.output(self.light.pin, gpio.HIGH if on else gpio.LOW)
+            self.light.is_on = on
+
+    def cancel(self) -> None:
+        """
+        Stop the running effect, if any. Safe to call from any thread.
+        The pin is left LOW: use hold to stop the effect and set the light on or off at once
+        """
+        with self._lock:
+            self._generation += 1
+            self._stop_pwm()
+
+    def fade_in(self, duration:float) -> None:
+        self.play(fade(0.0, 100.0, duration))
+
+    def fade_out(self, duration:float) -> None:
+        self.play(fade(100.0, 0.0, duration))
+
+    def pulse(self, period:float, count:int|None=None) -> None:
+        self.play(pulse(period, count))
+
+    def blink(self, count:int, on_s:float=0.25, off_s:float=0.25) -> None:
+        self.play(blink(count, on_s, off_s))
+
+    def count_in(self, beats:int, bpm:float) -> None:
+        """
+        Blink once per beat, then stay on. Eg before recording starts.
+        """
+        beat = 60.0 / bpm
+        keyframes = list(blink(beats, beat / 2, beat / 2))
+        keyframes.append((beats * beat, 100.0))
+        self.play(keyframes)
+
+    def _start(self, generation:int, keyframes:Iterator[tuple[float, float]]) -> None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if generation != self._generation:
+            return
+        self._schedule_next(generation, keyframes, self.loop.time())
+
+    def _schedule_next(self, generation:int, keyframes:Iterator[tuple[float, float]], start:float) -> None:
+        try:
+            offset, duty = next(keyframes)
+        except StopIteration:
+            self._handle = None
+            self._finish(generation)
+            return
+        self._handle = self.loop.call_at(start + offset, self._step, generation, keyframes, start, duty)
+
+    def _step(self, generation:int, keyframes:Iterator[tuple[float, float]], start:float, duty:float) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._set_duty(duty)
+        self._schedule_next(generation, keyframes, start)
+
+    def _finish(self, generation:int) -> None:
+        with self._lock:
+            if generation != self._generation or 0.0 < self._last_duty < 100.0:
+                return
+            gpio = self.light.gpio
+            value = gpio.HIGH if self._last_duty >= 100.0 else gpio.LOW
+            self._stop_pwm()
+            gpio.output(self.light.pin, value)
+            self.light.is_on = value == gpio.HIGH
+
+    def _set_duty(self, duty:float) -> None:
+        if self._pwm_running:
+            self.pwm.ChangeDutyCycle(duty)
+        else:
+            self.pwm.start(duty)
+            self._pwm_running = True
+        self._last_duty = duty
+
+    def _stop_pwm(self) -> None:
+        if self._pwm_running:
+            self.pwm.stop()
+            self._pwm_running = False
+            self._last_duty = 0.0
+
+
+if __name__ == "__main__":
+    import time
+    from AsyncWorker import AsyncWorker
+
+    async_worker = AsyncWorker()
+    light = GPIOLightController(16)
+    effects = GPIOEffectsEngine(light, async_worker.loop)
+
+    logger.info("Count-in, 4 beats at 120 BPM")
+    effects.count_in(beats=4, bpm=120)
+    time.sleep(3)
+    logger.info("Pulse")
+    effects.pulse(period=1.0)
+    time.sleep(3)
+    logger.info("Fade out")
+    effects.fade_out(1.0)
+    time.sleep(1.5)
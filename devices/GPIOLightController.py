@@ -1,26 +1,51 @@
-# Will only work on raspberry pi
+# Will only work on raspberry pi. Elsewhere, the stub GPIO module is used (eg for benchmarking)
 import time
 import asyncio
+import statistics
 
 from loguru import logger
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    logger.warning("RPi.GPIO not available, using stub GPIO module")
+    from devices import StubGPIO as GPIO
 
 from devices.LightController import LightController
 
 
 class GPIOLightController(LightController):
-    def __init__(self, pin:int):
+    # GPIO.output is a microsecond register write: run it inline, never through a thread
+    is_blocking = False
+    effects = None # Set by GPIOEffectsEngine, pre-empted by turn_on/turn_off
+
+    def __init__(self, pin:int, gpio=GPIO):
+        """
+        Args:
+            pin: Int, pin number in GPIO.BOARD numbering
+            gpio: GPIO module to drive the pin with. Defaults to RPi.GPIO, or the stub GPIO module
+                  when not running on a raspberry pi
+        """
         self.pin = pin
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setwarnings(False)
-        GPIO.setup(self.pin, GPIO.OUT)
+        self.gpio = gpio
+        self.is_on = False # Solidly on, eg recording. False while an effect is playing
+        self.gpio.setmode(self.gpio.BOARD)
+        self.gpio.setwarnings(False)
+        self.gpio.setup(self.pin, self.gpio.OUT)
         logger.info(f"Set pin #{self.pin} to OUT in [GPIO.BOARD] mode")
 
     def turn_on(self, hex_color:str|None=None):
-        GPIO.output(self.pin, GPIO.HIGH)
+        if self.effects:
+            self.effects.hold(True)
+            return
+        self.gpio.output(self.pin, self.gpio.HIGH)
+        self.is_on = True
 
     def turn_off(self):
-        GPIO.output(self.pin, GPIO.LOW)
+        if self.effects:
+            self.effects.hold(False)
+            return
+        self.gpio.output(self.pin, self.gpio.LOW)
+        self.is_on = False
 
     def health_check(self):
         self.turn_off()
@@ -30,23 +55,76 @@ class GPIOLightController(LightController):
         logger.info("GPIO light OK")
 
     async def async_turn_on(self, hex_color:str|None=None):
-        await asyncio.to_thread(self.turn_on, hex_color)
+        self.turn_on(hex_color)
 
     async def async_turn_off(self):
-        await asyncio.to_thread(self.turn_off)
+        self.turn_off()
 
     async def async_health_check(self):
-        await asyncio.to_thread(self.turn_off)
+        self.turn_off()
         await asyncio.sleep(1)
-        await asyncio.to_thread(self.turn_on)
+        self.turn_on()
         await asyncio.sleep(1)
-        await asyncio.to_thread(self.turn_off)
+        self.turn_off()
         logger.info("GPIO light OK")
 
+
+# Timing comparison functions. Pin write timestamps come from the stub GPIO module
+def time_threaded_writes(light:GPIOLightController, async_worker, n:int=1000) -> list[float]:
+    """
+    Time receive-to-pin latency when each pin write hops onto the event loop then a worker thread.
+    Returns a list of latencies in seconds.
+    """
+    latencies = []
+    for i in range(n):
+        tic = time.perf_counter()
+        action = light.turn_on if i % 2 == 0 else light.turn_off
+        async_worker.run_task(asyncio.to_thread(action)).result()
+        latencies.append(light.gpio.events[-1][0] - tic)
+    return latencies
+
+
+def time_inline_writes(light:GPIOLightController, dispatcher, n:int=1000) -> list[float]:
+    """
+    Time receive-to-pin latency when the dispatcher runs the pin write inline.
+    Returns a list of latencies in seconds.
+    """
+    latencies = []
+    for i in range(n):
+        tic = time.perf_counter()
+        action = "turn_on" if i % 2 == 0 else "turn_off"
+        dispatcher.dispatch(light, action)
+        latencies.append(light.gpio.events[-1][0] - tic)
+    return latencies
+
+
+def run_timing_comparison(light:GPIOLightController, n:int=1000) -> None:
+    """
+    Run and report receive-to-pin latency between threaded and inline pin writes.
+    """
+    from AsyncWorker import AsyncWorker
+    from DeviceDispatcher import DeviceDispatcher
+    from LatencyStats import percentile
+
+    async_worker = AsyncWorker()
+    for name, latencies in [
+            ("Threaded", time_threaded_writes(light, async_worker, n)),
+            ("Inline", time_inline_writes(light, DeviceDispatcher(async_worker), n)),
+            ]:
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1e6
+        p99 = percentile(latencies, 0.99) * 1e6
+        logger.info(f"{name} receive-to-pin latency: p50={p50:.1f}us p99={p99:.1f}us")
+
+
 if __name__ == "__main__":
     pin = 16
     gpio = GPIOLightController(pin)
 
+    if gpio.gpio.__name__ == "devices.StubGPIO":
+        run_timing_comparison(gpio)
+        exit(0)
+
     for i in range(3):
         print(f"Turning pin {pin} on")
         gpio.turn_on()
@@ -1,8 +1,24 @@
 # A simple class to control a light using a GPIO pin
+import asyncio
 from abc import ABC, abstractmethod
 
 
 class LightController(ABC):
+    # Controllers whose turn_on/turn_off can block (eg network calls) are run on the AsyncWorker
+    # through a thread. Non-blocking controllers (eg a GPIO pin write) are run inline by the dispatcher
+    is_blocking = True
+
+    @property
+    def name(self) -> str:
+        return type(self).__name__
+
+    @property
+    def devices(self) -> list:
+        """
+        Controllers of the devices whose state the commands of this controller set, eg the devices of a scene
+        """
+        return [self]
+
     @abstractmethod
     def turn_on(self, hex_color:str|None=None):
         pass
@@ -15,4 +31,17 @@ class LightController(ABC):
     def health_check(self):
         pass
 
+    async def async_turn_on(self, hex_color:str|None=None):
+        await asyncio.to_thread(self.turn_on, hex_color)
 
+    async def async_turn_off(self):
+        await asyncio.to_thread(self.turn_off)
+
+    async def async_health_check(self):
+        await asyncio.to_thread(self.health_check)
+
+    async def async_probe(self):
+        """
+        Cheap check that the device is reachable, without changing its state. Raises if it is not.
+        """
+        pass
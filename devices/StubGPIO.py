@@ -0,0 +1,84 @@
+# Stand-in for the RPi.GPIO module, so GPIO controllers can be run and benchmarked on any machine.
+# Every pin change is recorded with a timestamp in `events`: (time.perf_counter(), pin, value)
+# Every PWM duty cycle change is recorded in `duty_events`: (time.perf_counter(), pin, duty_cycle)
+
+import time
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+events = []
+duty_events = []
+_pin_modes = {}
+_pin_values = {}
+_mode = None
+
+
+def setmode(mode:int) -> None:
+    global _mode
+    _mode = mode
+
+def getmode() -> int | None:
+    return _mode
+
+def setwarnings(flag:bool) -> None:
+    pass
+
+def setup(pin:int, mode:int, initial:int=LOW) -> None:
+    _pin_modes[pin] = mode
+    _pin_values[pin] = initial
+
+def output(pin:int, value:int) -> None:
+    if _pin_modes.get(pin) != OUT:
+        raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+    value = HIGH if value else LOW
+    _pin_values[pin] = value
+    events.append((time.perf_counter(), pin, value))
+
+def input(pin:int) -> int:
+    return _pin_values.get(pin, LOW)
+
+def cleanup(pin:int|None=None) -> None:
+    if pin is None:
+        _pin_modes.clear()
+        _pin_values.clear()
+    else:
+        _pin_modes.pop(pin, None)
+        _pin_values.pop(pin, None)
+
+def reset_events() -> None:
+    """
+    Clear recorded pin and duty cycle changes, eg between benchmark runs
+    """
+    events.clear()
+    duty_events.clear()
+
+
+class PWM:
+    def __init__(self, pin:int, frequency:float):
+        if _pin_modes.get(pin) != OUT:
+            raise RuntimeError("You must setup() the GPIO channel as an output first")
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = None
+
+    def start(self, duty_cycle:float) -> None:
+        self.ChangeDutyCycle(duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle:float) -> None:
+        if not 0.0 <= duty_cycle <= 100.0:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.duty_cycle = duty_cycle
+        duty_events.append((time.perf_counter(), self.pin, duty_cycle))
+
+    def ChangeFrequency(self, frequency:float) -> None:
+        self.frequency = frequency
+
+    def stop(self) -> None:
+        if self.duty_cycle is not None:
+            self.duty_cycle = None
+            duty_events.append((time.perf_counter(), self.pin, None))
@@ -8,6 +8,13 @@ from loguru import logger
 
 CONTROL_CHANGE_STATUS_ALL_CHANNELS = [x for x in range(176, 192)]
 
+# MIDI clock (system real-time) messages are a single status byte
+TIMING_CLOCK = 248 # 24 pulses per quarter note
+START = 250
+CONTINUE = 251
+STOP = 252
+CLOCK_STATUSES = (TIMING_CLOCK, START, CONTINUE, STOP)
+
 class MidiActions(Enum):
     """
     Enum to represent MIDI actions
@@ -84,5 +91,5 @@ def get_midi_action(midi_data: list) -> MidiActions | None:
         elif status == 137:
             return MidiActions.SNARE_OFF
     else:
-        logger.info(f"Unknown MIDI message: {midi_data}")
+        logger.debug("Unknown MIDI message: {}", midi_data)
         return None
@@ -2,9 +2,11 @@
 # To be run on raspberry pi: turn on GPIO pins when recording starts, turn off when recording stops
 # If running on macOS, it uses DummyLightController to simulate GPIO pin
 
+import os
 import sys
 import argparse
 import time
+import concurrent.futures
 from functools import partial
 
 from pythonosc.dispatcher import Dispatcher
@@ -12,13 +14,25 @@ from pythonosc import osc_server
 from loguru import logger
 
 from AsyncWorker import AsyncWorker
+from BeatScheduler import BeatScheduler
+from RateLimiter import LatestValueRateLimiter
+from DeviceDispatcher import DeviceDispatcher, CRITICAL, BEST_EFFORT
+from QueuedLogging import LogSummary, setup_logging, SUMMARY_INTERVAL_S
+import EventJournal as ej
+from ServerConfig import ServerConfig, LiveTable, ConfigWatcher, load_config, CONFIG_PATH
+from SessionManager import SessionManager, SESSION_TIMEOUT_S
+from StateStore import StateStore, load_state, STATE_PATH, STATE_MAX_AGE_S
+from MulticastOSC import MulticastOSCUDPServer, MULTICAST_INTERFACE
+from DebugChannel import DebugChannel, DEBUG_CHANNEL
 from devices.LightController import LightController
 from devices.DirigeraPlugController import DirigeraPlugController
-from devices.DirigeraLightController import DirigeraLightController, COLOR_TO_HEX
+from devices.DirigeraLightController import DirigeraLightController
+from devices.DirigeraSceneController import DirigeraSceneController
 import midi_states as ms
 if sys.platform == "linux":
     logger.info("Running on Linux, using GPIOLightController")
     from devices.GPIOLightController import GPIOLightController
+    from devices.GPIOEffects import GPIOEffectsEngine
     CommonLightController = GPIOLightController
 elif sys.platform == "darwin":
     logger.info("Running on macOS, using DummyLightController")
@@ -27,14 +41,58 @@ elif sys.platform == "darwin":
 
 GPIO_PIN = 16
 DIRIGERA_LIGHT_NAME = "recording_light"
+RECORD_STOP_FADE_S = 0.5 # Fade the recording light out instead of switching it off, when effects are available
+BEAT_PULSE_S = 0.06 # Duration of the GPIO light pulse on every beat, when not recording
+SNARE_PULSE_S = 0.03 # Duration of the GPIO light pulse on every snare hit, when not recording
+DIRIGERA_MAX_RATE = 2 # Max requests/s to a single Dirigera device for high-frequency events, eg drum hits
+
+# Time after which a device command is stale and dropped if it hasn't reached its device yet,
+# counted from when the MIDI message was received. None: never dropped, eg turning everything off
+ACTION_DEADLINES_S = {
+    ms.MidiActions.RESET_ALL: 10.0,
+    ms.MidiActions.RECORD_START: 5.0,
+    ms.MidiActions.RECORD_STOP: 5.0,
+    ms.MidiActions.PLAY: 1.0,
+    ms.MidiActions.STOP: 1.0,
+    ms.MidiActions.ALL_NOTES_OFF: None,
+    }
+# Per device overrides of ACTION_DEADLINES_S, keyed by (device name, action). Eg {("Spotlight Plug", ms.MidiActions.PLAY): 2.0}
+DEVICE_DEADLINES_S = {}
+DEFAULT_SERVER_CONFIG = ServerConfig.default() # Used when no config file is given
+# Actions whose device commands run on the critical lane: ahead of, and superseding, queued ambience commands
+CRITICAL_ACTIONS = {ms.MidiActions.RECORD_START, ms.MidiActions.RECORD_STOP}
+
+def command_deadline(midi_action:ms.MidiActions, controller:LightController, received_at:float) -> float | None:
+    """
+    Deadline of a device command created for a MIDI action
+    Args:
+        midi_action: MidiActions enum the command was created for
+        controller: LightController object the command is for
+        received_at: Float, time.monotonic() when the MIDI message was received
+    Returns:
+        Float, time.monotonic() after which the command is stale, or None if it never is
+    """
+    if controller is None:
+        return None
+    deadline_s = DEVICE_DEADLINES_S.get((controller.name, midi_action), ACTION_DEADLINES_S.get(midi_action))
+    return None if deadline_s is None else received_at + deadline_s
 
 def process_midi_rec_light(
         midi_data:list,
         light_controller:LightController,
-        async_worker:AsyncWorker,
+        dispatcher:DeviceDispatcher,
         rgb_light_controller:DirigeraLightController=None,
         sunset_lights_plug:DirigeraPlugController=None,
         spotlight_plug:DirigeraPlugController=None,
+        hub_scenes:dict=None,
+        beat_scheduler:BeatScheduler=None,
+        snare_limiter:LatestValueRateLimiter=None,
+        received_at:float|None=None,
+        log_summary:LogSummary=None,
+        journal:ej.EventJournal=None,
+        config:ServerConfig=None,
+        source:str="osc",
+        session_manager:SessionManager=None,
         ) -> None:
     """
     Process MIDI data received from OSC.
@@ -45,104 +103,424 @@ def process_midi_rec_light(
                     data1, data2
         light_controller: LightController object to control a light.
                     Eg GPIOLightController or DummyLightController object
-        async_worker: AsyncWorker object to run async tasks
+        dispatcher: DeviceDispatcher object to run device actions, inline or on the AsyncWorker
         rgb_light_controller: DirigeraLightController object to control a RGB light
         sunset_lights_plug: DirigeraPlugController object to control a plug
         spotlight_plug: DirigeraPlugController object to control a plug
+        hub_scenes: Dict, MidiActions -> DirigeraSceneController object, triggered instead of the config scene of the action
+        beat_scheduler: BeatScheduler object pulsing the light on beats, muted while recording
+        snare_limiter: LatestValueRateLimiter object folding snare hit velocities into RGB light level updates
+        received_at: Float, time.monotonic() when the MIDI message was received. Device commands that
+                    haven't reached their device by their action's deadline from this time are dropped
+        log_summary: LogSummary object counting the MIDI actions handled, logged periodically
+        journal: EventJournal object recording every MIDI message received
+        config: ServerConfig object mapping MIDI messages to actions, and actions to device scenes and delayed scenes
+        source: Str, address of the OSC client that sent the message, eg "192.168.1.20:53000"
+        session_manager: SessionManager object merging the sessions of several clients. Messages from a session
+                    are ignored while another session is recording
     """
     status, data1, data2 = midi_data
+    received_at = received_at or time.monotonic()
+    config = config or DEFAULT_SERVER_CONFIG
+
+    midi_action = config.midi_action(midi_data)
+    if log_summary:
+        log_summary.count(midi_action.value if midi_action else "other")
+    if journal:
+        journal.record(ej.MIDI, midi_action.value if midi_action else None, source=source, midi_data=midi_data)
+    if session_manager is not None and not session_manager.update(source, midi_action, received_at):
+        logger.info("{}\tIgnored {} from {}, another session is recording", midi_data, midi_action.value, source)
+        if log_summary:
+            log_summary.count("ignored")
+        return
+    priority = CRITICAL if midi_action in CRITICAL_ACTIONS else BEST_EFFORT
+
+    def dispatch(controller:LightController, action:str, **kwargs) -> None:
+        deadline = command_deadline(midi_action, controller, received_at)
+        dispatcher.dispatch(controller, action, deadline=deadline, priority=priority, **kwargs)
 
-    midi_action = ms.get_midi_action(midi_data)
     match midi_action:
 
         case ms.MidiActions.RESET_ALL:
-            logger.info(f"{midi_data}\tInit server state")
-            async_worker.run_task(
+            logger.info("{}\tInit server state", midi_data)
+            dispatcher.async_worker.run_task(
                     light_controller.async_health_check()
                     )
-            if rgb_light_controller:
-                async_worker.run_task(
-                        rgb_light_controller.async_turn_on(hex_color=COLOR_TO_HEX["orange"])
-                        )
-            if spotlight_plug:
-                async_worker.run_task(spotlight_plug.async_turn_off())
-            if sunset_lights_plug:
-                async_worker.run_task(sunset_lights_plug.async_turn_on())
 
         case ms.MidiActions.RECORD_START:
-            logger.info(f"{midi_data}\tRecording started")
-            async_worker.run_task(
-                    light_controller.async_turn_on()
-                    )
-            if rgb_light_controller:
-                async_worker.run_task(
-                        rgb_light_controller.async_turn_on(hex_color=COLOR_TO_HEX["red"])
-                        )
-            if sunset_lights_plug:
-                async_worker.run_task(sunset_lights_plug.async_turn_on())
+            logger.info("{}\tRecording started", midi_data)
+            if beat_scheduler:
+                beat_scheduler.muted = True
+            if dispatcher.state_store:
+                dispatcher.state_store.set_recording(True)
+            dispatch(light_controller, "turn_on")
 
         case ms.MidiActions.RECORD_STOP:
-            logger.info(f"{midi_data}\tRecording stopped")
-            async_worker.run_task(light_controller.async_turn_off())
-            if rgb_light_controller:
-                async_worker.run_task(
-                        rgb_light_controller.async_turn_on(hex_color=COLOR_TO_HEX["pink"])
-                        )
+            logger.info("{}\tRecording stopped", midi_data)
+            if beat_scheduler:
+                beat_scheduler.muted = False
+            if dispatcher.state_store:
+                dispatcher.state_store.set_recording(False)
+            if getattr(light_controller, "effects", None):
+                light_controller.effects.fade_out(RECORD_STOP_FADE_S)
+            else:
+                dispatch(light_controller, "turn_off")
 
         case ms.MidiActions.PLAY:
-            logger.info(f"{midi_data}\tPlay")
-            if rgb_light_controller:
-                async_worker.run_task(
-                        rgb_light_controller.async_turn_on(hex_color=COLOR_TO_HEX["dark_green"])
-                        )
-            if spotlight_plug:
-                async_worker.run_task(spotlight_plug.async_turn_on())
-            if sunset_lights_plug:
-                async_worker.run_task(sunset_lights_plug.async_turn_off())
+            logger.info("{}\tPlay", midi_data)
 
         case ms.MidiActions.STOP:
-            logger.info(f"{midi_data}\tPause")
-            if rgb_light_controller:
-                async_worker.run_task(
-                        rgb_light_controller.async_turn_on(hex_color=COLOR_TO_HEX["pink"])
-                        )
-            if spotlight_plug:
-                async_worker.run_task(spotlight_plug.async_turn_off())
-            if sunset_lights_plug:
-                async_worker.run_task(sunset_lights_plug.async_turn_on())
+            logger.info("{}\tPause", midi_data)
 
         case ms.MidiActions.TRACK_LEFT:
-            logger.info(f"{midi_data}\tTrack Left")
+            logger.info("{}\tTrack Left", midi_data)
 
         case ms.MidiActions.TRACK_RIGHT:
-            logger.info(f"{midi_data}\tTrack Right")
+            logger.info("{}\tTrack Right", midi_data)
+
+        case ms.MidiActions.SNARE_ON:
+            # Too frequent to log every hit. The GPIO light reacts to every hit, the RGB light at its max rate
+            pulse_light(light_controller, SNARE_PULSE_S)
+            if snare_limiter:
+                snare_limiter.submit(data2)
 
         case ms.MidiActions.ALL_NOTES_OFF:
             # User quit Logic Pro X: turn everything off, server is still running
-            logger.info(f"{midi_data}\tTurn all off")
-            async_worker.run_task(light_controller.async_turn_off())
-            if rgb_light_controller:
-                async_worker.run_task(
-                        rgb_light_controller.async_turn_off()
-                        )
-            if sunset_lights_plug:
-                async_worker.run_task(sunset_lights_plug.async_turn_off())
-            if spotlight_plug:
-                spotlight_plug.turn_off()
+            logger.info("{}\tTurn all off", midi_data)
+            if dispatcher.state_store:
+                dispatcher.state_store.set_recording(False)
+            dispatch(light_controller, "turn_off")
         case _:
             pass
 
-def midi_handler(unused_addr, args, *midi_message):
+    # Dirigera devices: one request for the scene stored on the hub if there is one, else one command per device
+    controllers = {
+        "rgb_light": rgb_light_controller,
+        "sunset_lights": sunset_lights_plug,
+        "spotlight": spotlight_plug,
+        }
+    hub_scene = hub_scenes.get(midi_action) if hub_scenes else None
+    if hub_scene:
+        dispatch(hub_scene, "turn_on")
+    else:
+        for role, action, kwargs in config.scenes.get(midi_action, ()):
+            dispatch(controllers[role], action, **kwargs)
+    if midi_action in config.delayed_scenes:
+        delay, commands = config.delayed_scenes[midi_action]
+        for role, action, kwargs in commands:
+            dispatcher.dispatch_later(delay, controllers[role], action, **kwargs)
+
+def pulse_light(light_controller:LightController, duration:float) -> None:
+    """
+    Briefly pulse the light, unless it is solidly on (eg recording).
+    Only lights with an effects engine (GPIO) can keep up with beats and drum hits
+    Args:
+        light_controller: LightController object
+        duration: Float, duration of the pulse in seconds
+    """
+    if getattr(light_controller, "effects", None):
+        light_controller.effects.pulse_unless_on(duration)
+
+def pulse_on_beat(beat:int, light_controller:LightController) -> None:
+    """
+    Pulse the light on a beat
+    Args:
+        beat: Int, beat index since the transport started
+        light_controller: LightController object
+    """
+    pulse_light(light_controller, BEAT_PULSE_S)
+
+def velocity_to_level(velocity:int) -> int:
+    """
+    Map a MIDI note velocity (0-127) to a Dirigera light level (1-100)
+    """
+    return max(1, round(velocity / 127 * 100))
+
+def tempo_handler(unused_addr, args, bpm, playing, phase_s):
+    """
+    Callback function to handle tempo updates estimated by the client from MIDI clock
+    Args:
+        unused_addr: Unused
+        args: Additional arguments passed via the dispatcher: the BeatScheduler
+        bpm: Float, tempo in beats per minute
+        playing: Int, 1 if the transport is running
+        phase_s: Float, seconds elapsed since the last beat when the client sent the update
+    """
+    beat_scheduler = args[0]
+    beat_scheduler.update(bpm, bool(playing), phase_s)
+
+def midi_handler(client_address, unused_addr, args, *midi_message):
     """
     Callback function to handle MIDI messages
     Args:
+        client_address: Tuple, (ip, port) of the OSC client that sent the message
         unused_addr: Unused
         args: Additional arguments passsed via the dispatcher. Eg process_midi_rec_light
         midi_message: MIDI message from OSC, unpacked tuple
     """
+    received_at = time.monotonic()
     process_func = args[0] # Callable to process MIDI data
     midi_data = list(midi_message) # Convert unpacked tuple to list
-    process_func(midi_data)
+    process_func(midi_data, received_at=received_at, source=f"{client_address[0]}:{client_address[1]}")
+
+def create_midi_table(
+        config:ServerConfig,
+        controllers:dict,
+        dispatcher:DeviceDispatcher,
+        **handler_kwargs,
+        ) -> partial:
+    """
+    Build the MIDI processing function of a config: process_midi_rec_light bound to the config,
+    its Dirigera devices and hub scenes, and a snare rate limiter for its RGB light.
+    When the config has hub scenes, its scenes and devices share one dispatcher queue
+    Args:
+        config: ServerConfig object
+        controllers: Dict, device role -> controller object or None, eg {"rgb_light": DirigeraLightController},
+                    and MidiActions -> DirigeraSceneController object or None for the hub scenes
+        dispatcher: DeviceDispatcher object to run device actions
+        handler_kwargs: Other arguments of process_midi_rec_light, eg light_controller or journal
+    Returns:
+        partial of process_midi_rec_light, taking midi_data and received_at
+    """
+    rgb_light_controller = controllers.get("rgb_light")
+    snare_limiter = None
+    if rgb_light_controller:
+        snare_limiter = LatestValueRateLimiter(
+                dispatcher.async_worker,
+                lambda velocity: dispatcher.dispatch(
+                    rgb_light_controller,
+                    "set_level",
+                    level=velocity_to_level(velocity),
+                    ),
+                rate=DIRIGERA_MAX_RATE,
+                merge=max, # Loudest hit in the window wins
+                )
+    hub_scenes = controller_kwargs(controllers)["hub_scenes"]
+    # A scene and a device command, or two scenes, must reach the hub in the order of their MIDI actions,
+    # eg a quick PLAY then STOP must not end in the PLAY state when the PLAY scene trigger is slow
+    dispatcher.share_queue(list(controllers.values()) if hub_scenes else [])
+    return partial(
+            process_midi_rec_light,
+            dispatcher=dispatcher,
+            rgb_light_controller=rgb_light_controller,
+            sunset_lights_plug=controllers.get("sunset_lights"),
+            spotlight_plug=controllers.get("spotlight"),
+            hub_scenes=hub_scenes,
+            snare_limiter=snare_limiter,
+            config=config,
+            **handler_kwargs,
+            )
+
+def reload_midi_table(live_table:LiveTable, config:ServerConfig, controllers:dict) -> None:
+    """
+    Build the MIDI processing function of a new config and swap it in. Events being handled finish with the old one
+    Args:
+        live_table: LiveTable object mapped to the OSC channel by create_osc_dispatcher
+        config: ServerConfig object, the new config
+        controllers: Dict, device role -> controller object or None, for the new config
+    """
+    # Same GPIO light, beat scheduler, journal... as the current table
+    handler_kwargs = {
+        key: value for key, value in live_table.table.keywords.items()
+        if key in ("dispatcher", "light_controller", "beat_scheduler", "log_summary", "journal", "session_manager")
+        }
+    live_table.swap(create_midi_table(config, controllers, **handler_kwargs), config, controllers)
+
+def controller_kwargs(controllers:dict) -> dict:
+    """
+    Arguments of create_osc_dispatcher for the controllers of a config
+    Args:
+        controllers: Dict, device role or MidiActions -> controller object or None, as returned by create_controllers
+    Returns:
+        Dict with the device controllers and the available hub scenes, eg {"rgb_light_controller": ..., "hub_scenes": {...}}
+    """
+    return {
+        "rgb_light_controller": controllers.get("rgb_light"),
+        "sunset_lights_plug": controllers.get("sunset_lights"),
+        "spotlight_plug": controllers.get("spotlight"),
+        "hub_scenes": {key: controller for key, controller in controllers.items() if isinstance(key, ms.MidiActions) and controller},
+        }
+
+def create_osc_dispatcher(
+        device_dispatcher:DeviceDispatcher,
+        light_controller:LightController,
+        rgb_light_controller:DirigeraLightController=None,
+        sunset_lights_plug:DirigeraPlugController=None,
+        spotlight_plug:DirigeraPlugController=None,
+        osc_channel:str="/midi",
+        tempo_channel:str="/tempo",
+        log_summary:LogSummary=None,
+        journal:ej.EventJournal=None,
+        config:ServerConfig=None,
+        live_table:LiveTable=None,
+        session_manager:SessionManager=None,
+        hub_scenes:dict=None,
+        ) -> Dispatcher:
+    """
+    Map the OSC channels to their handlers, with the beat scheduler and snare rate limiter they drive
+    Args:
+        device_dispatcher: DeviceDispatcher object to run device actions
+        light_controller: LightController object of the recording light, eg GPIOLightController
+        rgb_light_controller: DirigeraLightController object to control a RGB light
+        sunset_lights_plug: DirigeraPlugController object to control a plug
+        spotlight_plug: DirigeraPlugController object to control a plug
+        osc_channel: Str, OSC channel of the MIDI messages
+        tempo_channel: Str, OSC channel of the tempo updates
+        log_summary: LogSummary object counting the MIDI actions handled
+        journal: EventJournal object recording every MIDI message received
+        config: ServerConfig object mapping MIDI messages to actions and device scenes. Defaults to DEFAULT_SERVER_CONFIG
+        live_table: LiveTable object to map the MIDI handler through, to swap in a new config later with reload_midi_table
+        session_manager: SessionManager object, to keep the sessions of several clients from turning off each other's devices
+        hub_scenes: Dict, MidiActions -> DirigeraSceneController object, to trigger instead of the config scene of the action
+    Returns:
+        Dispatcher, to serve with an OSC server
+    """
+    beat_scheduler = BeatScheduler(
+            device_dispatcher.async_worker,
+            partial(pulse_on_beat, light_controller=light_controller),
+            )
+    config = config or DEFAULT_SERVER_CONFIG
+    controllers = {
+        "rgb_light": rgb_light_controller,
+        "sunset_lights": sunset_lights_plug,
+        "spotlight": spotlight_plug,
+        **(hub_scenes or {}),
+        }
+    table = create_midi_table(
+            config,
+            controllers,
+            device_dispatcher,
+            light_controller=light_controller,
+            beat_scheduler=beat_scheduler,
+            log_summary=log_summary,
+            journal=journal,
+            session_manager=session_manager,
+            )
+    live_table = live_table if live_table is not None else LiveTable()
+    live_table.swap(table, config, controllers)
+
+    dispatcher = Dispatcher()
+    dispatcher.map(osc_channel, midi_handler, live_table, needs_reply_address=True)
+    dispatcher.map(tempo_channel, tempo_handler, beat_scheduler)
+    return dispatcher
+
+# Controller class of each device role, built from the device name in the config
+DEVICE_FACTORIES = {
+    "rgb_light": DirigeraLightController,
+    "sunset_lights": partial(DirigeraPlugController, start_on=True),
+    "spotlight": DirigeraPlugController,
+    }
+
+def create_controllers(config:ServerConfig, async_worker:AsyncWorker, previous:dict|None=None, health_check:bool=True) -> dict:
+    """
+    Connect to the Dirigera devices and hub scenes of a config. Devices and scenes whose name didn't change keep
+    their controller and connection
+    Args:
+        config: ServerConfig object
+        async_worker: AsyncWorker object to run the health checks of new controllers
+        previous: Dict, device role or MidiActions -> controller object, of the current config
+        health_check: Bool, run the health check of new controllers, which blinks the devices. False when
+                    restoring a saved state, the devices are put back in their state instead
+    Returns:
+        Dict, device role -> controller object, and MidiActions -> DirigeraSceneController object of its hub scene.
+        None if the device or scene is unavailable: the action then falls back to one command per device
+    """
+    previous = previous or {}
+    controllers = {}
+    for role, name in config.devices.items():
+        controller = previous.get(role)
+        if controller is None or controller.name != name:
+            try:
+                controller = DEVICE_FACTORIES[role](name)
+                if health_check:
+                    async_worker.run_task(controller.async_health_check())
+            except Exception as e:
+                # When testing locally, Dirigera controllers may not be available
+                logger.warning(f"Error initializing Dirigera controller {name}: {e}")
+                controller = None
+        controllers[role] = controller
+
+    devices = [controller for controller in controllers.values() if controller]
+    for midi_action, scene_name in config.hub_scenes.items():
+        controller = previous.get(midi_action)
+        if controller is None or controller.name != scene_name:
+            try:
+                controller = DirigeraSceneController(scene_name)
+                if health_check:
+                    async_worker.run_task(controller.async_health_check())
+            except Exception as e:
+                logger.warning(f"Error initializing Dirigera scene {scene_name}, {midi_action.value} falls back to device commands: {e}")
+                controller = None
+        if controller:
+            controller.controllers = devices # Devices whose cached state the scene changes
+        controllers[midi_action] = controller
+    return controllers
+
+def restore_state(
+        state:dict,
+        device_dispatcher:DeviceDispatcher,
+        light_controller:LightController,
+        controllers:dict,
+        beat_scheduler:BeatScheduler=None,
+        ) -> float:
+    """
+    Put the devices back in the state saved by a previous run, eg after a crash, instead of running their health
+    checks. Hub scenes are triggered first, in the order they were, then the last command of every device that
+    came after them is sent to all the devices at once
+    Args:
+        state: Dict, state returned by load_state
+        device_dispatcher: DeviceDispatcher object, its StateStore records the restored commands again
+        light_controller: LightController object, turned back on if the server was recording
+        controllers: Dict, device role or MidiActions -> controller object, as returned by create_controllers
+        beat_scheduler: BeatScheduler object, muted again if the server was recording
+    Returns:
+        Float, time in seconds to restore the state
+    """
+    tic = time.perf_counter()
+    if state.get("recording"):
+        if beat_scheduler:
+            beat_scheduler.muted = True
+        if device_dispatcher.state_store:
+            device_dispatcher.state_store.set_recording(True)
+        device_dispatcher.dispatch(light_controller, "turn_on", priority=CRITICAL)
+
+    by_name = {controller.name: controller for controller in controllers.values() if controller}
+    commands = sorted(
+            ((entry["desired"], by_name[name]) for name, entry in state.get("devices", {}).items()
+             if entry.get("desired") and name in by_name),
+            key=lambda command: command[0]["seq"],
+            )
+    unconfirmed = [
+            controller.name for desired, controller in commands
+            if state["devices"][controller.name].get("confirmed") != {"action": desired["action"], "kwargs": desired["kwargs"]}
+            ]
+    # A device command older than a scene setting the device is overridden by the scene. A scene's turn_off, eg
+    # recorded at shutdown, sets nothing
+    scenes = []
+    scene_seqs = {} # Device name -> seq of the last scene setting it
+    for desired, controller in commands:
+        if isinstance(controller, DirigeraSceneController) and desired["action"] == "turn_on":
+            scenes.append((desired, controller))
+            for member in controller.devices:
+                scene_seqs[member.name] = desired["seq"]
+    devices = [
+            (desired, controller) for desired, controller in commands
+            if not isinstance(controller, DirigeraSceneController) and desired["seq"] > scene_seqs.get(controller.name, 0)
+            ]
+
+    # Scenes one after the other, as they may set the same devices, then all the devices concurrently
+    for batch in [[scene] for scene in scenes] + [devices]:
+        futures = [
+                device_dispatcher.dispatch(controller, desired["action"], priority=CRITICAL, **desired["kwargs"])
+                for desired, controller in batch
+                ]
+        for future in futures:
+            if future:
+                future.result(timeout=device_dispatcher.timeout * 2)
+    restore_s = time.perf_counter() - tic
+    logger.info(f"Restored {len(scenes)} scenes and {len(devices)} devices in {restore_s * 1e3:.1f} ms, "
+                f"{len(unconfirmed)} had unconfirmed commands: {unconfirmed}")
+    return restore_s
 
 if __name__ == "__main__":
 
@@ -158,60 +536,162 @@ if __name__ == "__main__":
             default=5005,
             help="The port to listen on",
             )
+    parser.add_argument(
+            "--multicast_group",
+            type=str,
+            default=None,
+            help="Also receive the MIDI messages sent to this multicast group by client.py --multicast_group, eg 239.255.0.42",
+            )
+    parser.add_argument(
+            "--multicast_interface",
+            type=str,
+            default=MULTICAST_INTERFACE,
+            help="IP address of the interface to join the multicast group on, eg 127.0.0.1 to test with a client on this machine",
+            )
     parser.add_argument(
             "--osc_channel",
             type=str,
             default="/midi",
             help="The OSC channel to listen on",
             )
+    parser.add_argument(
+            "--tempo_channel",
+            type=str,
+            default="/tempo",
+            help="The OSC channel to listen on for tempo updates",
+            )
+    parser.add_argument(
+            "--log_level",
+            type=str,
+            default="INFO",
+            help="Min level of the logs written",
+            )
+    parser.add_argument(
+            "--log_file",
+            type=str,
+            default=None,
+            help="File to append logs to, instead of stderr",
+            )
+    parser.add_argument(
+            "--log_summary_interval",
+            type=float,
+            default=SUMMARY_INTERVAL_S,
+            help="Seconds between two logs of the number of MIDI actions handled",
+            )
+    parser.add_argument(
+            "--journal",
+            type=str,
+            default="event_journal.bin",
+            help="Journal file recording every MIDI message received and device action, empty to disable. Read it with EventJournal.py",
+            )
+    parser.add_argument(
+            "--config",
+            type=str,
+            default=CONFIG_PATH,
+            help="Config file of the devices, MIDI mapping and scenes. Reloaded when it changes",
+            )
+    parser.add_argument(
+            "--session_timeout",
+            type=float,
+            default=SESSION_TIMEOUT_S,
+            help="Seconds after which a silent OSC client's session is forgotten",
+            )
+    parser.add_argument(
+            "--state",
+            type=str,
+            default=STATE_PATH,
+            help="File keeping the last known state of the devices, restored on startup instead of running the health checks. Empty to disable",
+            )
+    parser.add_argument(
+            "--state_max_age",
+            type=float,
+            default=STATE_MAX_AGE_S,
+            help="Seconds after which a saved state is too old to restore",
+            )
+    parser.add_argument(
+            "--debug_channel",
+            type=str,
+            default=None,
+            help=f"OSC prefix of the profiling and stats requests, eg {DEBUG_CHANNEL} for {DEBUG_CHANNEL}/stats. Query it with tests/send_debug_cmd.py. "
+                 "Disabled by default: anyone who can reach the server can use it",
+            )
     args = parser.parse_args()
+    # Logs are written to the SD card by a background thread, never by the OSC handler
+    setup_logging(level=args.log_level, log_file=args.log_file)
 
     async_worker = AsyncWorker()
+    journal = ej.EventJournal(args.journal) if args.journal else None
+    state = load_state(args.state, args.state_max_age) if args.state else None
+    state_store = StateStore(args.state, state=state) if args.state else None
+    device_dispatcher = DeviceDispatcher(async_worker, journal=journal, state_store=state_store)
+    log_summary = LogSummary("MIDI actions handled")
+    async_worker.call_every(args.log_summary_interval, log_summary.flush)
     light_controller = CommonLightController(GPIO_PIN)
-    async_worker.run_task(light_controller.async_health_check())
-    try:
-        rgb_light_controller = DirigeraLightController(DIRIGERA_LIGHT_NAME)
-        async_worker.run_task(
-                rgb_light_controller.async_health_check()
-                )
+    if sys.platform == "linux":
+        GPIOEffectsEngine(light_controller, async_worker.loop)
+    if state is None:
+        async_worker.run_task(light_controller.async_health_check())
+    config = load_config(args.config) if os.path.exists(args.config) else DEFAULT_SERVER_CONFIG
+    controllers = create_controllers(config, async_worker, health_check=state is None)
+    live_table = LiveTable()
+    session_manager = SessionManager(args.session_timeout)
+    dispatcher = create_osc_dispatcher(
+            device_dispatcher,
+            light_controller,
+            osc_channel=args.osc_channel,
+            tempo_channel=args.tempo_channel,
+            log_summary=log_summary,
+            journal=journal,
+            config=config,
+            live_table=live_table,
+            session_manager=session_manager,
+            **controller_kwargs(controllers),
+            )
 
-        # Sunset lights
-        sunset_lights_plug_controller = DirigeraPlugController("Sunset Lights", start_on=True)
-        async_worker.run_task(
-                sunset_lights_plug_controller.async_health_check()
-                )
+    def reload_config(new_config:ServerConfig) -> None:
+        # Runs on the watcher thread: MIDI messages keep being handled with the current table meanwhile
+        tic = time.perf_counter()
+        new_controllers = create_controllers(new_config, async_worker, previous=live_table.controllers)
+        reload_midi_table(live_table, new_config, new_controllers)
+        logger.info(f"Reloaded {args.config} in {(time.perf_counter() - tic) * 1e3:.1f} ms")
+    config_watcher = ConfigWatcher(args.config, reload_config).start()
+
+    if args.debug_channel:
+        debug_channel = DebugChannel(async_worker, stats={
+            "midi_actions": log_summary.counts,
+            "devices": device_dispatcher.stats,
+            "lanes": device_dispatcher.lane_stats,
+            "sessions": session_manager.stats,
+            "config": lambda: {"reloads": config_watcher.reloads, "errors": config_watcher.errors},
+            "state": lambda: {"updates": state_store.updates, "writes": state_store.writes} if state_store else {},
+            })
+        debug_channel.map(dispatcher, args.debug_channel)
 
-        # Spotlight + disco ball
-        spotlight_plug_controller = DirigeraPlugController("Spotlight Plug")
-        async_worker.run_task(
-                spotlight_plug_controller.async_health_check()
+    if state:
+        # Before accepting MIDI messages, so that they aren't overridden by the restored state
+        restore_state(
+                state,
+                device_dispatcher,
+                light_controller,
+                controllers,
+                beat_scheduler=live_table.table.keywords["beat_scheduler"],
                 )
-    except Exception as e:
-        # When testing locally, Dirigera controllers may not be available
-        logger.warning(f"Error initializing Dirigera controllers: {e}")
-        logger.warning("Processing without Dirigera device control")
-        rgb_light_controller = None
-        sunset_lights_plug_controller = None
-        spotlight_plug_controller = None
+    if state_store:
+        state_store.start()
 
-    dispatcher = Dispatcher()
-    dispatcher.map(
-            args.osc_channel,
-            midi_handler,
-            partial(
-                process_midi_rec_light,
-                async_worker=async_worker,
-                light_controller=light_controller,
-                rgb_light_controller=rgb_light_controller,
-                sunset_lights_plug=sunset_lights_plug_controller,
-                spotlight_plug=spotlight_plug_controller,
-                ),
-            )
-
-    server = osc_server.ThreadingOSCUDPServer(
-            (args.ip, args.port),
-            dispatcher,
-            )
+    if args.multicast_group:
+        server = MulticastOSCUDPServer(
+                (args.ip, args.port),
+                dispatcher,
+                group=args.multicast_group,
+                interface=args.multicast_interface,
+                )
+        logger.info(f"Joined multicast group {args.multicast_group}")
+    else:
+        server = osc_server.ThreadingOSCUDPServer(
+                (args.ip, args.port),
+                dispatcher,
+                )
     logger.info(f"Listening on {server.server_address}")
     logger.info("Ready")
 
@@ -220,14 +700,19 @@ if __name__ == "__main__":
         server.serve_forever()
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received, shutting down...")
-        async_worker.run_task(light_controller.async_turn_off())
-        if rgb_light_controller:
-            async_worker.run_task(rgb_light_controller.async_turn_off())
-        if sunset_lights_plug_controller:
-            async_worker.run_task(sunset_lights_plug_controller.async_turn_off())
-        if spotlight_plug_controller:
-            async_worker.run_task(spotlight_plug_controller.async_turn_off())
-        time.sleep(1)
+        config_watcher.stop()
+        if state_store:
+            # Stopped on purpose: the next start must not turn the record light back on
+            state_store.set_recording(False)
+        futures = [device_dispatcher.turn_off(light_controller)]
+        for controller in live_table.controllers.values():
+            futures.append(device_dispatcher.turn_off(controller))
+        # Let the turn offs finish, and be journaled, before the journal is closed
+        concurrent.futures.wait([future for future in futures if future], timeout=device_dispatcher.timeout + 1)
+        if state_store:
+            state_store.stop()
+        if journal:
+            journal.close()
         logger.info("Exiting...")
         exit(0)
 
@@ -0,0 +1,102 @@
+import sys
+import time
+
+sys.path.append("..")
+import CircuitBreaker as cb
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DirigeraPlugController import DirigeraPlugController
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(condition, timeout:float=2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestCircuitBreaker:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.breaker = cb.CircuitBreaker("plug", failure_threshold=3, reset_timeout=5.0, clock=self.clock)
+
+    def test_opens_after_threshold(self):
+        assert not self.breaker.record_failure()
+        assert not self.breaker.record_failure()
+        assert self.breaker.record_failure()
+        assert self.breaker.state == cb.OPEN
+        assert not self.breaker.allow()
+        assert self.breaker.stats()["rejected"] == 1
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        assert self.breaker.state == cb.CLOSED
+
+    def test_half_open_probe(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now = 4.9
+        assert not self.breaker.start_probe()
+        self.clock.now = 5.0
+        assert self.breaker.start_probe()
+        assert self.breaker.state == cb.HALF_OPEN
+        assert not self.breaker.allow()
+
+        # Failed probe: open again, for another reset_timeout
+        assert self.breaker.record_failure()
+        assert self.breaker.state == cb.OPEN
+        self.clock.now = 10.0
+        assert self.breaker.start_probe()
+        self.breaker.record_success()
+        assert self.breaker.state == cb.CLOSED
+        assert self.breaker.allow()
+
+
+class TestDispatcherWithOutage:
+    def setup_method(self):
+        self.simulator = DirigeraHubSimulator(latency=0.005).start()
+        self.plug_id = self.simulator.add_outlet("Spotlight Plug")
+        self.plug = DirigeraPlugController(
+                "Spotlight Plug",
+                dirigera_hub=self.simulator.make_hub(),
+                hub_client=self.simulator.make_client(timeout=0.1),
+                )
+        self.dispatcher = DeviceDispatcher(AsyncWorker(), timeout=0.1, failure_threshold=2, reset_timeout=0.2)
+
+    def teardown_method(self):
+        self.simulator.outage = None
+        self.simulator.stop()
+
+    def test_outage_opens_breaker_and_probe_restores(self):
+        for outage in ["refuse", "hang"]:
+            self.simulator.outage = outage
+            for _ in range(2):
+                self.dispatcher.dispatch(self.plug, "turn_on").result(timeout=1)
+            assert self.dispatcher.stats()["Spotlight Plug"]["state"] == cb.OPEN
+
+            # Fail fast: not even sent to the loop
+            tic = time.monotonic()
+            assert self.dispatcher.dispatch(self.plug, "turn_on") is None
+            assert time.monotonic() - tic < 0.01
+            assert self.dispatcher.stats()["Spotlight Plug"]["rejected"] >= 1
+
+            # Hub back: the background probe closes the breaker
+            self.simulator.outage = None
+            assert wait_for(lambda: self.dispatcher.stats()["Spotlight Plug"]["state"] == cb.CLOSED)
+            self.dispatcher.dispatch(self.plug, "turn_on").result(timeout=1)
+            assert self.simulator.devices[self.plug_id]["attributes"]["isOn"] is True
+            self.dispatcher.dispatch(self.plug, "turn_off").result(timeout=1)
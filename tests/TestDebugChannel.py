@@ -0,0 +1,118 @@
+import sys
+import time
+import asyncio
+import threading
+
+from loguru import logger
+from pythonosc import osc_server, udp_client
+
+sys.path.append("..")
+import server
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from QueuedLogging import LogSummary
+from DebugChannel import DebugChannel, SamplingProfiler, debug_request, MIN_PROFILE_INTERVAL_S
+from TestSessionManager import StateLightController, RECORD_START
+
+LOOPBACK = "127.0.0.1"
+
+
+def busy_wait(duration:float) -> None:
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        pass
+
+
+class TestSamplingProfiler:
+    def test_samples_busy_thread(self):
+        profiler = SamplingProfiler(interval=0.002)
+        profiler.start()
+        worker = threading.Thread(target=busy_wait, args=(0.2,), name="Busy")
+        worker.start()
+        worker.join()
+        profiler.stop()
+        assert not profiler.running
+        assert profiler.samples > 10
+        assert any(stack.startswith("Busy;") and stack.endswith("TestDebugChannel.py:busy_wait") for stack in profiler.stacks)
+        assert not any(stack.startswith("SamplingProfiler") for stack in profiler.stacks)
+
+    def test_no_thread_when_off(self):
+        n_threads = threading.active_count()
+        profiler = SamplingProfiler()
+        profiler.stop()
+        assert threading.active_count() == n_threads
+
+
+class TestDebugChannel:
+    def setup_method(self, method):
+        logger.disable("server")
+        logger.disable("DebugChannel")
+        self.async_worker = AsyncWorker()
+        self.light = StateLightController()
+        self.log_summary = LogSummary("MIDI actions handled")
+        device_dispatcher = DeviceDispatcher(self.async_worker)
+        dispatcher = server.create_osc_dispatcher(device_dispatcher, self.light, log_summary=self.log_summary)
+        self.debug_channel = DebugChannel(
+                self.async_worker,
+                stats={"midi_actions": self.log_summary.counts, "devices": device_dispatcher.stats},
+                )
+        self.debug_channel.map(dispatcher)
+        self.osc = osc_server.ThreadingOSCUDPServer((LOOPBACK, 0), dispatcher)
+        self.port = self.osc.server_address[1]
+        threading.Thread(target=self.osc.serve_forever, daemon=True).start()
+
+    def teardown_method(self, method):
+        logger.enable("server")
+        logger.enable("DebugChannel")
+        self.osc.shutdown()
+        self.osc.server_close()
+
+    def test_stats(self):
+        udp_client.SimpleUDPClient(LOOPBACK, self.port).send_message("/midi", RECORD_START)
+        deadline = time.monotonic() + 2
+        while not self.light.on and time.monotonic() < deadline:
+            time.sleep(0.01)
+        reply = debug_request(LOOPBACK, self.port, "/debug/stats")
+        assert reply["request"] == "/debug/stats"
+        assert reply["midi_actions"] == {"record_start": 1}
+
+    def test_tasks(self):
+        async def hang():
+            await asyncio.sleep(60)
+
+        future = self.async_worker.run_task(hang())
+        self.async_worker.call_later(60, lambda: None)
+        reply = debug_request(LOOPBACK, self.port, "/debug/tasks")
+        future.cancel()
+        assert [task["coro"] for task in reply["tasks"]] == ["TestDebugChannel.test_tasks.<locals>.hang"]
+        assert reply["tasks"][0]["at"].startswith("TestDebugChannel.py:")
+        assert reply["timers"] == 1
+
+    def test_profile_to_file(self, tmp_path):
+        self.debug_channel.profile_dir = str(tmp_path)
+        assert debug_request(LOOPBACK, self.port, "/debug/profile/start", 0.002)["profiling"]
+        busy_wait(0.2)
+        reply = debug_request(LOOPBACK, self.port, "/debug/profile/stop")
+        assert not self.debug_channel.profiler.running
+        assert reply["samples"] > 10
+        with open(reply["path"]) as f:
+            lines = f.read().splitlines()
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) >= reply["samples"]
+        assert any("busy_wait" in line for line in lines)
+        assert reply["top"][0][1] > 0
+
+    def test_interval_clamped(self):
+        reply = debug_request(LOOPBACK, self.port, "/debug/profile/start", 0.0)
+        assert reply["interval_s"] == MIN_PROFILE_INTERVAL_S
+        assert self.debug_channel.profiler.interval == MIN_PROFILE_INTERVAL_S
+        self.debug_channel.profiler.stop()
+
+    def test_reply_too_large(self):
+        self.debug_channel.stats["big"] = lambda: {"data": "x" * 100000}
+        reply = debug_request(LOOPBACK, self.port, "/debug/stats")
+        assert reply["request"] == "/debug/stats"
+        assert "error" in reply
+
+    def test_stop_when_not_running(self):
+        reply = debug_request(LOOPBACK, self.port, "/debug/profile/stop")
+        assert reply["error"] == "profiler not running"
@@ -0,0 +1,78 @@
+import sys
+import time
+import asyncio
+
+sys.path.append("..")
+import server
+import midi_states as ms
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from devices.DummyLightController import DummyLightController
+
+
+class DelayedLightController(DummyLightController):
+    """
+    Fake backend taking delay seconds per command, like a slow hub
+    """
+    is_blocking = True
+
+    def __init__(self, name:str, delay:float):
+        self._name = name
+        self.delay = delay
+        self.actions = []
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    async def async_turn_on(self, hex_color:str|None=None):
+        await asyncio.sleep(self.delay)
+        self.actions.append(("turn_on", hex_color))
+
+    async def async_turn_off(self):
+        await asyncio.sleep(self.delay)
+        self.actions.append(("turn_off", None))
+
+
+class TestDeviceDeadlines:
+    def setup_method(self):
+        self.dispatcher = DeviceDispatcher(AsyncWorker())
+        self.slow_light = DelayedLightController("slow_light", delay=0.3)
+
+    def test_stale_command_dropped_behind_slow_device(self):
+        now = time.monotonic()
+        first = self.dispatcher.turn_on(self.slow_light, hex_color="#ff0000")
+        stale = self.dispatcher.turn_on(self.slow_light, deadline=now + 0.1, hex_color="#00ff00")
+        fresh = self.dispatcher.turn_on(self.slow_light, deadline=now + 5.0, hex_color="#0000ff")
+        for future in [first, stale, fresh]:
+            future.result(timeout=2)
+
+        assert self.slow_light.actions == [("turn_on", "#ff0000"), ("turn_on", "#0000ff")]
+        assert self.dispatcher.stats()["slow_light"]["stale_dropped"] == 1
+
+    def test_commands_to_a_device_run_in_order(self):
+        futures = [self.dispatcher.turn_on(self.slow_light, hex_color=str(i)) for i in range(3)]
+        futures.append(self.dispatcher.turn_off(self.slow_light))
+        for future in futures:
+            future.result(timeout=3)
+        assert [hex_color for _, hex_color in self.slow_light.actions[:3]] == ["0", "1", "2"]
+        assert self.slow_light.actions[-1][0] == "turn_off"
+
+    def test_deadline_from_receive_time(self):
+        light = DummyLightController(16)
+        rgb_light = DelayedLightController("rgb_light", delay=0.0)
+        # PLAY received 3 s ago, behind a slow queue: the color change is stale
+        server.process_midi_rec_light([16, 106, 127], light, self.dispatcher, rgb_light_controller=rgb_light, received_at=time.monotonic() - 3)
+        # Turning everything off is never stale
+        server.process_midi_rec_light([176, 123, 0], light, self.dispatcher, rgb_light_controller=rgb_light, received_at=time.monotonic() - 60)
+        time.sleep(0.1)
+        assert rgb_light.actions == [("turn_off", None)]
+        assert self.dispatcher.stats()["rgb_light"]["stale_dropped"] == 1
+
+    def test_per_device_deadline_override(self, monkeypatch):
+        monkeypatch.setitem(server.DEVICE_DEADLINES_S, ("rgb_light", ms.MidiActions.PLAY), 10.0)
+        rgb_light = DelayedLightController("rgb_light", delay=0.0)
+        received_at = time.monotonic() - 3
+        assert server.command_deadline(ms.MidiActions.PLAY, rgb_light, received_at) == received_at + 10.0
+        assert server.command_deadline(ms.MidiActions.STOP, rgb_light, received_at) == received_at + 1.0
+        assert server.command_deadline(ms.MidiActions.ALL_NOTES_OFF, rgb_light, received_at) is None
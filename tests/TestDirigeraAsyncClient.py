@@ -0,0 +1,84 @@
+import sys
+import asyncio
+import threading
+
+import pytest
+
+sys.path.append("..")
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DirigeraLightController import DirigeraLightController, COLOR_TO_HEX, hex_to_hsv
+from devices.DirigeraPlugController import DirigeraPlugController
+
+
+class TestDirigeraAsyncClient:
+    def setup_method(self):
+        self.simulator = DirigeraHubSimulator(latency=0.02).start()
+
+    def teardown_method(self):
+        self.simulator.stop()
+
+    def test_light_turn_on_native(self):
+        light_id = self.simulator.add_light("recording_light")
+        light = DirigeraLightController(
+                "recording_light",
+                dirigera_hub=self.simulator.make_hub(),
+                hub_client=self.simulator.make_client(),
+                )
+        asyncio.run(light.async_turn_on(hex_color=COLOR_TO_HEX["red"]))
+
+        hue, saturation, value = hex_to_hsv(COLOR_TO_HEX["red"])
+        attributes = self.simulator.devices[light_id]["attributes"]
+        assert attributes["isOn"] is True
+        assert attributes["colorHue"] == hue
+        assert attributes["lightLevel"] == value
+
+        asyncio.run(light.async_turn_off())
+        assert attributes["isOn"] is False
+
+    def test_plug_native(self):
+        plug_id = self.simulator.add_outlet("Sunset Lights")
+        plug = DirigeraPlugController(
+                "Sunset Lights",
+                dirigera_hub=self.simulator.make_hub(),
+                hub_client=self.simulator.make_client(),
+                )
+        asyncio.run(plug.async_turn_on())
+        assert self.simulator.devices[plug_id]["attributes"]["isOn"] is True
+
+    def test_many_devices_concurrently_without_threads(self):
+        n = 50
+        for i in range(n):
+            self.simulator.add_light(f"light_{i}", is_on=True)
+        hub = self.simulator.make_hub()
+        hub_client = self.simulator.make_client(max_connections=n)
+        lights = [DirigeraLightController(f"light_{i}", dirigera_hub=hub, hub_client=hub_client) for i in range(n)]
+        n_threads = threading.active_count()
+
+        async def turn_all_off():
+            await asyncio.gather(*[light.async_turn_off() for light in lights])
+            return threading.active_count()
+
+        loop = asyncio.new_event_loop()
+        tic = loop.time()
+        assert loop.run_until_complete(turn_all_off()) == n_threads
+        # Concurrent, not 50 x 20 ms
+        assert loop.time() - tic < 0.5
+        assert all(not device["attributes"]["isOn"] for device in self.simulator.devices.values())
+        loop.close()
+
+    def test_connections_are_reused(self):
+        light_id = self.simulator.add_light("recording_light")
+        hub_client = self.simulator.make_client(max_connections=2)
+
+        async def patch_many():
+            for level in range(1, 11):
+                await hub_client.patch(f"/devices/{light_id}", [{"attributes": {"lightLevel": level}}])
+
+        asyncio.run(patch_many())
+        assert self.simulator.connections == 1
+
+    def test_request_timeout(self):
+        self.simulator.latency = 0.5
+        hub_client = self.simulator.make_client(timeout=0.05)
+        with pytest.raises(TimeoutError):
+            asyncio.run(hub_client.get("/devices"))
@@ -0,0 +1,187 @@
+import sys
+import time
+import asyncio
+
+import pytest
+from loguru import logger
+
+sys.path.append("..")
+import server
+import midi_states as ms
+import replay_session as rs
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from ServerConfig import ServerConfig, LiveTable, DEFAULT_CONFIG
+from devices.DummyLightController import DummyLightController
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DirigeraLightController import DirigeraLightController
+from devices.DirigeraPlugController import DirigeraPlugController
+from devices.DirigeraSceneController import DirigeraSceneController
+
+PLAY = [16, 106, 127]
+STOP = [16, 105, 127]
+RECORD_START = [144, 25, 127]
+
+
+class TestDirigeraSceneController:
+    def setup_method(self):
+        self.simulator = DirigeraHubSimulator(latency=0.02).start()
+        self.light_id = self.simulator.add_light("recording_light")
+        self.plug_id = self.simulator.add_outlet("Spotlight Plug")
+        self.simulator.add_scene("Studio play", {
+            self.light_id: {"isOn": True, "lightLevel": 27, "colorHue": 108.0, "colorSaturation": 0.97},
+            self.plug_id: {"isOn": True},
+            })
+        hub = self.simulator.make_hub()
+        hub_client = self.simulator.make_client()
+        self.light = DirigeraLightController("recording_light", dirigera_hub=hub, hub_client=hub_client)
+        self.plug = DirigeraPlugController("Spotlight Plug", dirigera_hub=hub, hub_client=hub_client)
+        self.scene = DirigeraSceneController("Studio play", [self.light, self.plug], dirigera_hub=hub, hub_client=hub_client)
+
+    def teardown_method(self):
+        self.simulator.stop()
+
+    def test_one_request_switches_all_devices(self):
+        n_requests = len(self.simulator.requests)
+        asyncio.run(self.scene.async_turn_on())
+        assert [request[1:] for request in self.simulator.requests[n_requests:]] == [("POST", f"/v1/scenes/{self.scene.scene_id}/trigger")]
+        assert self.simulator.devices[self.light_id]["attributes"]["lightLevel"] == 27
+        assert self.simulator.devices[self.plug_id]["attributes"]["isOn"] is True
+
+    def test_cached_state_follows_scene(self):
+        asyncio.run(self.scene.async_turn_on())
+        assert self.plug.plug.attributes.is_on is True
+        # Not skipped as already off
+        asyncio.run(self.plug.async_turn_off())
+        assert self.simulator.devices[self.plug_id]["attributes"]["isOn"] is False
+
+    def test_failed_trigger_restores_cached_state(self):
+        self.simulator.outage = "refuse"
+        with pytest.raises(Exception):
+            asyncio.run(self.scene.async_turn_on())
+        assert self.plug.plug.attributes.is_on is False
+        assert self.light.light.attributes.light_level == 100
+
+    def test_sync_trigger(self):
+        scene = DirigeraSceneController("Studio play", dirigera_hub=self.simulator.make_hub())
+        scene.turn_on()
+        assert self.simulator.devices[self.plug_id]["attributes"]["isOn"] is True
+
+    def test_unknown_scene(self):
+        with pytest.raises(ValueError):
+            DirigeraSceneController("Studio jam", dirigera_hub=self.simulator.make_hub())
+
+    def test_hub_scene_instead_of_device_commands(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        config = ServerConfig({
+            **DEFAULT_CONFIG,
+            "devices": {"rgb_light": "recording_light", "spotlight": "Spotlight Plug"},
+            "scenes": {"play": {"rgb_light": "red", "spotlight": "on"}, "stop": {"spotlight": "off"}},
+            "hub_scenes": {"play": "Studio play"},
+            })
+        assert config.hub_scenes == {ms.MidiActions.PLAY: "Studio play"}
+        process = server.create_midi_table(
+                config,
+                {"rgb_light": self.light, "spotlight": self.plug, ms.MidiActions.PLAY: self.scene},
+                dispatcher,
+                light_controller=DummyLightController(server.GPIO_PIN),
+                )
+        n_requests = len(self.simulator.requests)
+        process(PLAY)
+        process(STOP) # No hub scene: device commands
+        time.sleep(0.2)
+        assert [request[1] for request in self.simulator.requests[n_requests:]] == ["POST", "PATCH"]
+        assert self.simulator.devices[self.plug_id]["attributes"]["isOn"] is False
+        assert self.simulator.devices[self.light_id]["attributes"]["lightLevel"] == 27
+
+    def test_hub_scenes_at_startup(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        config = ServerConfig({
+            **DEFAULT_CONFIG,
+            "devices": {"rgb_light": "recording_light", "spotlight": "Spotlight Plug"},
+            "hub_scenes": {"play": "Studio play", "stop": "Studio stop"},
+            })
+        # As returned by create_controllers, the stop scene isn't on the hub
+        controllers = {"rgb_light": self.light, "spotlight": self.plug, ms.MidiActions.PLAY: self.scene, ms.MidiActions.STOP: None}
+        live_table = LiveTable()
+        server.create_osc_dispatcher(
+                dispatcher,
+                DummyLightController(server.GPIO_PIN),
+                config=config,
+                live_table=live_table,
+                **server.controller_kwargs(controllers),
+                )
+        n_requests = len(self.simulator.requests)
+        live_table(PLAY)
+        time.sleep(0.2)
+        assert [request[1:] for request in self.simulator.requests[n_requests:]] == [("POST", f"/v1/scenes/{self.scene.scene_id}/trigger")]
+        assert live_table.table.keywords["hub_scenes"] == {ms.MidiActions.PLAY: self.scene}
+        assert dispatcher._queue_keys[id(self.scene)] == dispatcher._queue_keys[id(self.plug)]
+
+    def test_slow_scene_not_overtaken(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        config = ServerConfig({
+            **DEFAULT_CONFIG,
+            "devices": {"rgb_light": "recording_light", "spotlight": "Spotlight Plug"},
+            "scenes": {"stop": {"spotlight": "off"}},
+            "hub_scenes": {"play": "Studio play"},
+            })
+        trigger = self.scene.async_turn_on
+
+        async def slow_trigger(hex_color=None):
+            await asyncio.sleep(0.1) # Eg a retried hub request
+            await trigger(hex_color)
+
+        self.scene.async_turn_on = slow_trigger
+        process = server.create_midi_table(
+                config,
+                {"rgb_light": self.light, "spotlight": self.plug, ms.MidiActions.PLAY: self.scene},
+                dispatcher,
+                light_controller=DummyLightController(server.GPIO_PIN),
+                )
+        process(PLAY)
+        process(STOP)
+        time.sleep(0.4)
+        # The STOP command ran after the PLAY scene, not before it
+        assert self.simulator.devices[self.plug_id]["attributes"]["isOn"] is False
+
+    def test_critical_scene_supersedes_queued_device_commands(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        config = ServerConfig({
+            **DEFAULT_CONFIG,
+            "devices": {"rgb_light": "recording_light", "spotlight": "Spotlight Plug"},
+            "scenes": {"stop": {"rgb_light": "blue"}},
+            "hub_scenes": {"record_start": "Studio play"},
+            })
+        turn_on = self.plug.async_turn_on
+
+        async def slow_turn_on(hex_color=None):
+            await asyncio.sleep(0.1)
+            await turn_on(hex_color)
+
+        self.plug.async_turn_on = slow_turn_on
+        process = server.create_midi_table(
+                config,
+                {"rgb_light": self.light, "spotlight": self.plug, ms.MidiActions.RECORD_START: self.scene},
+                dispatcher,
+                light_controller=DummyLightController(server.GPIO_PIN),
+                )
+        dispatcher.dispatch(self.plug, "turn_on") # Keeps the shared queue busy
+        time.sleep(0.02)
+        process(STOP)
+        process(RECORD_START)
+        time.sleep(0.4)
+        # The older blue command was dropped, not run after the scene
+        assert self.simulator.devices[self.light_id]["attributes"]["colorHue"] == 108.0
+        assert dispatcher.superseded == {"recording_light": 1}
+
+
+class TestHubScenesReplay:
+    def test_fewer_requests_same_states(self):
+        logger.disable("server")
+        session = [(i * 0.15, [PLAY, STOP][i % 2]) for i in range(8)]
+        reports = [rs.run_against_simulator(session, speed=1, settle=0.5, hub_scenes=hub_scenes) for hub_scenes in (False, True)]
+        logger.enable("server")
+        assert reports[0]["states"] == reports[1]["states"]
+        assert reports[1]["outcomes"] == {"ok": len(session)}
+        assert reports[1]["hub_requests"] < reports[0]["hub_requests"]
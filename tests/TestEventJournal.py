@@ -0,0 +1,161 @@
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.append("..")
+import server
+import midi_states as ms
+import EventJournal as ej
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher, CRITICAL
+from devices.DummyLightController import DummyLightController
+from TestDeviceDeadlines import DelayedLightController
+
+
+class FailingLightController(DelayedLightController):
+    async def async_turn_on(self, hex_color:str|None=None):
+        raise ConnectionError("hub unreachable")
+
+
+class TestEventJournal:
+    @pytest.fixture(autouse=True)
+    def journal_path(self, tmp_path):
+        self.path = str(tmp_path / "journal.bin")
+
+    def test_round_trip(self):
+        journal = ej.EventJournal(self.path, capacity=16)
+        journal.record(ej.MIDI, "record_start", source="192.168.1.20", midi_data=[2, 25, 127], timestamp=1000.0)
+        journal.record(ej.DEVICE, "turn_on", ej.FAILED, latency=0.25, device="recording_light", timestamp=1000.5)
+        journal.close()
+
+        midi, device = ej.read_journal(self.path)
+        assert midi == ej.JournalEntry(1, 1000.0, "midi", [2, 25, 127], "record_start", "received", 0.0, "192.168.1.20", "")
+        assert device.kind == "device"
+        assert device.action == "turn_on"
+        assert device.outcome == "failed"
+        assert device.latency == pytest.approx(0.25)
+        assert device.device == "recording_light"
+
+    def test_full_length_source(self):
+        journal = ej.EventJournal(self.path, capacity=16)
+        for source in ("192.168.100.12:57120", "255.255.255.255:65535"):
+            journal.record(ej.MIDI, "play", source=source, midi_data=[16, 106, 127])
+        journal.close()
+        assert [entry.source for entry in ej.read_journal(self.path)] == ["192.168.100.12:57120", "255.255.255.255:65535"]
+
+    def test_action_codes_pinned(self):
+        # Codes stored in existing journals
+        assert (ej.ACTION_CODES["record_start"], ej.ACTION_CODES["unknown"], ej.ACTION_CODES["turn_on"], ej.OTHER_ACTION) == (1, 11, 12, 15)
+        assert all(midi_action.value in ej.ACTION_CODES for midi_action in ms.MidiActions)
+
+    def test_other_version_moved_aside(self):
+        with open(self.path, "wb") as f:
+            f.write(ej.HEADER.pack(ej.MAGIC, ej.VERSION - 1, 64, 16).ljust(ej.HEADER_SIZE + 16 * 64, b"\0"))
+        journal = ej.EventJournal(self.path, capacity=16)
+        journal.record(ej.MIDI, "play")
+        journal.close()
+        assert [entry.action for entry in ej.read_journal(self.path)] == ["play"]
+        with open(self.path + ".old", "rb") as f:
+            assert ej.HEADER.unpack_from(f.read(ej.HEADER.size))[1] == ej.VERSION - 1
+
+    def test_record_after_close(self):
+        journal = ej.EventJournal(self.path, capacity=16)
+        journal.record(ej.MIDI, "record_start")
+        journal.close()
+        # Eg a device command finishing during shutdown
+        journal.record(ej.DEVICE, "turn_off", ej.OK, device="Spotlight Plug")
+        journal.close()
+        assert [entry.action for entry in ej.read_journal(self.path)] == ["record_start"]
+
+    def test_ring_keeps_last_records_in_order(self):
+        journal = ej.EventJournal(self.path, capacity=8)
+        for velocity in range(20):
+            journal.record(ej.MIDI, "snare_on", midi_data=[144, 38, velocity])
+        journal.close()
+        entries = ej.read_journal(self.path)
+        assert [entry.midi_data[2] for entry in entries] == list(range(12, 20))
+
+    def test_reopen_appends(self):
+        journal = ej.EventJournal(self.path, capacity=8)
+        journal.record(ej.MIDI, "play")
+        journal.close()
+        journal = ej.EventJournal(self.path, capacity=1024)
+        assert journal.capacity == 8
+        journal.record(ej.MIDI, "stop")
+        journal.close()
+        assert [(entry.seq, entry.action) for entry in ej.read_journal(self.path)] == [(1, "play"), (2, "stop")]
+
+    def test_concurrent_writers(self):
+        journal = ej.EventJournal(self.path, capacity=4096)
+
+        def write(source:str):
+            for i in range(1000):
+                journal.record(ej.MIDI, "snare_on", source=source, midi_data=[144, 38, i % 128])
+
+        threads = [threading.Thread(target=write, args=(f"client_{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        journal.close()
+
+        entries = ej.read_journal(self.path)
+        assert [entry.seq for entry in entries] == list(range(1, 4001))
+        for i in range(4):
+            velocities = [entry.midi_data[2] for entry in entries if entry.source == f"client_{i}"]
+            assert velocities == [v % 128 for v in range(1000)]
+
+    def test_long_names_truncated(self):
+        journal = ej.EventJournal(self.path, capacity=8)
+        journal.record(ej.DEVICE, "set_level", device="A very long Dirigera device name, in the living room")
+        journal.record(ej.DEVICE, "blink")
+        journal.close()
+        long_name, unknown_action = ej.read_journal(self.path)
+        assert long_name.device == "A very long Dirigera device name, in t"
+        assert unknown_action.action == "other"
+
+    def test_not_a_journal(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 128)
+        with pytest.raises(ValueError):
+            ej.read_journal(self.path)
+
+    def test_filter(self):
+        journal = ej.EventJournal(self.path, capacity=16)
+        journal.record(ej.MIDI, "play", timestamp=10.0)
+        journal.record(ej.DEVICE, "turn_on", ej.OK, device="Spotlight Plug", timestamp=11.0)
+        journal.record(ej.DEVICE, "turn_on", ej.TIMEOUT, device="recording_light", timestamp=12.0)
+        journal.close()
+        entries = ej.read_journal(self.path)
+        assert [entry.device for entry in ej.filter_entries(entries, kind="device")] == ["Spotlight Plug", "recording_light"]
+        assert [entry.device for entry in ej.filter_entries(entries, outcome="timeout")] == ["recording_light"]
+        assert [entry.device for entry in ej.filter_entries(entries, device="Spotlight")] == ["Spotlight Plug"]
+        assert [entry.action for entry in ej.filter_entries(entries, since=11.5)] == ["turn_on"]
+        assert ej.format_entry(entries[0]).split()[3:5] == ["midi", "received"]
+
+    def test_server_records_midi_and_device_outcomes(self):
+        journal = ej.EventJournal(self.path, capacity=64)
+        dispatcher = DeviceDispatcher(AsyncWorker(), journal=journal)
+        light = DummyLightController(server.GPIO_PIN)
+        rgb_light = DelayedLightController("rgb_light", delay=0.05)
+        plug = FailingLightController("Spotlight Plug", delay=0.0)
+
+        server.process_midi_rec_light([16, 106, 127], light, dispatcher, rgb_light_controller=rgb_light, spotlight_plug=plug, journal=journal)
+        futures = [dispatcher.turn_on(rgb_light, hex_color=str(i)) for i in range(3)]
+        futures.append(dispatcher.turn_off(rgb_light, priority=CRITICAL))
+        for future in futures:
+            future.result(timeout=2)
+        time.sleep(0.1)
+        journal.close()
+
+        entries = ej.read_journal(self.path)
+        assert entries[0].kind == "midi"
+        assert entries[0].action == "play"
+        outcomes = {(entry.device, entry.outcome) for entry in entries[1:]}
+        assert ("rgb_light", "ok") in outcomes
+        assert ("rgb_light", "superseded") in outcomes
+        assert ("Spotlight Plug", "failed") in outcomes
+        ok = [entry for entry in entries if entry.device == "rgb_light" and entry.outcome == "ok"]
+        assert all(entry.latency >= 0.05 for entry in ok)
@@ -0,0 +1,90 @@
+import sys
+import time
+import threading
+
+sys.path.append("..")
+import server
+from AsyncWorker import AsyncWorker
+from devices import StubGPIO
+from devices.GPIOLightController import GPIOLightController
+from devices.GPIOEffects import GPIOEffectsEngine, fade, blink, pulse
+
+MAX_JITTER_S = 0.02
+
+
+class TestGPIOEffects:
+    def setup_method(self):
+        StubGPIO.cleanup()
+        StubGPIO.reset_events()
+        self.light = GPIOLightController(16, gpio=StubGPIO)
+        self.effects = GPIOEffectsEngine(self.light, AsyncWorker().loop)
+
+    def test_fade_keyframes(self):
+        keyframes = list(fade(0, 100, 1.0, steps=4))
+        assert keyframes == [(0.0, 0.0), (0.25, 25.0), (0.5, 50.0), (0.75, 75.0), (1.0, 100.0)]
+
+    def test_blink_ends_off(self):
+        keyframes = list(blink(2, 0.1, 0.2))
+        assert [duty for _, duty in keyframes] == [100.0, 0.0, 100.0, 0.0]
+        assert keyframes[-1][0] == 0.1 + 0.2 + 0.1
+
+    def test_pulse_count(self):
+        keyframes = list(pulse(1.0, count=2, steps=2))
+        assert [duty for _, duty in keyframes] == [0.0, 50.0, 100.0, 50.0, 0.0] * 2
+
+    def test_fade_jitter(self):
+        duration, steps = 0.2, 10
+        self.effects.play(fade(0, 100, duration, steps=steps))
+        time.sleep(duration + 0.1)
+        duty_events = [event for event in StubGPIO.duty_events if event[2] is not None]
+        assert [duty for _, _, duty in duty_events] == [100 * i / steps for i in range(steps + 1)]
+
+        start = duty_events[0][0]
+        for i, (timestamp, _, _) in enumerate(duty_events):
+            expected = start + duration * i / steps
+            assert abs(timestamp - expected) < MAX_JITTER_S
+
+        # Fully on at the end: back to a plain HIGH output
+        assert StubGPIO.input(16) == StubGPIO.HIGH
+
+    def test_turn_off_preempts_effect(self):
+        self.effects.pulse(period=0.1)
+        time.sleep(0.05)
+        self.light.turn_off()
+        n_duty_events = len(StubGPIO.duty_events)
+        time.sleep(0.15)
+        assert len(StubGPIO.duty_events) == n_duty_events
+        assert StubGPIO.input(16) == StubGPIO.LOW
+
+    def test_new_effect_preempts_running_one(self):
+        self.effects.pulse(period=0.1)
+        time.sleep(0.05)
+        self.effects.blink(1, on_s=0.02, off_s=0.02)
+        time.sleep(0.15)
+        assert StubGPIO.duty_events[-1][2] is None # PWM stopped after the blink ended
+        assert StubGPIO.input(16) == StubGPIO.LOW
+
+    def test_pulse_never_undoes_turn_on(self):
+        # Beat and snare pulses run on OSC handler threads, concurrently with RECORD_START's turn_on
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(50):
+                self.light.turn_off()
+                stop = threading.Event()
+
+                def pulse_forever():
+                    while not stop.is_set():
+                        server.pulse_light(self.light, 0.001)
+
+                pulser = threading.Thread(target=pulse_forever)
+                pulser.start()
+                time.sleep(0.001)
+                self.light.turn_on()
+                stop.set()
+                pulser.join()
+                time.sleep(0.01) # Any pulse started before turn_on has ended
+                assert self.light.is_on
+                assert StubGPIO.input(16) == StubGPIO.HIGH
+        finally:
+            sys.setswitchinterval(switch_interval)
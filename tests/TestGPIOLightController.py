@@ -0,0 +1,53 @@
+import sys
+import threading
+
+sys.path.append("..")
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from devices import StubGPIO
+from devices.GPIOLightController import GPIOLightController
+from devices.DummyLightController import DummyLightController
+
+
+class SlowLightController(DummyLightController):
+    is_blocking = True
+
+    def __init__(self):
+        self.turned_on = threading.Event()
+        self.thread_name = None
+
+    def turn_on(self, hex_color:str|None=None):
+        self.thread_name = threading.current_thread().name
+        self.turned_on.set()
+
+
+class TestGPIOLightController:
+    def setup_method(self):
+        StubGPIO.reset_events()
+        self.light = GPIOLightController(16, gpio=StubGPIO)
+
+    def test_gpio_light_is_non_blocking(self):
+        assert GPIOLightController.is_blocking is False
+
+    def test_turn_on_off_writes_pin(self):
+        self.light.turn_on()
+        self.light.turn_off()
+        assert [(pin, value) for _, pin, value in StubGPIO.events] == [(16, StubGPIO.HIGH), (16, StubGPIO.LOW)]
+
+    def test_dispatch_runs_gpio_inline(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        dispatcher.turn_on(self.light)
+        # Pin is written before dispatch returns, with no event loop or thread hop
+        assert StubGPIO.input(16) == StubGPIO.HIGH
+        assert len(StubGPIO.events) == 1
+
+    def test_dispatch_runs_blocking_controller_off_thread(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        slow_light = SlowLightController()
+        dispatcher.turn_on(slow_light)
+        assert slow_light.turned_on.wait(timeout=1)
+        assert slow_light.thread_name != threading.current_thread().name
+
+    def test_dispatch_ignores_missing_controller(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        dispatcher.turn_on(None)
@@ -0,0 +1,91 @@
+import sys
+import random
+import threading
+
+sys.path.append("..")
+import midi_states as ms
+from MidiDeduplicator import MidiDeduplicator
+
+LOGIC = "Logic Pro Virtual Out"
+KEYBOARD = "Impact LX61+ MIDI2"
+
+
+def interleaved_streams(n:int, echo_delay_s:float, seed:int=0) -> list:
+    """
+    Synthetic (timestamp, source, midi_data) stream: every record/play/stop press on the keyboard is
+    echoed by Logic echo_delay_s later, with notes from the keyboard in between
+    """
+    rng = random.Random(seed)
+    presses = [[2, 25, 127], [2, 25, 0], [16, 106, 127], [16, 105, 127]]
+    stream = []
+    t = 0.0
+    for i in range(n):
+        midi_data = presses[i % len(presses)]
+        stream.append((t, KEYBOARD, midi_data))
+        stream.append((t + echo_delay_s, LOGIC, midi_data))
+        stream.append((t + rng.uniform(0, echo_delay_s), KEYBOARD, [144, 38, rng.randint(1, 127)]))
+        t += rng.uniform(1.0, 2.0)
+    return sorted(stream, key=lambda event: event[0])
+
+
+class TestMidiDeduplicator:
+    def accepted(self, deduplicator:MidiDeduplicator, stream:list) -> list:
+        return [
+            (source, midi_data) for timestamp, source, midi_data in stream
+            if deduplicator.accept(ms.get_midi_action(midi_data), source, timestamp)
+            ]
+
+    def test_echo_from_other_source_suppressed(self):
+        deduplicator = MidiDeduplicator(window=0.3)
+        accepted = self.accepted(deduplicator, interleaved_streams(40, echo_delay_s=0.02))
+
+        actions = [ms.get_midi_action(midi_data) for _, midi_data in accepted if ms.get_midi_action(midi_data)]
+        assert len(actions) == 40
+        assert deduplicator.suppressed_total == 40
+        assert deduplicator.suppressed[ms.MidiActions.RECORD_START] == 10
+        # Notes are never actions, so never suppressed
+        assert sum(1 for _, midi_data in accepted if midi_data[0] == 144) == 40
+
+    def test_echo_outside_window_passes(self):
+        deduplicator = MidiDeduplicator(window=0.3)
+        accepted = self.accepted(deduplicator, interleaved_streams(8, echo_delay_s=0.5))
+        assert deduplicator.suppressed_total == 0
+        assert len(accepted) == 24
+
+    def test_quick_repeats_from_same_source_pass(self):
+        deduplicator = MidiDeduplicator(window=0.3)
+        for i in range(5):
+            assert deduplicator.accept(ms.MidiActions.PLAY, KEYBOARD, i * 0.01)
+        assert deduplicator.suppressed_total == 0
+
+    def test_different_actions_never_suppressed(self):
+        deduplicator = MidiDeduplicator(window=0.3)
+        assert deduplicator.accept(ms.MidiActions.RECORD_START, KEYBOARD, 0.0)
+        assert deduplicator.accept(ms.MidiActions.RECORD_STOP, LOGIC, 0.01)
+        assert deduplicator.accept(ms.MidiActions.RECORD_START, LOGIC, 0.02) is False
+        assert deduplicator.accept(ms.MidiActions.PLAY, LOGIC, 0.03)
+
+    def test_window_anchored_on_accepted_action(self):
+        deduplicator = MidiDeduplicator(window=0.3)
+        assert deduplicator.accept(ms.MidiActions.STOP, KEYBOARD, 0.0)
+        assert not deduplicator.accept(ms.MidiActions.STOP, LOGIC, 0.2)
+        # Suppressed duplicates don't extend the window
+        assert deduplicator.accept(ms.MidiActions.STOP, LOGIC, 0.4)
+
+    def test_concurrent_sources(self):
+        # Each MIDI port calls back from its own thread: exactly one of the two copies gets through
+        deduplicator = MidiDeduplicator(window=0.3)
+        barrier = threading.Barrier(2)
+        results = {}
+
+        def press(source:str):
+            barrier.wait()
+            results[source] = deduplicator.accept(ms.MidiActions.RECORD_START, source, 0.0)
+
+        threads = [threading.Thread(target=press, args=(source,)) for source in (LOGIC, KEYBOARD)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results.values()) == [False, True]
+        assert deduplicator.suppressed_total == 1
@@ -0,0 +1,126 @@
+import sys
+import time
+import threading
+
+sys.path.append("..")
+from MidiPortWatcher import MidiPortWatcher
+
+LOGIC = "Logic Pro Virtual Out"
+KEYBOARD = "Impact LX61+ MIDI2"
+
+
+class FakePortEnumerator:
+    """
+    Ports that can be plugged in and out, and record when they are opened and closed
+    """
+    def __init__(self, ports:list[str]):
+        self.ports = list(ports)
+        self.calls = 0
+        self.opened = {} # Port name -> time it was opened
+        self.closed = {} # Port name -> time it was closed
+        self.fail_open = set()
+        self._lock = threading.Lock()
+
+    def get_ports(self) -> list[str]:
+        with self._lock:
+            self.calls += 1
+            return list(self.ports)
+
+    def plug(self, port_name:str) -> float:
+        with self._lock:
+            self.ports.append(port_name)
+        return time.monotonic()
+
+    def unplug(self, port_name:str) -> float:
+        with self._lock:
+            self.ports.remove(port_name)
+        return time.monotonic()
+
+    def open_port(self, index:int, port_name:str, source:str) -> str:
+        if port_name in self.fail_open:
+            raise OSError(f"{port_name} is gone")
+        assert self.ports[index] == port_name
+        self.opened[port_name] = time.monotonic()
+        return port_name
+
+    def close_port(self, handle:str) -> None:
+        self.closed[handle] = time.monotonic()
+
+
+class TestMidiPortWatcher:
+    def setup_method(self):
+        self.enumerator = FakePortEnumerator(["IAC Driver Bus 1", f"{LOGIC} 1"])
+        self.watcher = MidiPortWatcher(
+                [LOGIC, KEYBOARD],
+                list_ports=self.enumerator.get_ports,
+                open_port=self.enumerator.open_port,
+                close_port=self.enumerator.close_port,
+                poll_interval=0.02,
+                )
+
+    def teardown_method(self):
+        self.watcher.stop()
+
+    def wait_for(self, condition, timeout:float=1.0) -> float:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "Timed out"
+            time.sleep(0.001)
+        return time.monotonic()
+
+    def test_opens_available_sources_on_start(self):
+        self.watcher.start()
+        assert list(self.watcher.opened) == [LOGIC]
+        assert self.watcher.missing() == [KEYBOARD]
+
+    def test_keyboard_plugged_in_later(self):
+        self.watcher.start()
+        plugged_at = self.enumerator.plug(f"{KEYBOARD} 2")
+        opened_at = self.wait_for(lambda: f"{KEYBOARD} 2" in self.enumerator.opened)
+        # Recovered within one poll interval, plus scheduling slack
+        assert opened_at - plugged_at < self.watcher.poll_interval + 0.05
+        assert self.watcher.missing() == []
+
+    def test_unplug_and_replug(self):
+        port_name = f"{KEYBOARD} 2"
+        self.enumerator.plug(port_name)
+        self.watcher.start()
+        logic_handle = self.watcher.opened[LOGIC][1]
+
+        unplugged_at = self.enumerator.unplug(port_name)
+        closed_at = self.wait_for(lambda: port_name in self.enumerator.closed)
+        assert closed_at - unplugged_at < self.watcher.poll_interval + 0.05
+        assert self.watcher.missing() == [KEYBOARD]
+
+        replugged_at = self.enumerator.plug(port_name)
+        reopened_at = self.wait_for(lambda: self.enumerator.opened[port_name] > replugged_at)
+        assert reopened_at - replugged_at < self.watcher.poll_interval + 0.05
+        assert self.watcher.reconnects == 1
+        # The other source was never touched
+        assert self.watcher.opened[LOGIC][1] is logic_handle
+        assert f"{LOGIC} 1" not in self.enumerator.closed
+
+    def test_open_failure_retried(self):
+        port_name = f"{KEYBOARD} 2"
+        self.enumerator.fail_open.add(port_name)
+        self.enumerator.plug(port_name)
+        self.watcher.scan()
+        assert self.watcher.missing() == [KEYBOARD]
+
+        self.enumerator.fail_open.clear()
+        self.watcher.scan()
+        assert self.watcher.missing() == []
+
+    def test_unchanged_port_list_is_cheap(self):
+        self.watcher.scan()
+        opened = dict(self.enumerator.opened)
+        for _ in range(100):
+            self.watcher.scan()
+        assert self.enumerator.opened == opened
+        assert self.enumerator.closed == {}
+
+    def test_stop_closes_ports(self):
+        self.watcher.start()
+        self.watcher.stop()
+        assert f"{LOGIC} 1" in self.enumerator.closed
+        assert self.watcher.opened == {}
@@ -0,0 +1,122 @@
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.append("..")
+from MidiSender import MidiSender, RingBuffer
+
+
+class TestRingBuffer:
+    def test_fifo_and_wraparound(self):
+        ring = RingBuffer(capacity=4)
+        popped = []
+        for i in range(10):
+            assert ring.push(i)
+            if i % 3 == 2:
+                ring.drain(popped)
+        ring.drain(popped)
+        assert popped == list(range(10))
+        assert len(ring) == 0
+
+    def test_full_ring_drops_newest(self):
+        ring = RingBuffer(capacity=4)
+        assert all(ring.push(i) for i in range(4))
+        assert not ring.push(4)
+        assert ring.dropped == 1
+        popped = []
+        assert ring.drain(popped) == 4
+        assert popped == [0, 1, 2, 3]
+
+    def test_capacity_power_of_2(self):
+        with pytest.raises(ValueError):
+            RingBuffer(capacity=1000)
+
+    def test_concurrent_producer_consumer(self):
+        ring = RingBuffer(capacity=64)
+        n = 50000
+        popped = []
+
+        def produce():
+            for i in range(n):
+                while len(ring) >= ring.capacity:
+                    time.sleep(0)
+                ring.push(i)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        while len(popped) < n:
+            ring.drain(popped)
+        producer.join()
+        assert popped == list(range(n))
+        assert ring.dropped == 0
+
+
+class TestMidiSender:
+    def setup_method(self):
+        self.batches = []
+        self.handler_threads = set()
+
+    def handler(self, events:list) -> None:
+        self.handler_threads.add(threading.get_ident())
+        self.batches.append(events)
+
+    def test_sources_merged_in_order_on_one_thread(self):
+        sender = MidiSender(self.handler, ["logic", "keyboard"]).start()
+        n = 2000
+
+        def produce(source:str):
+            for i in range(n):
+                sender.push(([144, 38, i % 128], 0.0), source)
+                if i % 100 == 0:
+                    time.sleep(0.001)
+
+        producers = [threading.Thread(target=produce, args=(source,)) for source in ("logic", "keyboard")]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        sender.stop()
+
+        events = [event for batch in self.batches for event in batch]
+        assert len(events) == 2 * n
+        assert sender.dropped == 0
+        assert len(self.handler_threads) == 1
+        assert threading.get_ident() not in self.handler_threads
+        for batch in self.batches:
+            assert len(batch) <= sender.max_batch
+            assert [timestamp for _, timestamp, _ in batch] == sorted(timestamp for _, timestamp, _ in batch)
+        for source in ("logic", "keyboard"):
+            assert [midi_data[2] for midi_data, _, s in events if s == source] == [i % 128 for i in range(n)]
+
+    def test_wakes_up_on_push(self):
+        sender = MidiSender(self.handler, ["logic"]).start()
+        time.sleep(0.05) # Let the sender go idle
+        tic = time.monotonic()
+        sender.push(([2, 25, 127], 0.0), "logic")
+        while not self.batches and time.monotonic() - tic < 1:
+            time.sleep(0.0005)
+        # Woken up by the push, not by the idle timeout
+        assert time.monotonic() - tic < 0.1
+        assert self.batches[0][0][0] == [2, 25, 127]
+        sender.stop()
+
+    def test_stop_handles_buffered_messages(self):
+        sender = MidiSender(self.handler, ["logic"])
+        for i in range(10):
+            sender.push(([144, 38, i], 0.0), "logic")
+        sender.start().stop()
+        assert sender.processed == 10
+
+    def test_handler_error_does_not_stop_sender(self):
+        def failing_handler(events:list) -> None:
+            self.handler(events)
+            raise RuntimeError("OSC send failed")
+
+        sender = MidiSender(failing_handler, ["logic"]).start()
+        sender.push(([144, 38, 1], 0.0), "logic")
+        time.sleep(0.05)
+        sender.push(([144, 38, 2], 0.0), "logic")
+        sender.stop()
+        assert sender.processed == 2
@@ -0,0 +1,59 @@
+import sys
+import time
+import threading
+
+from loguru import logger
+
+sys.path.append("..")
+import server
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from SessionManager import SessionManager
+from MulticastOSC import MulticastOSCClient, MulticastOSCUDPServer
+from TestSessionManager import StateLightController, RECORD_START, RECORD_STOP
+
+LOOPBACK = "127.0.0.1"
+
+
+class TestMulticastOSC:
+    def setup_method(self):
+        logger.disable("server")
+        self.lights = []
+        self.sessions = []
+        self.servers = []
+        port = 0 # The first server picks a free port, the others share it
+        for _ in range(3):
+            light = StateLightController()
+            sessions = SessionManager()
+            dispatcher = server.create_osc_dispatcher(DeviceDispatcher(AsyncWorker()), light, session_manager=sessions)
+            osc = MulticastOSCUDPServer(("0.0.0.0", port), dispatcher, interface=LOOPBACK)
+            port = osc.server_address[1]
+            threading.Thread(target=osc.serve_forever, daemon=True).start()
+            self.lights.append(light)
+            self.sessions.append(sessions)
+            self.servers.append(osc)
+        self.client = MulticastOSCClient(port=port, interface=LOOPBACK)
+
+    def teardown_method(self):
+        logger.enable("server")
+        for osc in self.servers:
+            osc.shutdown()
+            osc.server_close()
+
+    def wait_for(self, condition, timeout:float=2.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_every_server_receives_one_send(self):
+        self.client.send_message("/midi", RECORD_START)
+        assert self.wait_for(lambda: all(light.on for light in self.lights))
+        # The same client session on every server
+        assert all(len(sessions) == 1 for sessions in self.sessions)
+        assert len({next(iter(sessions.stats())) for sessions in self.sessions}) == 1
+
+        self.client.send_message("/midi", RECORD_STOP)
+        assert self.wait_for(lambda: not any(light.on for light in self.lights))
@@ -0,0 +1,115 @@
+import sys
+import time
+import asyncio
+import statistics
+
+sys.path.append("..")
+import server
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher, CRITICAL, BEST_EFFORT
+from LatencyStats import percentile
+from devices.DirigeraAsyncClient import critical_request
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DummyLightController import DummyLightController
+from TestDeviceDeadlines import DelayedLightController
+
+
+def critical_latencies(dispatcher:DeviceDispatcher, light:DelayedLightController, n:int=20) -> list:
+    latencies = []
+    for i in range(n):
+        tic = time.monotonic()
+        dispatcher.turn_on(light, priority=CRITICAL, hex_color=f"critical_{i}").result(timeout=5)
+        latencies.append(time.monotonic() - tic)
+        time.sleep(0.005)
+    return latencies
+
+
+class TestPriorityLanes:
+    def setup_method(self):
+        self.dispatcher = DeviceDispatcher(AsyncWorker())
+        self.recording_light = DelayedLightController("recording_light", delay=0.01)
+        self.ambience = [DelayedLightController(f"ambience_{i}", delay=0.05) for i in range(5)]
+
+    def test_critical_latency_flat_under_best_effort_flood(self):
+        baseline = critical_latencies(self.dispatcher, self.recording_light)
+
+        # Flood every device, including the recording light, with best-effort commands
+        flood = []
+        for i in range(40):
+            for controller in self.ambience + [self.recording_light]:
+                flood.append(self.dispatcher.turn_on(controller, hex_color=f"ambience_{i}"))
+        loaded = critical_latencies(self.dispatcher, self.recording_light)
+        for future in flood:
+            future.result(timeout=30)
+
+        # At worst a critical command waits for the best-effort command already running on its device
+        baseline_p99 = max(baseline)
+        assert max(loaded) < baseline_p99 + self.recording_light.delay + 0.05
+        assert statistics.median(loaded) < statistics.median(baseline) + self.recording_light.delay + 0.02
+
+    def test_critical_runs_ahead_of_queued_best_effort(self):
+        futures = [self.dispatcher.turn_on(self.recording_light, hex_color=f"ambience_{i}") for i in range(10)]
+        futures.append(self.dispatcher.turn_off(self.recording_light, priority=CRITICAL))
+        for future in futures:
+            future.result(timeout=2)
+
+        # Only the best-effort command already running when the critical one arrived reached the device
+        assert self.recording_light.actions[-1] == ("turn_off", None)
+        assert len(self.recording_light.actions) <= 2
+        assert self.dispatcher.stats()["recording_light"]["superseded"] >= 9
+
+    def test_best_effort_after_critical_still_runs(self):
+        self.dispatcher.turn_on(self.recording_light, priority=CRITICAL, hex_color="red").result(timeout=2)
+        self.dispatcher.turn_on(self.recording_light, priority=BEST_EFFORT, hex_color="blue").result(timeout=2)
+        assert self.recording_light.actions == [("turn_on", "red"), ("turn_on", "blue")]
+
+    def test_lane_stats(self):
+        self.dispatcher.turn_on(self.recording_light, priority=CRITICAL).result(timeout=2)
+        self.dispatcher.turn_on(self.ambience[0]).result(timeout=2)
+        stats = self.dispatcher.lane_stats()
+        assert stats["critical"]["count"] == 1
+        assert stats["best_effort"]["count"] == 1
+        assert stats["critical"]["p99_ms"] >= self.recording_light.delay * 1e3
+
+    def test_lane_stats_p99_nearest_rank(self):
+        self.dispatcher.lane_latencies[CRITICAL].extend(i / 1e3 for i in range(10, 0, -1))
+        assert self.dispatcher.lane_stats()["critical"]["p99_ms"] == 10.0
+        assert percentile(list(range(1, 1001)), 0.99) == 990
+        assert percentile([7], 0.99) == 7
+
+    def test_record_actions_are_critical(self):
+        futures = [self.dispatcher.turn_on(self.recording_light, hex_color=f"ambience_{i}") for i in range(10)]
+        server.process_midi_rec_light([2, 25, 0], DummyLightController(server.GPIO_PIN), self.dispatcher, rgb_light_controller=self.recording_light)
+        for future in futures:
+            future.result(timeout=2)
+        time.sleep(0.1)
+        assert self.recording_light.actions[-1] == ("turn_on", server.DEFAULT_SERVER_CONFIG.colors["pink"])
+        assert self.dispatcher.stats()["recording_light"]["superseded"] >= 9
+
+
+class TestReservedConnections:
+    def setup_method(self):
+        self.simulator = DirigeraHubSimulator(latency=0.1).start()
+        self.light_id = self.simulator.add_light("recording_light")
+
+    def teardown_method(self):
+        self.simulator.stop()
+
+    def test_critical_request_not_queued_behind_best_effort(self):
+        hub_client = self.simulator.make_client(max_connections=4, reserved_connections=1)
+
+        async def critical_get():
+            critical_request.set(True)
+            tic = asyncio.get_running_loop().time()
+            await hub_client.get(f"/devices/{self.light_id}")
+            return asyncio.get_running_loop().time() - tic
+
+        async def flood_then_critical():
+            flood = [asyncio.create_task(hub_client.get("/devices")) for _ in range(20)]
+            await asyncio.sleep(0.01)
+            latency = await asyncio.create_task(critical_get())
+            await asyncio.gather(*flood)
+            return latency
+
+        # 20 best-effort requests on 3 connections take ~0.7 s, the critical one gets the reserved connection
+        assert asyncio.run(flood_then_critical()) < 0.3
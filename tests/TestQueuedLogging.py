@@ -0,0 +1,134 @@
+import io
+import sys
+import time
+import threading
+
+import pytest
+from loguru import logger
+
+sys.path.append("..")
+from QueuedLogging import QueuedSink, LogSummary
+
+
+class BlockingStream(io.StringIO):
+    """
+    Stream whose writes block until released, like a stalled SD card
+    """
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+        self.writes = 0
+
+    def write(self, data:str) -> int:
+        self.released.wait()
+        self.writes += 1
+        return super().write(data)
+
+
+class FormatCounter:
+    def __init__(self):
+        self.formatted = 0
+
+    def __format__(self, spec:str) -> str:
+        self.formatted += 1
+        return "formatted"
+
+
+class TestQueuedLogging:
+    @pytest.fixture(autouse=True)
+    def restore_logger(self):
+        yield
+        logger.remove()
+        logger.add(sys.stderr)
+
+    def add_sink(self, stream, **kwargs) -> QueuedSink:
+        logger.remove()
+        sink = QueuedSink(stream, **kwargs)
+        logger.add(sink, level="INFO", format="{level} {message}")
+        return sink
+
+    def test_messages_written_in_order_by_background_thread(self):
+        stream = io.StringIO()
+        sink = self.add_sink(stream, flush_interval=0.01)
+        for i in range(100):
+            logger.info("message {}", i)
+        time.sleep(0.1)
+        assert stream.getvalue().splitlines() == [f"INFO message {i}" for i in range(100)]
+
+    def test_logger_remove_writes_queued_messages(self):
+        stream = io.StringIO()
+        self.add_sink(stream, flush_interval=10)
+        logger.info("last words")
+        logger.remove()
+        assert stream.getvalue() == "INFO last words\n"
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        stream = BlockingStream()
+        stream.released.set()
+        sink = self.add_sink(stream, maxsize=10, flush_interval=10)
+        stream.released.clear()
+
+        tic = time.perf_counter()
+        for i in range(50):
+            logger.info("message {}", i)
+        assert time.perf_counter() - tic < 0.1
+        assert sink.dropped == 40
+
+        stream.released.set()
+        logger.remove()
+        lines = stream.getvalue().splitlines()
+        assert lines[:10] == [f"INFO message {i}" for i in range(10)]
+        assert lines[-1] == "40 log messages dropped, logging queue full"
+
+    def test_warnings_written_right_away(self):
+        stream = io.StringIO()
+        self.add_sink(stream, flush_interval=10)
+        logger.warning("device offline")
+        time.sleep(0.05)
+        assert stream.getvalue() == "WARNING device offline\n"
+
+    def test_disabled_level_is_not_formatted(self):
+        stream = io.StringIO()
+        self.add_sink(stream)
+        counter = FormatCounter()
+        for _ in range(10):
+            logger.debug("{}", counter)
+        logger.info("{}", counter)
+        logger.remove()
+        assert counter.formatted == 1
+        assert stream.getvalue() == "INFO formatted\n"
+
+
+class TestLogSummary:
+    def test_counts_and_resets(self):
+        summary = LogSummary("Sent over OSC")
+        for _ in range(3):
+            summary.count("/midi")
+        summary.count("/tempo")
+        assert summary.flush() == {"/midi": 3, "/tempo": 1}
+        assert summary.flush() == {}
+
+    def test_concurrent_counts(self):
+        summary = LogSummary("Sent over OSC")
+
+        def count():
+            for _ in range(10000):
+                summary.count("/midi")
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert summary.flush() == {"/midi": 40000}
+
+    def test_flush_logs_one_line(self):
+        stream = io.StringIO()
+        logger.remove()
+        logger.add(stream, format="{message}")
+        summary = LogSummary("MIDI actions handled")
+        summary.count("snare_on", 120)
+        summary.flush()
+        logger.remove()
+        logger.add(sys.stderr)
+        assert stream.getvalue().startswith("MIDI actions handled in the last 0s: {'snare_on': 120}")
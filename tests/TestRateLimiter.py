@@ -0,0 +1,66 @@
+import sys
+
+sys.path.append("..")
+from RateLimiter import LatestValueRateLimiter
+from TimerWheel import TimerWheel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLatestValueRateLimiter:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=0.001, clock=self.clock)
+        self.sent = []
+
+    def run_until(self, end:float, step:float=0.001):
+        while self.clock.now < end:
+            self.clock.now = round(self.clock.now + step, 6)
+            self.wheel.advance()
+
+    def test_first_value_sent_immediately(self):
+        limiter = LatestValueRateLimiter(self.wheel, self.sent.append, rate=2)
+        limiter.submit(1)
+        assert self.sent == [1]
+
+    def test_snare_roll_is_capped(self):
+        limiter = LatestValueRateLimiter(self.wheel, self.sent.append, rate=2, merge=max)
+        # 20 hits/s for 5 s
+        for i in range(100):
+            self.run_until(i * 0.05)
+            limiter.submit(i)
+        self.run_until(6.0)
+        assert len(self.sent) <= 2 * 6 + 1
+        assert limiter.sent + limiter.folded == 100
+        # The last hit is never lost
+        assert self.sent[-1] == 99
+
+    def test_hits_fold_into_max(self):
+        limiter = LatestValueRateLimiter(self.wheel, self.sent.append, rate=2, merge=max)
+        for velocity in [10, 120, 30]:
+            limiter.submit(velocity)
+        assert self.sent == [10]
+        self.run_until(0.5)
+        assert self.sent == [10, 120]
+
+    def test_latest_value_by_default(self):
+        limiter = LatestValueRateLimiter(self.wheel, self.sent.append, rate=10)
+        for value in ["red", "green", "blue"]:
+            limiter.submit(value)
+        self.run_until(0.1)
+        assert self.sent == ["red", "blue"]
+
+    def test_cancel_drops_pending(self):
+        limiter = LatestValueRateLimiter(self.wheel, self.sent.append, rate=2)
+        limiter.submit(1)
+        limiter.submit(2)
+        limiter.cancel()
+        self.run_until(1.0)
+        assert self.sent == [1]
+        assert len(self.wheel) == 0
@@ -0,0 +1,109 @@
+import sys
+import time
+
+import pytest
+
+sys.path.append("..")
+import EventJournal as ej
+import replay_session as rs
+
+PLAY = [16, 106, 127]
+STOP = [16, 105, 127]
+RECORD_START = [2, 25, 127]
+RECORD_STOP = [2, 25, 0]
+SNARE = [153, 38, 100]
+
+
+def varlen(value:int) -> bytes:
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(encoded)
+
+def write_midi_file(path:str, tracks:list[list[tuple[int, bytes]]], division:int=480) -> None:
+    """
+    Write a format 1 MIDI file, tracks of (delta ticks, raw event bytes)
+    """
+    data = b"MThd" + (6).to_bytes(4, "big") + (1).to_bytes(2, "big") + len(tracks).to_bytes(2, "big") + division.to_bytes(2, "big")
+    for track in tracks:
+        body = b"".join(varlen(delta) + event for delta, event in track) + b"\x00\xff\x2f\x00"
+        data += b"MTrk" + len(body).to_bytes(4, "big") + body
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class TestReadSession:
+    def test_midi_file_tempo_and_running_status(self, tmp_path):
+        path = str(tmp_path / "session.mid")
+        tempo_track = [
+            (0, b"\xff\x51\x03" + (500000).to_bytes(3, "big")), # 120 BPM
+            (960, b"\xff\x51\x03" + (1000000).to_bytes(3, "big")), # 60 BPM after 2 beats
+            ]
+        play, stop = [176, 106, 127], [176, 105, 127] # Transport buttons, as control changes
+        notes = [
+            (0, bytes(play)),
+            (480, bytes([153, 38, 100])),
+            (480, bytes([38, 90])), # Running status
+            (480, b"\xf0\x03\x01\x02\xf7"), # Sysex, skipped
+            (0, bytes([0xC9, 5])), # Program change, 2 bytes, skipped
+            (0, bytes(stop)),
+            ]
+        write_midi_file(path, [tempo_track, notes])
+        session = rs.read_session(path)
+        assert [midi_data for _, midi_data in session] == [play, SNARE, [153, 38, 90], stop]
+        assert [offset for offset, _ in session] == pytest.approx([0.0, 0.5, 1.0, 2.0])
+
+    def test_journal(self, tmp_path):
+        path = str(tmp_path / "journal.bin")
+        journal = ej.EventJournal(path, capacity=16)
+        journal.record(ej.MIDI, "play", midi_data=PLAY, timestamp=100.0)
+        journal.record(ej.DEVICE, "turn_on", ej.OK, device="Spotlight Plug", timestamp=100.1)
+        journal.record(ej.MIDI, "stop", midi_data=STOP, timestamp=102.5)
+        journal.close()
+        assert rs.read_session(path) == [(0.0, PLAY), (2.5, STOP)]
+
+    def test_filter_actions(self):
+        session = [(0.0, PLAY), (0.1, SNARE), (0.2, [144, 60, 100]), (0.3, STOP)]
+        assert rs.filter_actions(session, ["play", "stop"]) == [(0.0, PLAY), (0.3, STOP)]
+        assert rs.filter_actions(session, ["unknown"]) == [(0.2, [144, 60, 100])]
+
+
+class TestReplay:
+    def test_scaled_timing(self):
+        session = [(0.0, PLAY), (0.2, SNARE), (0.4, STOP)]
+        sent = []
+        tic = time.monotonic()
+        lateness = rs.replay(session, lambda midi_data: sent.append((time.monotonic() - tic, midi_data)), speed=2)
+        assert [midi_data for _, midi_data in sent] == [PLAY, SNARE, STOP]
+        assert [offset for offset, _ in sent] == pytest.approx([0.0, 0.1, 0.2], abs=0.02)
+        assert max(lateness) < 0.02
+
+    def test_as_fast_as_possible(self):
+        session = [(i * 1.0, SNARE) for i in range(100)]
+        tic = time.monotonic()
+        assert rs.replay(session, lambda midi_data: None, speed=0) == []
+        assert time.monotonic() - tic < 0.1
+
+    def test_runs_compared_against_simulator(self):
+        session = [(0.0, PLAY), (0.05, RECORD_START), *[(0.1 + i * 0.01, SNARE) for i in range(20)], (0.4, RECORD_STOP), (0.5, STOP)]
+        reports = [rs.run_against_simulator(session, speed, settle=0.5) for speed in (1, 0)]
+
+        for report in reports:
+            assert report["received"] == len(session)
+            assert report["outcomes"].get("ok", 0) > 0
+            assert report["latency_p99_ms"] is not None
+        # Same session, same end state, whatever the speed
+        assert reports[0]["states"] == reports[1]["states"]
+        assert reports[0]["states"]["Spotlight Plug"]["isOn"] is False
+        assert reports[0]["states"]["Sunset Lights"]["isOn"] is True
+        assert reports[1]["duration_s"] < reports[0]["duration_s"]
+        assert "speed  max" in rs.format_reports(reports)
+
+    def test_concurrent_clients(self):
+        session = [(0.0, PLAY), (0.1, STOP), (0.2, PLAY), (0.3, STOP)]
+        report = rs.run_against_simulator(session, speed=1, settle=0.5, clients=50)
+        assert report["sessions"] == 50
+        assert report["received"] == report["sent"] == 200
+        assert report["states"]["Spotlight Plug"]["isOn"] is False
@@ -0,0 +1,194 @@
+import os
+import sys
+import time
+import threading
+from functools import partial
+
+import pytest
+from loguru import logger
+
+sys.path.append("..")
+import server
+import midi_states as ms
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from devices.DummyLightController import DummyLightController
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DirigeraPlugController import DirigeraPlugController
+from ServerConfig import ServerConfig, LiveTable, ConfigWatcher, load_config, DEFAULT_CONFIG
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), "..", "config.toml")
+PLAY = [16, 106, 127]
+SCENE_A = {"rgb_light": "#0000aa", "sunset_lights": "on", "spotlight": "off"}
+SCENE_B = {"rgb_light": "#0000bb", "sunset_lights": "off", "spotlight": "on"}
+
+
+class RecordingController(DummyLightController):
+    """
+    Inline controller recording the actions run on it, per calling thread
+    """
+    def __init__(self, name:str, actions:threading.local):
+        self._name = name
+        self.actions = actions
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def turn_on(self, hex_color:str|None=None):
+        self.actions.list.append((self._name, "turn_on", hex_color))
+
+    def turn_off(self):
+        self.actions.list.append((self._name, "turn_off", None))
+
+
+def config_with_play_scene(scene:dict) -> ServerConfig:
+    return ServerConfig({**DEFAULT_CONFIG, "scenes": {"play": scene}})
+
+def scene_actions(scene:dict) -> list:
+    return [
+        (role, "turn_off", None) if state == "off" else (role, "turn_on", None if state == "on" else state)
+        for role, state in scene.items()
+        ]
+
+
+class TestServerConfig:
+    def test_config_file_is_the_default(self):
+        config = load_config(CONFIG_FILE)
+        default = ServerConfig.default()
+        assert config.devices == default.devices
+        assert config.midi_rules == default.midi_rules
+        assert config.scenes == default.scenes
+
+    def test_mapping_matches_midi_states(self):
+        config = ServerConfig.default()
+        messages = [[status, data1, data2] for status in (2, 16, 137, 144, 153, 176, 191) for data1 in (25, 38, 105, 106, 109, 110, 121, 123) for data2 in (0, 64, 127)]
+        for midi_data in messages:
+            assert config.midi_action(midi_data) == ms.get_midi_action(midi_data), midi_data
+
+    @pytest.mark.parametrize("config", [
+        {"devices": {"disco_ball": "Disco"}},
+        {"midi": [{"action": "jump", "data1": 1}]},
+        {"scenes": {"play": {"rgb_light": "ultraviolet"}}},
+        {"scenes": {"play": {"smoke_machine": "on"}}},
+        {"delayed_scenes": {"stop": {"sunset_lights": "off"}}},
+        {"delayed_scenes": {"stop": {"after_s": -1, "sunset_lights": "off"}}},
+        ])
+    def test_invalid_config(self, config):
+        with pytest.raises(ValueError):
+            ServerConfig(config)
+
+
+class TestConfigWatcher:
+    def write(self, path, text:str) -> None:
+        with open(path, "w") as f:
+            f.write(text)
+
+    def test_reload_on_change_keep_config_on_error(self, tmp_path):
+        path = tmp_path / "config.toml"
+        self.write(path, '[scenes.play]\nrgb_light = "red"\n')
+        loaded = []
+        watcher = ConfigWatcher(str(path), loaded.append)
+        assert watcher.check() is False
+
+        self.write(path, '[scenes.play]\nrgb_light = "blue"\nspotlight = "on"\n')
+        assert watcher.check() is True
+        assert loaded[-1].scenes[ms.MidiActions.PLAY][0][2] == {"hex_color": "#0000FF"}
+
+        self.write(path, '[scenes.play]\nrgb_light = "not a color at all"\n')
+        assert watcher.check() is False
+        self.write(path, '[scenes.play\n')
+        assert watcher.check() is False
+        assert (watcher.reloads, watcher.errors, len(loaded)) == (1, 2, 1)
+
+    def test_background_reload(self, tmp_path):
+        path = tmp_path / "config.toml"
+        self.write(path, "")
+        loaded = []
+        watcher = ConfigWatcher(str(path), loaded.append, poll_interval=0.01).start()
+        self.write(path, '[devices]\nspotlight = "Disco Ball"\n')
+        time.sleep(0.2)
+        watcher.stop()
+        assert [config.devices for config in loaded] == [{"spotlight": "Disco Ball"}]
+
+
+class TestReload:
+    def setup_method(self):
+        self.async_worker = AsyncWorker()
+        self.dispatcher = DeviceDispatcher(self.async_worker)
+        self.actions = threading.local()
+        self.controllers = {role: RecordingController(role, self.actions) for role in SCENE_A}
+
+    def test_unchanged_devices_keep_their_controller(self, monkeypatch):
+        config = ServerConfig.default()
+        previous = {role: RecordingController(name, self.actions) for role, name in config.devices.items()}
+        new_config = ServerConfig({"devices": {**config.devices, "spotlight": "Disco Ball"}})
+        simulator = DirigeraHubSimulator().start()
+        plug_id = simulator.add_outlet("Disco Ball")
+        monkeypatch.setitem(server.DEVICE_FACTORIES, "spotlight", partial(
+                DirigeraPlugController,
+                dirigera_hub=simulator.make_hub(),
+                hub_client=simulator.make_client(),
+                ))
+        # Only the new device gets a new controller, the others are reused as they are
+        controllers = server.create_controllers(new_config, self.async_worker, previous=previous, health_check=False)
+        simulator.stop()
+        assert controllers["spotlight"].plug.id == plug_id
+        assert controllers == {**previous, "spotlight": controllers["spotlight"]}
+
+    def test_no_event_dropped_or_mixed_during_reloads(self):
+        logger.disable("server")
+        configs = [config_with_play_scene(SCENE_A), config_with_play_scene(SCENE_B)]
+        live_table = LiveTable()
+        server.create_osc_dispatcher(
+                self.dispatcher,
+                DummyLightController(server.GPIO_PIN),
+                rgb_light_controller=self.controllers["rgb_light"],
+                sunset_lights_plug=self.controllers["sunset_lights"],
+                spotlight_plug=self.controllers["spotlight"],
+                config=configs[0],
+                live_table=live_table,
+                )
+        stop = threading.Event()
+        reloads = []
+
+        def reload_forever():
+            while not stop.is_set():
+                tic = time.perf_counter()
+                server.reload_midi_table(live_table, configs[(len(reloads) + 1) % 2], self.controllers)
+                reloads.append(time.perf_counter() - tic)
+                time.sleep(0)
+
+        results = []
+
+        def handle_events(n:int):
+            self.actions.list = []
+            for i in range(n):
+                live_table(PLAY, received_at=time.monotonic())
+                if i % 10 == 0:
+                    time.sleep(0) # Let the reloader swap tables between events
+            results.append(self.actions.list)
+
+        reloader = threading.Thread(target=reload_forever)
+        reloader.start()
+        while not reloads: # Events see both configs
+            time.sleep(0.001)
+        handlers = [threading.Thread(target=handle_events, args=(500,)) for _ in range(4)]
+        for handler in handlers:
+            handler.start()
+        for handler in handlers:
+            handler.join()
+        stop.set()
+        reloader.join()
+        logger.enable("server")
+
+        assert len(reloads) > 10
+        scenes = [scene_actions(SCENE_A), scene_actions(SCENE_B)]
+        seen = set()
+        for actions in results:
+            # One scene of 3 actions per event, none missing, each entirely from one config
+            assert len(actions) == 500 * 3
+            for i in range(0, len(actions), 3):
+                assert actions[i:i + 3] in scenes
+                seen.add(actions[i][2])
+        assert seen == {"#0000aa", "#0000bb"}
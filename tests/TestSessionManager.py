@@ -0,0 +1,164 @@
+import sys
+import time
+import threading
+
+from loguru import logger
+from pythonosc import udp_client, osc_server
+
+sys.path.append("..")
+import server
+import midi_states as ms
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from SessionManager import SessionManager
+from devices.DummyLightController import DummyLightController
+
+RECORD_START = [144, 25, 127]
+RECORD_STOP = [144, 25, 0]
+PLAY = [16, 106, 127]
+STOP = [16, 105, 127]
+RESET_ALL = [176, 121, 0]
+ALL_NOTES_OFF = [176, 123, 0]
+MAIN = "10.0.0.1:5000"
+LAPTOP = "10.0.0.2:5000"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StateLightController(DummyLightController):
+    """
+    Inline light keeping its state and the times it was turned off
+    """
+    def __init__(self):
+        self.on = False
+        self.turned_off = 0
+
+    def turn_on(self, hex_color:str|None=None):
+        self.on = True
+
+    def turn_off(self):
+        self.on = False
+        self.turned_off += 1
+
+
+class TestSessionManager:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.sessions = SessionManager(timeout=60, clock=self.clock)
+
+    def test_other_session_cannot_turn_off_while_recording(self):
+        assert self.sessions.update(MAIN, ms.MidiActions.RECORD_START)
+        for midi_action in (ms.MidiActions.ALL_NOTES_OFF, ms.MidiActions.RESET_ALL, ms.MidiActions.RECORD_STOP, ms.MidiActions.PLAY):
+            assert not self.sessions.update(LAPTOP, midi_action)
+        assert self.sessions.update(MAIN, ms.MidiActions.PLAY)
+        assert self.sessions.update(MAIN, ms.MidiActions.RECORD_STOP)
+        # Nobody recording: every session drives the devices again
+        assert self.sessions.update(LAPTOP, ms.MidiActions.ALL_NOTES_OFF)
+        assert self.sessions.stats()[LAPTOP]["ignored"] == 4
+
+    def test_light_stays_on_until_last_recording_stops(self):
+        assert self.sessions.update(MAIN, ms.MidiActions.RECORD_START)
+        assert self.sessions.update(LAPTOP, ms.MidiActions.RECORD_START)
+        assert not self.sessions.update(MAIN, ms.MidiActions.RECORD_STOP)
+        assert self.sessions.recording == 1
+        assert self.sessions.update(LAPTOP, ms.MidiActions.RECORD_STOP)
+        assert self.sessions.recording == 0
+
+    def test_silent_sessions_expire_least_recent_first(self):
+        self.sessions.update(MAIN, ms.MidiActions.RECORD_START)
+        self.clock.now = 30
+        self.sessions.update(LAPTOP, ms.MidiActions.PLAY)
+        self.clock.now = 61
+        self.sessions.update("10.0.0.3:5000", None)
+        assert list(self.sessions.stats()) == [LAPTOP, "10.0.0.3:5000"]
+        assert (self.sessions.expired, self.sessions.recording) == (1, 0)
+        # The laptop was seen again, it isn't the next to expire
+        self.sessions.update(LAPTOP, ms.MidiActions.STOP)
+        self.clock.now = 122
+        self.sessions.update(LAPTOP, ms.MidiActions.STOP)
+        assert list(self.sessions.stats()) == [LAPTOP]
+
+    def test_restarted_client_replaces_its_session(self):
+        assert self.sessions.update(MAIN, ms.MidiActions.RECORD_START)
+        assert not self.sessions.update(LAPTOP, ms.MidiActions.PLAY)
+        # client.py restarted on the main rig during the take: new port, starts with a RESET_ALL
+        restarted = "10.0.0.1:5001"
+        assert self.sessions.update(restarted, ms.MidiActions.RESET_ALL)
+        assert self.sessions.recording == 0
+        assert list(self.sessions.stats()) == [LAPTOP, restarted]
+        assert self.sessions.update(restarted, ms.MidiActions.RECORD_START)
+        assert self.sessions.update(restarted, ms.MidiActions.RECORD_STOP)
+        assert self.sessions.recording == 0
+
+    def test_expiry_pops_only_expired_front(self):
+        sessions = SessionManager(timeout=60, clock=self.clock)
+        for i in range(10):
+            sessions.update(f"10.0.0.{i}:5000", ms.MidiActions.PLAY)
+        self.clock.now = 30
+        for i in range(100000):
+            sessions.update(f"10.1.{i // 256}.{i % 256}:5000", ms.MidiActions.PLAY)
+        self.clock.now = 61
+        sessions.update("10.1.0.0:5000", ms.MidiActions.PLAY)
+        # The 10 sessions silent for too long were at the front, the others are kept
+        assert sessions.expired == 10
+        assert len(sessions) == 100000
+        assert next(iter(sessions.stats())) == "10.1.0.1:5000"
+
+class TestSessionsOverOSC:
+    def setup_method(self):
+        self.light = StateLightController()
+        self.sessions = SessionManager()
+        dispatcher = server.create_osc_dispatcher(
+                DeviceDispatcher(AsyncWorker()),
+                self.light,
+                session_manager=self.sessions,
+                )
+        self.osc = osc_server.ThreadingOSCUDPServer(("127.0.0.1", 0), dispatcher)
+        threading.Thread(target=self.osc.serve_forever, daemon=True).start()
+        logger.disable("server")
+
+    def teardown_method(self):
+        logger.enable("server")
+        self.osc.shutdown()
+
+    def wait_for(self, condition, timeout:float=5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_50_clients_cannot_stop_the_recording_session(self):
+        main = udp_client.SimpleUDPClient(*self.osc.server_address)
+        main.send_message("/midi", RECORD_START)
+        assert self.wait_for(lambda: self.light.on)
+
+        def other_client(client:udp_client.SimpleUDPClient):
+            # 50 messages/s each, 2500/s for all the clients. No RESET_ALL: from this host, it would replace
+            # the main session as if client.py had restarted
+            for i in range(20):
+                client.send_message("/midi", [PLAY, STOP, ALL_NOTES_OFF, RECORD_STOP][i % 4])
+                time.sleep(0.02)
+
+        # Each client keeps its socket, so its own address, for the whole test
+        others = [udp_client.SimpleUDPClient(*self.osc.server_address) for _ in range(49)]
+        clients = [threading.Thread(target=other_client, args=(client,)) for client in others]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert self.wait_for(lambda: len(self.sessions) == 50)
+        # Every message of the other clients received, none applied
+        assert self.wait_for(lambda: sum(session["ignored"] for session in self.sessions.stats().values()) == 49 * 20)
+        assert self.light.on
+        assert self.light.turned_off == 0
+
+        main.send_message("/midi", RECORD_STOP)
+        assert self.wait_for(lambda: not self.light.on)
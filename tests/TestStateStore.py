@@ -0,0 +1,207 @@
+import sys
+import json
+import time
+import threading
+from types import SimpleNamespace
+
+from loguru import logger
+
+sys.path.append("..")
+import server
+import midi_states as ms
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from StateStore import StateStore, load_state, VERSION
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DirigeraLightController import DirigeraLightController
+from devices.DirigeraPlugController import DirigeraPlugController
+from devices.DirigeraSceneController import DirigeraSceneController
+from TestSessionManager import StateLightController, RECORD_START, RECORD_STOP
+
+
+class TestStateStore:
+    def test_burst_is_one_write(self, tmp_path):
+        path = str(tmp_path / "state.json")
+        store = StateStore(path, flush_interval=0.2).start()
+        for i in range(200):
+            store.set_desired("Spotlight Plug", ["turn_on", "turn_off"][i % 2], {})
+        time.sleep(0.4)
+        assert store.updates == 200
+        assert store.writes == 1
+        store.stop()
+        assert load_state(path)["devices"]["Spotlight Plug"]["desired"]["action"] == "turn_off"
+
+    def test_transient_actions_not_persisted(self, tmp_path):
+        store = StateStore(str(tmp_path / "state.json"))
+        store.set_desired("recording_light", "set_level", {"level": 80})
+        assert store.snapshot()["devices"] == {}
+
+    def test_file_always_complete(self, tmp_path):
+        path = str(tmp_path / "state.json")
+        store = StateStore(path)
+        store.set_recording(True)
+        store.flush()
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            while not stop.is_set():
+                try:
+                    with open(path) as f:
+                        json.load(f)
+                except ValueError as e:
+                    errors.append(e)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        for i in range(50):
+            store.set_desired(f"device {i % 10}", "turn_on", {"hex_color": "#ff3729"})
+            store.flush()
+        stop.set()
+        reader.join()
+        assert not errors
+
+    def test_load_state(self, tmp_path):
+        path = str(tmp_path / "state.json")
+        assert load_state(path) is None
+        with open(path, "w") as f:
+            f.write('{"recording": tr')
+        assert load_state(path) is None
+        store = StateStore(path)
+        store.set_recording(True)
+        store.flush()
+        assert load_state(path)["recording"] is True
+        assert load_state(path, max_age=-1) is None
+        with open(path, "w") as f:
+            json.dump({"version": VERSION + 1, "saved_at": time.time()}, f)
+        assert load_state(path) is None
+
+    def test_sequence_continues_after_restart(self, tmp_path):
+        store = StateStore(str(tmp_path / "state.json"))
+        store.set_desired("Spotlight Plug", "turn_on", {})
+        store.set_desired("Sunset Plug", "turn_on", {})
+        restarted = StateStore(store.path, state=store.snapshot())
+        restarted.set_desired("Spotlight Plug", "turn_off", {})
+        devices = restarted.snapshot()["devices"]
+        assert devices["Spotlight Plug"]["desired"]["seq"] > devices["Sunset Plug"]["desired"]["seq"]
+
+
+class TestStateRestore:
+    def setup_method(self, method):
+        logger.disable("server")
+        self.simulator = DirigeraHubSimulator(latency=0.1).start()
+        self.hub = self.simulator.make_hub()
+        self.hub_client = self.simulator.make_client()
+        self.light = StateLightController()
+        self.beat_scheduler = SimpleNamespace(muted=False)
+
+    def teardown_method(self, method):
+        logger.enable("server")
+        self.simulator.stop()
+
+    def make_dispatcher(self, tmp_path) -> DeviceDispatcher:
+        self.store = StateStore(str(tmp_path / "state.json"))
+        return DeviceDispatcher(AsyncWorker(), state_store=self.store)
+
+    def test_dispatcher_records_desired_and_confirmed(self, tmp_path):
+        self.simulator.add_outlet("Spotlight Plug")
+        plug = DirigeraPlugController("Spotlight Plug", dirigera_hub=self.hub, hub_client=self.hub_client)
+        dispatcher = self.make_dispatcher(tmp_path)
+        self.simulator.outage = "refuse"
+        dispatcher.dispatch(plug, "turn_on").result(timeout=5)
+        entry = self.store.snapshot()["devices"]["Spotlight Plug"]
+        assert entry["desired"]["action"] == "turn_on"
+        assert entry["confirmed"] is None
+        self.simulator.outage = None
+        dispatcher.dispatch(plug, "turn_on").result(timeout=5)
+        assert self.store.snapshot()["devices"]["Spotlight Plug"]["confirmed"] == {"action": "turn_on", "kwargs": {}}
+
+    def test_recording_flag(self, tmp_path):
+        dispatcher = self.make_dispatcher(tmp_path)
+        process = server.create_midi_table(server.DEFAULT_SERVER_CONFIG, {}, dispatcher, light_controller=self.light)
+        process(RECORD_START)
+        assert self.store.snapshot()["recording"] is True
+        process(RECORD_STOP)
+        assert self.store.snapshot()["recording"] is False
+
+    def test_devices_restored_concurrently(self, tmp_path):
+        names = [f"Plug {i}" for i in range(4)]
+        plug_ids = [self.simulator.add_outlet(name) for name in names]
+        controllers = {
+                name: DirigeraPlugController(name, dirigera_hub=self.hub, hub_client=self.hub_client)
+                for name in names
+                }
+        state = {"recording": True, "devices": {
+                name: {"desired": {"action": "turn_on", "kwargs": {}, "seq": i + 1}, "confirmed": None}
+                for i, name in enumerate(names)
+                }}
+        dispatcher = self.make_dispatcher(tmp_path)
+        restore_s = server.restore_state(state, dispatcher, self.light, controllers, self.beat_scheduler)
+        assert all(self.simulator.devices[plug_id]["attributes"]["isOn"] for plug_id in plug_ids)
+        assert self.light.on
+        assert self.beat_scheduler.muted
+        # One hub round trip for all the devices, not one per device
+        assert restore_s < 2 * self.simulator.latency
+        assert self.store.snapshot()["recording"] is True
+
+    def test_scene_then_newer_device_commands(self, tmp_path):
+        light_id = self.simulator.add_light("recording_light")
+        plug_id = self.simulator.add_outlet("Spotlight Plug")
+        self.simulator.add_scene("Studio play", {
+            light_id: {"isOn": True, "lightLevel": 27},
+            plug_id: {"isOn": True},
+            })
+        light = DirigeraLightController("recording_light", dirigera_hub=self.hub, hub_client=self.hub_client)
+        plug = DirigeraPlugController("Spotlight Plug", dirigera_hub=self.hub, hub_client=self.hub_client)
+        scene = DirigeraSceneController("Studio play", [light, plug], dirigera_hub=self.hub, hub_client=self.hub_client)
+        state = {"recording": False, "devices": {
+                "recording_light": {"desired": {"action": "turn_on", "kwargs": {"hex_color": "#ff3729"}, "seq": 1}, "confirmed": None},
+                "Studio play": {"desired": {"action": "turn_on", "kwargs": {}, "seq": 2}, "confirmed": None},
+                "Spotlight Plug": {"desired": {"action": "turn_off", "kwargs": {}, "seq": 3}, "confirmed": None},
+                }}
+        n_requests = len(self.simulator.requests)
+        server.restore_state(
+                state,
+                self.make_dispatcher(tmp_path),
+                self.light,
+                {"rgb_light": light, "spotlight": plug, ms.MidiActions.PLAY: scene},
+                self.beat_scheduler,
+                )
+        # The light command is older than the scene: not sent
+        assert [request[1:] for request in self.simulator.requests[n_requests:]] == [
+                ("POST", f"/v1/scenes/{scene.scene_id}/trigger"),
+                ("PATCH", f"/v1/devices/{plug_id}"),
+                ]
+        assert self.simulator.devices[light_id]["attributes"]["lightLevel"] == 27
+        assert self.simulator.devices[plug_id]["attributes"]["isOn"] is False
+        assert not self.light.on
+        assert not self.beat_scheduler.muted
+
+    def test_state_saved_at_shutdown(self, tmp_path):
+        light_id = self.simulator.add_light("recording_light")
+        plug_id = self.simulator.add_outlet("Spotlight Plug")
+        self.simulator.add_scene("Studio play", {plug_id: {"isOn": True}})
+        light = DirigeraLightController("recording_light", dirigera_hub=self.hub, hub_client=self.hub_client)
+        plug = DirigeraPlugController("Spotlight Plug", dirigera_hub=self.hub, hub_client=self.hub_client)
+        scene = DirigeraSceneController("Studio play", [light, plug], dirigera_hub=self.hub, hub_client=self.hub_client)
+        controllers = {"rgb_light": light, "spotlight": plug, ms.MidiActions.PLAY: scene}
+        dispatcher = self.make_dispatcher(tmp_path)
+        dispatcher.dispatch(scene, "turn_on").result(timeout=5)
+        # As on shutdown: every controller turned off, the scenes last
+        for controller in controllers.values():
+            dispatcher.turn_off(controller).result(timeout=5)
+        state = self.store.snapshot()
+        assert state["devices"]["Studio play"]["desired"]["action"] == "turn_off"
+
+        # Eg switched on by hand while the server was down, and read by the controllers of the restarted server
+        self.simulator.devices[plug_id]["attributes"]["isOn"] = True
+        plug.plug.attributes.is_on = True
+        server.restore_state(state, self.make_dispatcher(tmp_path), self.light, controllers)
+        assert self.simulator.devices[plug_id]["attributes"]["isOn"] is False
+
+    def test_unknown_devices_skipped(self, tmp_path):
+        state = {"recording": False, "devices": {
+                "Removed Plug": {"desired": {"action": "turn_on", "kwargs": {}, "seq": 1}, "confirmed": None},
+                }}
+        server.restore_state(state, self.make_dispatcher(tmp_path), self.light, {"spotlight": None})
+        assert self.store.snapshot()["devices"] == {}
@@ -0,0 +1,100 @@
+import sys
+import random
+import threading
+
+sys.path.append("..")
+import midi_states as ms
+from AsyncWorker import AsyncWorker
+from BeatScheduler import BeatScheduler
+from TempoTracker import TempoTracker, PULSES_PER_QUARTER_NOTE
+
+
+def clock_stream(bpm:float, beats:int, start:float=0.0, jitter_s:float=0.002, seed:int=0) -> list[float]:
+    """
+    Synthetic MIDI clock pulse times, each pulse off by up to jitter_s
+    """
+    rng = random.Random(seed)
+    period = 60.0 / bpm / PULSES_PER_QUARTER_NOTE
+    return [start + i * period + rng.uniform(-jitter_s, jitter_s) for i in range(beats * PULSES_PER_QUARTER_NOTE)]
+
+
+class TestTempoTracker:
+    def feed(self, tracker:TempoTracker, pulse_times:list[float]) -> list:
+        updates = []
+        for timestamp in pulse_times:
+            update = tracker.process(ms.TIMING_CLOCK, timestamp)
+            if update:
+                updates.append((timestamp, update))
+        return updates
+
+    def test_estimates_bpm_with_jitter(self):
+        tracker = TempoTracker()
+        tracker.process(ms.START, 0.0)
+        updates = self.feed(tracker, clock_stream(120, beats=32))
+        assert abs(tracker.bpm - 120) < 0.5
+        # 768 clock pulses in, only a handful of updates out
+        assert 1 <= len(updates) <= 5
+        assert updates[-1][1][1] == 1
+
+    def test_phase_is_time_since_beat(self):
+        tracker = TempoTracker()
+        tracker.process(ms.START, 0.0)
+        pulse_times = clock_stream(120, beats=8, jitter_s=0.0)
+        updates = self.feed(tracker, pulse_times)
+        for timestamp, (bpm, playing, phase_s) in updates:
+            # Beats at multiples of 0.5 s from the first pulse
+            assert abs((timestamp - phase_s) % 0.5) < 0.002 or abs((timestamp - phase_s) % 0.5 - 0.5) < 0.002
+
+    def test_tempo_change_sends_update(self):
+        tracker = TempoTracker()
+        tracker.process(ms.START, 0.0)
+        first = clock_stream(120, beats=16)
+        self.feed(tracker, first)
+        updates = self.feed(tracker, clock_stream(140, beats=16, start=first[-1] + 60 / 120 / 24, seed=1))
+        assert updates
+        assert abs(updates[-1][1][0] - 140) < 0.5
+
+    def test_stop_and_continue(self):
+        tracker = TempoTracker()
+        tracker.process(ms.START, 0.0)
+        pulse_times = clock_stream(100, beats=8)
+        self.feed(tracker, pulse_times)
+        assert tracker.process(ms.STOP, pulse_times[-1])[1] == 0
+        assert tracker.process(ms.CONTINUE, pulse_times[-1] + 1)[1] == 1
+
+    def test_no_update_before_first_beat(self):
+        tracker = TempoTracker()
+        assert tracker.process(ms.START, 0.0) is None
+        assert self.feed(tracker, clock_stream(120, beats=1)[:-1]) == []
+
+
+class TestBeatScheduler:
+    def test_beats_follow_tempo(self):
+        async_worker = AsyncWorker()
+        beat_times = []
+        done = threading.Event()
+
+        def on_beat(beat):
+            beat_times.append(async_worker.timers.time())
+            if beat == 4:
+                done.set()
+
+        beat_scheduler = BeatScheduler(async_worker, on_beat)
+        now = async_worker.timers.time()
+        beat_scheduler.update(bpm=600, playing=True, phase_s=0.05) # Beat every 0.1 s, last one 50 ms ago
+        assert done.wait(timeout=2)
+        beat_scheduler.stop()
+
+        for i, beat_time in enumerate(beat_times[:5]):
+            assert abs(beat_time - (now + 0.05 + i * 0.1)) < 0.03
+
+    def test_muted_and_stopped(self):
+        async_worker = AsyncWorker()
+        beats = []
+        beat_scheduler = BeatScheduler(async_worker, beats.append)
+        beat_scheduler.muted = True
+        beat_scheduler.update(bpm=1200, playing=True, phase_s=0)
+        threading.Event().wait(0.2)
+        assert beats == []
+        beat_scheduler.stop()
+        assert len(async_worker.timers) == 0
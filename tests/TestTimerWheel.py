@@ -0,0 +1,214 @@
+import sys
+import time
+import threading
+
+sys.path.append("..")
+import server
+from AsyncWorker import AsyncWorker
+from DeviceDispatcher import DeviceDispatcher
+from TimerWheel import TimerWheel
+from ServerConfig import ServerConfig, DEFAULT_CONFIG
+from devices.DummyLightController import DummyLightController
+
+
+PLAY = [16, 106, 127]
+STOP = [16, 105, 127]
+# Sunset lights off some time after stop, unless play comes first
+DELAYED_OFF_CONFIG = ServerConfig({
+    **DEFAULT_CONFIG,
+    "scenes": {"play": {"sunset_lights": "on"}, "stop": {"sunset_lights": "on"}},
+    "delayed_scenes": {"stop": {"after_s": 0.05, "sunset_lights": "off"}},
+    })
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingLightController(DummyLightController):
+    def __init__(self):
+        self.actions = []
+        self.done = threading.Event()
+
+    def turn_on(self, hex_color:str|None=None):
+        self.actions.append("turn_on")
+
+    def turn_off(self):
+        self.actions.append("turn_off")
+        self.done.set()
+
+
+class TestTimerWheel:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=0.01, slots=8, clock=self.clock)
+        self.fired = []
+
+    def test_fires_at_deadline(self):
+        self.wheel.call_later(0.05, self.fired.append, "a")
+        self.clock.now = 0.04
+        assert self.wheel.advance() == 0
+        self.clock.now = 0.05
+        assert self.wheel.advance() == 1
+        assert self.fired == ["a"]
+        assert len(self.wheel) == 0
+
+    def test_timers_beyond_one_turn(self):
+        # 8 slots of 10 ms: 0.25 s is more than 3 turns away
+        self.wheel.call_later(0.25, self.fired.append, "far")
+        self.wheel.call_later(0.01, self.fired.append, "near")
+        for i in range(1, 30):
+            self.clock.now = i * 0.01
+            self.wheel.advance()
+        assert self.fired == ["near", "far"]
+
+    def test_large_jump_fires_in_deadline_order(self):
+        for delay in [0.3, 0.1, 0.2]:
+            self.wheel.call_later(delay, self.fired.append, delay)
+        self.clock.now = 10.0
+        assert self.wheel.advance() == 3
+        assert self.fired == [0.1, 0.2, 0.3]
+
+    def test_cancel(self):
+        handles = [self.wheel.call_later(i * 0.01, self.fired.append, i) for i in range(1000)]
+        for handle in handles[::2]:
+            handle.cancel()
+            handle.cancel()
+        assert len(self.wheel) == 500
+        self.clock.now = 20.0
+        self.wheel.advance()
+        assert self.fired == list(range(1, 1000, 2))
+
+    def test_call_every(self):
+        handle = self.wheel.call_every(0.1, self.fired.append, "beat")
+        for i in range(1, 36):
+            self.clock.now = i * 0.01
+            self.wheel.advance()
+        assert self.fired == ["beat"] * 3
+        handle.cancel()
+        self.clock.now = 1.0
+        self.wheel.advance()
+        assert self.fired == ["beat"] * 3
+        assert len(self.wheel) == 0
+
+    def test_failing_callback_does_not_stop_others(self):
+        self.wheel.call_later(0.01, lambda: 1 / 0)
+        self.wheel.call_later(0.01, self.fired.append, "a")
+        self.clock.now = 0.01
+        assert self.wheel.advance() == 2
+        assert self.fired == ["a"]
+
+    def test_cancelled_by_earlier_due_timer(self):
+        # Both due on the same advance: the first one cancels the second before it runs
+        second = self.wheel.call_later(0.02, self.fired.append, "second")
+        self.wheel.call_later(0.01, second.cancel)
+        self.clock.now = 0.02
+        assert self.wheel.advance() == 1
+        assert self.fired == []
+        assert len(self.wheel) == 0
+
+    def test_next_deadline(self):
+        assert self.wheel.next_deadline() is None
+        far = self.wheel.call_later(0.25, self.fired.append, "far") # Beyond one turn
+        assert abs(self.wheel.next_deadline() - 0.25) < 1e-9
+        self.wheel.call_later(0.03, self.fired.append, "near")
+        assert abs(self.wheel.next_deadline() - 0.03) < 1e-9
+        self.clock.now = 0.03
+        self.wheel.advance()
+        far.cancel()
+        assert self.wheel.next_deadline() is None
+
+
+class TestAsyncWorkerTimers:
+    def test_call_later_runs_on_loop(self):
+        async_worker = AsyncWorker()
+        fired = threading.Event()
+        async_worker.call_later(0.02, fired.set)
+        assert fired.wait(timeout=1)
+
+    def test_newer_action_cancels_delayed_action(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        light = RecordingLightController()
+        dispatcher.dispatch_later(0.05, light, "turn_on")
+        dispatcher.dispatch_later(0.05, light, "turn_off")
+        assert light.done.wait(timeout=1)
+        assert light.actions == ["turn_off"]
+        assert len(dispatcher.async_worker.timers) == 0
+
+    def test_loop_sleeps_until_deadline(self):
+        async_worker = AsyncWorker()
+        fired = threading.Event()
+        ticks = []
+        advance = async_worker.timers.advance
+        async_worker.timers.advance = lambda *args: ticks.append(1) or advance(*args)
+        async_worker.call_every(0.2, lambda: None)
+        async_worker.call_later(0.05, fired.set) # Earlier than the pending wake up
+        assert fired.wait(timeout=1)
+        time.sleep(0.5)
+        # Not one wake up every 10 ms tick: only when a timer is due
+        assert len(ticks) <= 6
+
+    def test_timers_survive_failing_callback(self):
+        async_worker = AsyncWorker()
+        fired = threading.Event()
+        async_worker.call_later(0.01, lambda: 1 / 0)
+        async_worker.call_later(0.01, fired.set)
+        assert fired.wait(timeout=1)
+        fired.clear()
+        async_worker.call_later(0.02, fired.set)
+        assert fired.wait(timeout=1)
+
+    def test_firing_timer_keeps_newer_delayed_action(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        light = RecordingLightController()
+        key = id(light)
+        dispatcher.dispatch_later(10, light, "turn_on")
+        first = dispatcher._pending_timers[key]
+        first[0].cancel() # As if it had fired just as a newer dispatch_later came in
+        dispatcher.dispatch_later(0.05, light, "turn_off")
+        # The first timer's callback runs: it must not run, drop, nor cancel the newer timer
+        dispatcher._run_delayed(key, light, "turn_on", first[1])
+        assert key in dispatcher._pending_timers
+        assert light.done.wait(timeout=1)
+        assert light.actions == ["turn_off"]
+
+    def test_firing_timer_after_newer_dispatch(self):
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        light = RecordingLightController()
+        dispatcher.dispatch_later(10, light, "turn_off")
+        handle, kwargs = dispatcher._pending_timers[id(light)]
+        handle.cancel() # As if it had fired just as the newer dispatch came in
+        dispatcher.dispatch(light, "turn_on")
+        dispatcher._run_delayed(id(light), light, "turn_off", kwargs) # Inline light: runs the action right away, if at all
+        assert light.actions == ["turn_on"]
+
+    def test_delayed_scene(self):
+        light = RecordingLightController()
+        process = server.create_midi_table(
+                DELAYED_OFF_CONFIG,
+                {"sunset_lights": light},
+                DeviceDispatcher(AsyncWorker()),
+                light_controller=DummyLightController(server.GPIO_PIN),
+                )
+        process(STOP)
+        assert light.done.wait(timeout=1)
+        assert light.actions == ["turn_on", "turn_off"]
+
+    def test_newer_action_cancels_delayed_scene(self):
+        light = RecordingLightController()
+        dispatcher = DeviceDispatcher(AsyncWorker())
+        process = server.create_midi_table(
+                DELAYED_OFF_CONFIG,
+                {"sunset_lights": light},
+                dispatcher,
+                light_controller=DummyLightController(server.GPIO_PIN),
+                )
+        process(STOP)
+        process(PLAY)
+        time.sleep(0.15)
+        assert light.actions == ["turn_on", "turn_on"]
+        assert len(dispatcher.async_worker.timers) == 0
@@ -0,0 +1,366 @@
+# Script to replay a recorded session, from an event journal or a MIDI file, to the OSC server.
+# Replays with the original timing, faster (--speed 2, 10, or 0 for as fast as possible), or only chosen actions.
+# Without --hostname, each speed is replayed against an in-process server with simulated Dirigera devices,
+# and the resulting device states and latencies are compared across runs.
+# --clients replays the session from several OSC clients at once, each with its own session on the server.
+#   python replay_session.py ../event_journal.bin --speed 1 10 0
+#   python replay_session.py ../event_journal.bin --speed 0 --clients 50
+# --hub_scenes stores the scenes of the config on the simulated hub, and triggers them instead of device commands.
+#   python replay_session.py session.mid --speed 1 --hub_scenes
+#   python replay_session.py session.mid --actions snare_on play stop --hostname rpi.local
+
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+import statistics
+
+from loguru import logger
+from pythonosc import udp_client, osc_server
+
+sys.path.append("..")
+import server
+import midi_states as ms
+import EventJournal as ej
+from AsyncWorker import AsyncWorker
+from LatencyStats import percentile
+from DeviceDispatcher import DeviceDispatcher
+from SessionManager import SessionManager
+from ServerConfig import ServerConfig
+from devices.DummyLightController import DummyLightController
+from devices.DirigeraHubSimulator import DirigeraHubSimulator
+from devices.DirigeraLightController import DirigeraLightController, hex_to_hsv
+from devices.DirigeraPlugController import DirigeraPlugController
+from devices.DirigeraSceneController import DirigeraSceneController
+
+
+DEFAULT_TEMPO = 500000 # Microseconds per quarter note, 120 BPM
+SETTLE_S = 1.0 # Time left to the devices to finish after the last message, before reading their state
+
+
+def read_varlen(data:bytes, pos:int) -> tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def read_midi_file(path:str) -> list[tuple[float, list]]:
+    """
+    Read the channel messages of a standard MIDI file, all tracks merged, following tempo changes
+    Args:
+        path: Str, path of the .mid file
+    Returns:
+        List of (seconds from the start, [status, data1, data2]), in time order
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"MThd":
+        raise ValueError(f"{path} is not a MIDI file")
+    header_length = struct.unpack(">I", data[4:8])[0]
+    _, n_tracks, division = struct.unpack(">HHH", data[8:14])
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+
+    events = [] # (tick, track order, tempo or MIDI message)
+    pos = 8 + header_length
+    for _ in range(n_tracks):
+        if data[pos:pos + 4] != b"MTrk":
+            raise ValueError(f"Expected a track at byte {pos}")
+        end = pos + 8 + struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        pos += 8
+        tick = 0
+        running_status = None
+        while pos < end:
+            delta, pos = read_varlen(data, pos)
+            tick += delta
+            byte = data[pos]
+            if byte == 0xFF:
+                meta_type = data[pos + 1]
+                length, pos = read_varlen(data, pos + 2)
+                if meta_type == 0x51:
+                    events.append((tick, len(events), int.from_bytes(data[pos:pos + 3], "big")))
+                pos += length
+            elif byte in (0xF0, 0xF7):
+                length, pos = read_varlen(data, pos + 1)
+                pos += length
+            else:
+                if byte & 0x80:
+                    running_status = byte
+                    pos += 1
+                n_data = 1 if running_status & 0xF0 in (0xC0, 0xD0) else 2
+                events.append((tick, len(events), [running_status, *data[pos:pos + n_data]]))
+                pos += n_data
+        pos = end
+
+    session = []
+    tempo = DEFAULT_TEMPO
+    seconds = 0.0
+    last_tick = 0
+    for tick, _, event in sorted(events):
+        seconds += (tick - last_tick) * tempo / 1e6 / division
+        last_tick = tick
+        if isinstance(event, int):
+            tempo = event
+        elif len(event) == 3:
+            session.append((seconds, event))
+    return session
+
+def read_journal_session(path:str) -> list[tuple[float, list]]:
+    """
+    Read the MIDI messages received in an event journal
+    Returns:
+        List of (seconds from the first message, [status, data1, data2]), in time order
+    """
+    entries = [entry for entry in ej.read_journal(path) if entry.kind == "midi"]
+    if not entries:
+        return []
+    start = entries[0].timestamp
+    return [(entry.timestamp - start, entry.midi_data) for entry in entries]
+
+def read_session(path:str) -> list[tuple[float, list]]:
+    if path.endswith((".mid", ".midi")):
+        return read_midi_file(path)
+    return read_journal_session(path)
+
+def filter_actions(session:list, actions:list[str]) -> list[tuple[float, list]]:
+    """
+    Keep the messages mapped to one of actions, eg ["play", "stop"]
+    """
+    return [(offset, midi_data) for offset, midi_data in session if (ms.get_midi_action(midi_data) or ms.MidiActions.UNKNOWN).value in actions]
+
+def replay(session:list, send, speed:float=1.0) -> list[float]:
+    """
+    Send the messages of a session at their original times divided by speed
+    Args:
+        session: List of (seconds from the start, [status, data1, data2])
+        send: Callable taking [status, data1, data2]
+        speed: Float, 1 for the original timing, 10 for 10x faster, 0 for as fast as possible
+    Returns:
+        List of floats, how late each message was sent compared to its scheduled time, in seconds
+    """
+    lateness = []
+    start = time.monotonic()
+    for offset, midi_data in session:
+        if speed:
+            scheduled = start + offset / speed
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lateness.append(time.monotonic() - scheduled)
+        send(midi_data)
+    return lateness
+
+def add_hub_scenes(simulator:DirigeraHubSimulator, config:ServerConfig) -> dict[ms.MidiActions, str]:
+    """
+    Store the scenes of a config on the simulated hub, setting the same device attributes as the device commands
+    Returns:
+        Dict, MidiActions -> name of its hub scene
+    """
+    device_ids = {device["attributes"]["customName"]: device_id for device_id, device in simulator.devices.items()}
+    hub_scenes = {}
+    for midi_action, commands in config.scenes.items():
+        device_attributes = {}
+        for role, action, kwargs in commands:
+            attributes = {"isOn": action == "turn_on"}
+            if kwargs.get("hex_color"):
+                hue, saturation, value = hex_to_hsv(kwargs["hex_color"])
+                attributes.update(colorHue=hue, colorSaturation=saturation / 100, lightLevel=value)
+            device_attributes[device_ids[config.devices[role]]] = attributes
+        hub_scenes[midi_action] = f"Studio {midi_action.value}"
+        simulator.add_scene(hub_scenes[midi_action], device_attributes)
+    return hub_scenes
+
+def run_against_simulator(
+        session:list,
+        speed:float,
+        hub_latency:float=0.02,
+        settle:float=SETTLE_S,
+        clients:int=1,
+        hub_scenes:bool=False,
+        ) -> dict:
+    """
+    Replay a session to an in-process server driving simulated Dirigera devices
+    Args:
+        session: List of (seconds from the start, [status, data1, data2])
+        speed: Float, see replay
+        hub_latency: Float, time in seconds the simulated hub takes to answer each request
+        settle: Float, time in seconds left to the devices after the last message
+        clients: Int, number of OSC clients replaying the session concurrently, each from its own address
+        hub_scenes: Bool, trigger scenes stored on the hub, one request per action, instead of one command per device
+    Returns:
+        Dict, report of the run: final device states, MIDI messages received, device action outcomes and latencies
+    """
+    simulator = DirigeraHubSimulator(latency=hub_latency).start()
+    simulator.add_light(server.DIRIGERA_LIGHT_NAME)
+    simulator.add_outlet("Sunset Lights")
+    simulator.add_outlet("Spotlight Plug")
+    hub = simulator.make_hub()
+    hub_client = simulator.make_client()
+
+    # Created empty, so that no other process can take the name. The journal initializes it
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as journal_file:
+        journal_path = journal_file.name
+    journal = ej.EventJournal(journal_path)
+    device_dispatcher = DeviceDispatcher(AsyncWorker(), journal=journal)
+    session_manager = SessionManager()
+    controllers = [
+        DirigeraLightController(server.DIRIGERA_LIGHT_NAME, dirigera_hub=hub, hub_client=hub_client),
+        DirigeraPlugController("Sunset Lights", dirigera_hub=hub, hub_client=hub_client),
+        DirigeraPlugController("Spotlight Plug", dirigera_hub=hub, hub_client=hub_client),
+        ]
+    scene_controllers = {}
+    if hub_scenes:
+        for midi_action, scene_name in add_hub_scenes(simulator, server.DEFAULT_SERVER_CONFIG).items():
+            scene_controllers[midi_action] = DirigeraSceneController(scene_name, controllers, dirigera_hub=hub, hub_client=hub_client)
+    dispatcher = server.create_osc_dispatcher(
+            device_dispatcher,
+            DummyLightController(server.GPIO_PIN),
+            rgb_light_controller=controllers[0],
+            sunset_lights_plug=controllers[1],
+            spotlight_plug=controllers[2],
+            journal=journal,
+            session_manager=session_manager,
+            hub_scenes=scene_controllers,
+            )
+    osc = osc_server.ThreadingOSCUDPServer(("127.0.0.1", 0), dispatcher)
+    threading.Thread(target=osc.serve_forever, daemon=True).start()
+
+    lateness = []
+
+    def replay_client():
+        client = udp_client.SimpleUDPClient(*osc.server_address)
+        lateness.extend(replay(session, lambda midi_data: client.send_message("/midi", midi_data), speed))
+
+    tic = time.monotonic()
+    threads = [threading.Thread(target=replay_client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - tic
+    time.sleep(settle)
+    osc.shutdown()
+    journal.close()
+
+    entries = ej.read_journal(journal_path)
+    os.remove(journal_path)
+    device_entries = [entry for entry in entries if entry.kind == "device"]
+    outcomes = {}
+    for entry in device_entries:
+        outcomes[entry.outcome] = outcomes.get(entry.outcome, 0) + 1
+    latencies = sorted(entry.latency for entry in device_entries if entry.outcome == "ok")
+    states = {
+        device["attributes"]["customName"]: {
+            attribute: device["attributes"][attribute]
+            for attribute in ("isOn", "lightLevel", "colorHue", "colorSaturation")
+            if attribute in device["attributes"]
+            }
+        for device in simulator.devices.values()
+        }
+    simulator.stop()
+    return {
+        "speed": speed,
+        "clients": clients,
+        "hub_scenes": hub_scenes,
+        "sessions": len(session_manager),
+        "sent": len(session) * clients,
+        "received": sum(1 for entry in entries if entry.kind == "midi"),
+        "duration_s": duration,
+        "max_late_ms": max(lateness, default=0.0) * 1e3,
+        "outcomes": outcomes,
+        "latency_p50_ms": statistics.median(latencies) * 1e3 if latencies else None,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1e3 if latencies else None,
+        "hub_requests": len(simulator.requests),
+        "states": states,
+        }
+
+def format_reports(reports:list[dict]) -> str:
+    """
+    One line per run, and the device states that differ from the first run
+    """
+    lines = []
+    for report in reports:
+        latency = "-" if report["latency_p50_ms"] is None else f"p50 {report['latency_p50_ms']:.1f} ms p99 {report['latency_p99_ms']:.1f} ms"
+        lines.append(
+                f"speed {report['speed'] or 'max':>4}, {report['clients']} clients{', hub scenes' if report['hub_scenes'] else ''}: "
+                f"{report['received']}/{report['sent']} received in {report['duration_s']:.2f}s, "
+                f"{report['hub_requests']} hub requests, device actions {report['outcomes']}, {latency}"
+                )
+        for name, state in report["states"].items():
+            reference = reports[0]["states"][name]
+            if state != reference:
+                lines.append(f"    {name} ended {state}, run 1 ended {reference}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("session", help="Event journal recorded by server.py, or a .mid file")
+    parser.add_argument(
+            "--speed",
+            type=float,
+            nargs="+",
+            default=[1.0],
+            help="Replay speeds, eg 1 10 0. 1 is the original timing, 0 is as fast as possible",
+            )
+    parser.add_argument(
+            "--actions",
+            nargs="+",
+            choices=[midi_action.value for midi_action in ms.MidiActions],
+            help="Only replay these actions",
+            )
+    parser.add_argument(
+            "--hostname",
+            default=None,
+            help="Replay to the server.py on this host instead of simulated devices, at the first speed",
+            )
+    parser.add_argument(
+            "--port",
+            type=int,
+            default=5005,
+            help="The port to send OSC messages to, with --hostname",
+            )
+    parser.add_argument(
+            "--clients",
+            type=int,
+            default=1,
+            help="Number of OSC clients replaying the session at once to the simulated devices",
+            )
+    parser.add_argument(
+            "--hub_scenes",
+            action="store_true",
+            help="Also replay with the scenes of the config stored on the simulated hub, to compare with device commands",
+            )
+    parser.add_argument(
+            "--hub_latency",
+            type=float,
+            default=0.02,
+            help="Time in seconds the simulated Dirigera hub takes to answer each request",
+            )
+    args = parser.parse_args()
+
+    session = read_session(args.session)
+    if args.actions:
+        session = filter_actions(session, args.actions)
+    logger.info(f"Replaying {len(session)} MIDI messages spanning {session[-1][0] if session else 0:.1f}s")
+
+    if args.hostname:
+        client = udp_client.SimpleUDPClient(socket.gethostbyname(args.hostname), args.port)
+        lateness = replay(session, lambda midi_data: client.send_message("/midi", midi_data), args.speed[0])
+        logger.info(f"Sent {len(session)} MIDI messages, at most {max(lateness, default=0.0) * 1e3:.1f} ms late")
+    else:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        reports = [
+            run_against_simulator(session, speed, hub_latency=args.hub_latency, clients=args.clients, hub_scenes=hub_scenes)
+            for hub_scenes in ([False, True] if args.hub_scenes else [False])
+            for speed in args.speed
+            ]
+        print(format_reports(reports))
@@ -0,0 +1,59 @@
+# Script to profile a running server.py and read its live counters, over its OSC debug channel
+# server.py must be started with --debug_channel, eg --debug_channel /debug
+# Eg profile 30 s of a session lagging on the Pi:
+#   python send_debug_cmd.py --hostname rpi.local profile/start
+#   python send_debug_cmd.py --hostname rpi.local profile/stop
+# The folded stacks file is written on the Pi, next to server.py
+
+import sys
+import json
+import socket
+import argparse
+
+from loguru import logger
+
+sys.path.append("..")
+from DebugChannel import debug_request, DEBUG_CHANNEL, PROFILE_INTERVAL_S
+
+COMMANDS = ["profile/start", "profile/stop", "stats", "tasks"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+            "command",
+            choices=COMMANDS,
+            help="Debug request to send",
+            )
+    parser.add_argument(
+            "--hostname",
+            default="rpi.local",
+            help="The hostname of the instance running server.py. Use 'localhost' if testing locally",
+            )
+    parser.add_argument(
+            "--port",
+            type=int,
+            default=5005,
+            help="The port server.py listens on",
+            )
+    parser.add_argument(
+            "--debug_channel",
+            default=DEBUG_CHANNEL,
+            help="The --debug_channel of server.py",
+            )
+    parser.add_argument(
+            "--interval",
+            type=float,
+            default=PROFILE_INTERVAL_S,
+            help="Seconds between two samples of the profiler, for profile/start",
+            )
+    args = parser.parse_args()
+
+    rpi_ip = socket.gethostbyname(args.hostname)
+    request_args = [args.interval] if args.command == "profile/start" else []
+    try:
+        reply = debug_request(rpi_ip, args.port, f"{args.debug_channel}/{args.command}", *request_args)
+    except socket.timeout:
+        logger.error(f"No reply from {args.hostname}:{args.port}, is server.py running with --debug_channel {args.debug_channel}?")
+        sys.exit(1)
+    print(json.dumps(reply, indent=2))